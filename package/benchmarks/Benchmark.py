@@ -0,0 +1,575 @@
+'''
+Benchmark.py
+this code is designed for benchmarking vivaldi_a on synthetic grids
+so that the speed and memory use of releases can be tracked over time
+(1) Synthetic FV grids (1, 0.25, 0.1 degree) and cubed-sphere SCRIP meshes
+    (ne30, ne120, and ne30 with a refined patch), generated offline
+(2) Timings and peak memory of Calc_Emis_T, Regridding (weight application),
+    and Plot_2D (SE setup), saved as JSON
+
+usage:
+    python Benchmark.py --out bench_vivaldi_a.json
+    python Benchmark.py --quick --out bench_quick.json
+    python Benchmark.py --out bench_new.json --baseline bench_old.json --threshold 1.2
+
+MODIFICATION HISTORY:
+    vivaldi_a contributors, 17, OCT, 2026: VERSION 1.00
+    - Initial version
+'''
+
+### Module import ###
+import numpy as np
+import xarray as xr
+import datetime
+import time
+import tracemalloc
+import platform
+import subprocess
+import argparse
+import tempfile
+import json
+import sys
+import os
+
+# modules of vivaldi_a are imported in the same way as they import each other
+package_dir = os.path.join( os.path.dirname( os.path.abspath(__file__) ), '..', 'vivaldi_a' )
+sys.path.insert( 0, os.path.join( package_dir, 'analysis' ) )
+sys.path.insert( 0, os.path.join( package_dir, 'plot' ) )
+
+from Calc_Emis import Calc_Emis_T
+
+
+# ========================================================================
+# ============================ Synthetic grids ===========================
+# ========================================================================
+# grids of the benchmark suite: FV resolution in degrees, SE number of elements
+FV_grids = { 'FV_1deg':1., 'FV_0.25deg':0.25, 'FV_0.1deg':0.1 }
+SE_grids = { 'ne30':{'ne':30}, 'ne120':{'ne':120},
+             'ne30_refined':{'ne':30, 'refine':4, 'patch':[[235.,295.],[25.,50.]]} }
+# grids skipped in the quick mode
+large_grids = [ 'FV_0.1deg', 'ne120' ]
+
+
+def make_FV_grid(res):
+    '''
+    Centers and bounds (n x 2) of a global lat/lon grid with res degree resolution
+    '''
+    nlat = int( round( 180. / res ) )
+    nlon = int( round( 360. / res ) )
+    lat_edges = np.linspace( -90., 90., nlat+1 )
+    lon_edges = np.linspace( 0., 360., nlon+1 )
+    lat_bnds = np.stack( [ lat_edges[:-1], lat_edges[1:] ], axis=1 )
+    lon_bnds = np.stack( [ lon_edges[:-1], lon_edges[1:] ], axis=1 )
+
+    return np.mean( lat_bnds, axis=1 ), np.mean( lon_bnds, axis=1 ), lat_bnds, lon_bnds
+
+
+def write_FV_grid_file(res, filename):
+    '''
+    Grid file (GRIDSPEC) with lat/lon bounds for mass conserving regridding
+    '''
+    lat, lon, lat_bnds, lon_bnds = make_FV_grid( res )
+    ds = xr.Dataset( { 'lat_bnds':( ('lat','bound'), lat_bnds ),
+                       'lon_bnds':( ('lon','bound'), lon_bnds ) },
+                     coords={ 'lat':( 'lat', lat, {'units':'degrees_north', 'bounds':'lat_bnds'} ),
+                              'lon':( 'lon', lon, {'units':'degrees_east', 'bounds':'lon_bnds'} ) } )
+    ds.to_netcdf( filename )
+
+
+def cube_to_sphere(face, alpha, beta):
+    '''
+    Unit vectors of equiangular cubed-sphere coordinates (alpha, beta in radians)
+    on each face (0-3 around the equator, 4 north, 5 south)
+    '''
+    x = np.tan( alpha )
+    y = np.tan( beta )
+    one = np.ones( np.shape(x) )
+    face_xyz = [ ( one, x, y ), ( -x, one, y ), ( -one, -x, y ),
+                 ( x, -one, y ), ( -y, x, one ), ( y, x, -one ) ]
+
+    xyz = np.zeros( np.shape(x) + (3,) )
+    for fi, ( fx, fy, fz ) in enumerate( face_xyz ):
+        on_face = face == fi
+        xyz[on_face] = np.stack( [ fx[on_face], fy[on_face], fz[on_face] ], axis=-1 )
+
+    return xyz / np.linalg.norm( xyz, axis=-1, keepdims=True )
+
+
+def triangle_area(a, b, c):
+    '''
+    Area (radians^2) of spherical triangles of unit vectors (..., 3)
+    '''
+    triple = np.abs( np.sum( a * np.cross( b, c ), axis=-1 ) )
+    denom = 1. + np.sum( a * b, axis=-1 ) + np.sum( b * c, axis=-1 ) + np.sum( c * a, axis=-1 )
+
+    return 2. * np.arctan2( triple, denom )
+
+
+def make_cubed_sphere(ne, refine=1, patch=None):
+    '''
+    NAME:
+           make_cubed_sphere
+
+    PURPOSE:
+           Cells of a synthetic equiangular cubed-sphere mesh with 3 x 3 cells per element
+           (6 x (3 ne)^2 cells, similar to ne30np4 and ne120np4 physics columns),
+           optionally with cells in a lon/lat patch refined into refine x refine cells,
+           as a regional refinement mesh
+
+    INPUTS:
+           ne: number of elements along each edge of a cube face
+           refine: refinement factor of cells in the patch
+           patch: [lon_range, lat_range] of the refined region (0~360 longitudes)
+
+    OUTPUTS:
+           center_lon, center_lat (ncol), corner_lon, corner_lat (ncol x 4),
+           area (ncol, radians^2)
+    '''
+    ncell = 3 * ne
+    edges = np.linspace( -np.pi/4., np.pi/4., ncell+1 )
+    face, ai, bi = np.meshgrid( np.arange(6), np.arange(ncell), np.arange(ncell), indexing='ij' )
+    face = np.ravel( face )
+    alpha0 = edges[np.ravel(ai)]
+    alpha1 = edges[np.ravel(ai)+1]
+    beta0 = edges[np.ravel(bi)]
+    beta1 = edges[np.ravel(bi)+1]
+
+    if ( refine > 1 ) & ( patch != None ):
+        center = cube_to_sphere( face, ( alpha0 + alpha1 ) / 2., ( beta0 + beta1 ) / 2. )
+        center_lon = np.degrees( np.arctan2( center[:,1], center[:,0] ) ) % 360.
+        center_lat = np.degrees( np.arcsin( center[:,2] ) )
+        in_patch = ( center_lon >= patch[0][0] ) & ( center_lon <= patch[0][1] ) & \
+                   ( center_lat >= patch[1][0] ) & ( center_lat <= patch[1][1] )
+
+        # refine x refine sub-cells of the cells in the patch
+        sub = np.arange( refine ) / refine
+        si, sj = np.meshgrid( sub, sub, indexing='ij' )
+        si = np.ravel( si )[np.newaxis,:]
+        sj = np.ravel( sj )[np.newaxis,:]
+        dalpha = ( alpha1 - alpha0 )[in_patch,np.newaxis]
+        dbeta = ( beta1 - beta0 )[in_patch,np.newaxis]
+        sub_alpha0 = alpha0[in_patch,np.newaxis] + si * dalpha
+        sub_beta0 = beta0[in_patch,np.newaxis] + sj * dbeta
+
+        face = np.append( face[~in_patch], np.repeat( face[in_patch], refine**2 ) )
+        alpha0 = np.append( alpha0[~in_patch], np.ravel( sub_alpha0 ) )
+        alpha1 = np.append( alpha1[~in_patch], np.ravel( sub_alpha0 + dalpha / refine ) )
+        beta0 = np.append( beta0[~in_patch], np.ravel( sub_beta0 ) )
+        beta1 = np.append( beta1[~in_patch], np.ravel( sub_beta0 + dbeta / refine ) )
+
+    corners = np.stack( [ cube_to_sphere( face, alpha0, beta0 ),
+                          cube_to_sphere( face, alpha1, beta0 ),
+                          cube_to_sphere( face, alpha1, beta1 ),
+                          cube_to_sphere( face, alpha0, beta1 ) ], axis=1 )
+    center = cube_to_sphere( face, ( alpha0 + alpha1 ) / 2., ( beta0 + beta1 ) / 2. )
+
+    # counterclockwise corners seen from outside of the sphere
+    normal = np.cross( corners[:,1] - corners[:,0], corners[:,2] - corners[:,0] )
+    clockwise = np.sum( normal * center, axis=-1 ) < 0
+    corners[clockwise] = corners[clockwise][:,::-1]
+
+    area = triangle_area( corners[:,0], corners[:,1], corners[:,2] ) + \
+           triangle_area( corners[:,0], corners[:,2], corners[:,3] )
+
+    def to_lonlat(xyz):
+        return ( np.degrees( np.arctan2( xyz[...,1], xyz[...,0] ) ) % 360.,
+                 np.degrees( np.arcsin( np.clip( xyz[...,2], -1., 1. ) ) ) )
+    center_lon, center_lat = to_lonlat( center )
+    corner_lon, corner_lat = to_lonlat( corners )
+
+    return center_lon, center_lat, corner_lon, corner_lat, area
+
+
+def write_SCRIP_file(filename, ne, refine=1, patch=None):
+    '''
+    SCRIP file of a synthetic cubed-sphere mesh (see make_cubed_sphere)
+    '''
+    center_lon, center_lat, corner_lon, corner_lat, area = \
+        make_cubed_sphere( ne, refine=refine, patch=patch )
+    ds = xr.Dataset( { 'grid_dims':( 'grid_rank', np.array( [len(center_lon)], dtype='i4' ) ),
+                       'grid_center_lat':( 'grid_size', center_lat, {'units':'degrees'} ),
+                       'grid_center_lon':( 'grid_size', center_lon, {'units':'degrees'} ),
+                       'grid_corner_lat':( ('grid_size','grid_corners'), corner_lat,
+                                           {'units':'degrees'} ),
+                       'grid_corner_lon':( ('grid_size','grid_corners'), corner_lon,
+                                           {'units':'degrees'} ),
+                       'grid_area':( 'grid_size', area, {'units':'radians^2'} ),
+                       'grid_imask':( 'grid_size', np.ones( len(center_lon), dtype='i4' ) ) } )
+    ds.to_netcdf( filename )
+
+
+def overlap_matrix_1D(src_edges, dst_edges, func=None):
+    '''
+    Sparse (dst x src) matrix of overlaps of 1-D cells divided by destination cell sizes,
+    cell sizes measured in func( edges ) (e.g., sine of latitudes for areas)
+    '''
+    from scipy import sparse
+
+    if func == None:
+        func = lambda edges: edges
+    merged = np.unique( np.concatenate( ( src_edges, dst_edges ) ) )
+    mid = ( merged[:-1] + merged[1:] ) / 2.
+    si = np.searchsorted( src_edges, mid ) - 1
+    di = np.searchsorted( dst_edges, mid ) - 1
+    length = np.diff( func( merged ) )
+    dst_length = np.diff( func( dst_edges ) )
+
+    return sparse.csr_matrix( ( length / dst_length[di], ( di, si ) ),
+                              shape=( len(dst_edges)-1, len(src_edges)-1 ) )
+
+
+def write_FV_weight_file(src_res, dst_res, filename):
+    '''
+    First-order conservative weights between global FV grids in the ESMF weight file 
+    format, calculated analytically (cell edges on latitude circles and meridians).
+    Used when ESMPy is not available to generate weights; ESMF treats cell edges 
+    as great circles, so its weights differ slightly
+    '''
+    from scipy import sparse
+    from netCDF4 import Dataset
+
+    src_lat, src_lon, src_lat_bnds, src_lon_bnds = make_FV_grid( src_res )
+    dst_lat, dst_lon, dst_lat_bnds, dst_lon_bnds = make_FV_grid( dst_res )
+    sin_lat = lambda edges: np.sin( np.radians( edges ) )
+    lat_weight = overlap_matrix_1D( np.append( src_lat_bnds[:,0], src_lat_bnds[-1,1] ),
+                                    np.append( dst_lat_bnds[:,0], dst_lat_bnds[-1,1] ),
+                                    func=sin_lat )
+    lon_weight = overlap_matrix_1D( np.append( src_lon_bnds[:,0], src_lon_bnds[-1,1] ),
+                                    np.append( dst_lon_bnds[:,0], dst_lon_bnds[-1,1] ) )
+    # C-order (lat, lon) sequence indices of the destination (row) and source (col)
+    weight = sparse.kron( lat_weight, lon_weight ).tocoo()
+
+    def cell_area(lat_bnds, lon_bnds):
+        return np.ravel( np.abs( np.diff( sin_lat( lat_bnds ), axis=1 ) ) * 
+                         np.radians( np.diff( lon_bnds, axis=1 ) ).T )
+
+    fid = Dataset( filename, 'w' )
+    fid.createDimension( 'n_a', weight.shape[1] )
+    fid.createDimension( 'n_b', weight.shape[0] )
+    fid.createDimension( 'n_s', weight.nnz )
+    fid.createVariable( 'S', 'f8', ('n_s',) )[:] = weight.data
+    fid.createVariable( 'row', 'i4', ('n_s',) )[:] = weight.row + 1
+    fid.createVariable( 'col', 'i4', ('n_s',) )[:] = weight.col + 1
+    fid.createVariable( 'area_a', 'f8', ('n_a',) )[:] = cell_area( src_lat_bnds, src_lon_bnds )
+    fid.createVariable( 'area_b', 'f8', ('n_b',) )[:] = cell_area( dst_lat_bnds, dst_lon_bnds )
+    fid.weights_from = 'analytic first-order conservative weights (Benchmark.py)'
+    fid.close()
+
+
+def grid_file(workdir, name):
+    '''
+    Grid file of a benchmark grid in workdir, generated once and reused
+    '''
+    if name in FV_grids:
+        filename = os.path.join( workdir, 'grid_' + name + '.nc' )
+        if not os.path.exists( filename ):
+            write_FV_grid_file( FV_grids[name], filename )
+    else:
+        filename = os.path.join( workdir, 'scrip_' + name + '.nc' )
+        if not os.path.exists( filename ):
+            write_SCRIP_file( filename, **SE_grids[name] )
+
+    return filename
+
+
+def synthetic_emissions(shape, seed=0):
+    '''
+    Positive float32 emissions (kg/m2/s) with a reproducible random field
+    '''
+    rng = np.random.default_rng( seed )
+    return ( rng.random( shape, dtype='f4' ) * 1e-10 ).astype( 'f4' )
+# ========================== END Synthetic grids =========================
+# ========================================================================
+
+
+# ========================================================================
+# ========================= Timing and peak memory =======================
+# ========================================================================
+def measure(func, repeat=3):
+    '''
+    Wall-clock times of repeat calls of func, and peak memory (MB) of one more call
+    traced by tracemalloc (numpy and Python allocations, not netCDF/HDF5 buffers)
+    '''
+    times = []
+    for ri in np.arange( repeat ):
+        start = time.perf_counter()
+        func()
+        times.append( time.perf_counter() - start )
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return { 'time_s':times, 'time_min_s':float( np.min(times) ),
+             'time_median_s':float( np.median(times) ), 'peak_memory_mb':peak / 2.**20 }
+
+
+def run_case(results, benchmark, case, grid, params, func, repeat=3, verbose=True):
+    '''
+    Measure a benchmark case and append the result,
+    a failed (or unavailable) case is recorded with the reason
+    '''
+    result = { 'benchmark':benchmark, 'case':case, 'grid':grid, 'params':params }
+    try:
+        result.update( measure( func, repeat=repeat ) )
+        result['status'] = 'ok'
+    except Exception as err:
+        result['status'] = 'failed'
+        result['reason'] = type(err).__name__ + ': ' + str(err)
+    results.append( result )
+
+    if verbose:
+        if result['status'] == 'ok':
+            print( '%-12s %-14s %-13s %9.3f s %10.1f MB' % ( benchmark, case, grid,
+                   result['time_min_s'], result['peak_memory_mb'] ) )
+        else:
+            print( '%-12s %-14s %-13s %s' % ( benchmark, case, grid, result['reason'] ) )
+
+
+def skip_case(results, benchmark, grid, reason, verbose=True):
+    results.append( { 'benchmark':benchmark, 'case':'all', 'grid':grid,
+                      'status':'skipped', 'reason':reason } )
+    if verbose:
+        print( '%-12s %-14s %-13s skipped: %s' % ( benchmark, 'all', grid, reason ) )
+# ======================= END Timing and peak memory =====================
+# ========================================================================
+
+
+# ========================================================================
+# ============================== Benchmarks ==============================
+# ========================================================================
+def bench_Calc_Emis_T(results, grids, workdir, ntime=12, repeat=3, verbose=True):
+    '''
+    Calc_Emis_T for global totals, a box, batch regions, zonal bands, and out-of-core mode
+    '''
+    regions = { 'EUS':[[-95,-75],[25,50]], 'EAS':[[100,150],[20,50]],
+                'PAC':[[170,-130],[-20,20]] }
+    time_values = np.arange( '2000-01', '2001-01', dtype='datetime64[M]' )[:ntime]
+    time_values = time_values.astype( 'datetime64[D]' ).astype( 'datetime64[ns]' ) \
+                  + np.timedelta64( 14, 'D' )
+
+    for grid in grids:
+        if grid in FV_grids:
+            lat, lon, lat_bnds, lon_bnds = make_FV_grid( FV_grids[grid] )
+            var = synthetic_emissions( (ntime, len(lat), len(lon)) )
+            kwargs = { 'dimension':['time','lat','lon'],
+                       'dim_var':{ 'time':time_values, 'lat':lat, 'lon':lon,
+                                   'lat_bnds':lat_bnds, 'lon_bnds':lon_bnds } }
+        else:
+            scrip_file = grid_file( workdir, grid )
+            ncol = xr.open_dataset( scrip_file ).sizes['grid_size']
+            var = synthetic_emissions( (ntime, ncol) )
+            kwargs = { 'dimension':['time','ncol'], 'scrip_file':scrip_file,
+                       'dim_var':{ 'time':time_values, 'ncol':np.arange(ncol) } }
+        kwargs.update( { 'unit':'kg/m2/s', 'mw':28., 'print_results':False,
+                         'ignore_warning':True } )
+
+        cases = { 'global':{},
+                  'box':{ 'lon_range':[100,150], 'lat_range':[20,50] },
+                  'regions':{ 'regions':regions },
+                  'zonal_5deg':{ 'zonal_bands':5. },
+                  'chunk_64mb':{ 'chunk_mb':64 } }
+        for case, case_kwargs in cases.items():
+            def func():
+                # dim_var is copied, Calc_Emis_T may shift longitudes in place
+                dim_var = { key:np.copy(value) for key, value in kwargs['dim_var'].items() }
+                Calc_Emis_T( var, **dict( kwargs, dim_var=dim_var ), **case_kwargs )
+            params = { 'shape':list( np.shape(var) ), 'dtype':str(var.dtype) }
+            params.update( { key:str(value) for key, value in case_kwargs.items() } )
+            run_case( results, 'Calc_Emis_T', case, grid, params, func,
+                      repeat=repeat, verbose=verbose )
+
+
+def bench_Regridding(results, grids, workdir, ntime=12, repeat=3, verbose=True):
+    '''
+    Regridding of FV 1 degree emissions to each grid with an existing weight file
+    (first-order conservative) by the sparse and ESMF engines,
+    weight generation is not timed. Without ESMPy, weights between FV grids are 
+    calculated analytically (write_FV_weight_file) and only the sparse engine is used
+    '''
+    import Regridding_ESMF
+    from Regridding_ESMF import Regridding
+
+    if Regridding_ESMF.ESMF == None:
+        engines = ['sparse']
+    else:
+        engines = ['sparse', 'ESMF']
+
+    src_grid = 'FV_1deg'
+    src_grid_file = grid_file( workdir, src_grid )
+    lat, lon, lat_bnds, lon_bnds = make_FV_grid( FV_grids[src_grid] )
+    var = synthetic_emissions( (ntime, len(lat), len(lon)) )
+    kwargs = { 'dimension':['time','lat','lon'],
+               'dim_var':{ 'time':np.arange(ntime), 'lat':lat, 'lon':lon },
+               'src_grid_file':src_grid_file, 'method':'Conserve', 'save_results':False,
+               'speed_up':False, 'creation_date':False, 'check_timings':False }
+
+    for grid in grids:
+        if grid == src_grid:
+            continue
+        dst_grid_file = grid_file( workdir, grid )
+        wgt_file = os.path.join( workdir, 'wgt_' + src_grid + '_to_' + grid + '.nc' )
+        if ( Regridding_ESMF.ESMF == None ) & ( grid not in FV_grids ):
+            skip_case( results, 'Regridding', grid, 'ESMPy is not available ' + \
+                       'to generate weights', verbose=verbose )
+            continue
+        try:
+            if Regridding_ESMF.ESMF == None:
+                wgt_file = wgt_file.replace( '.nc', '_analytic.nc' )
+                if not os.path.exists( wgt_file ):
+                    write_FV_weight_file( FV_grids[src_grid], FV_grids[grid], wgt_file )
+            elif not os.path.exists( wgt_file ):
+                Regridding( var, dst_grid_file=dst_grid_file, wgt_file=wgt_file,
+                            save_wgt_file=True, save_wgt_file_only=True, **kwargs )
+        except Exception as err:
+            skip_case( results, 'Regridding', grid, 'weight generation failed (' + \
+                       type(err).__name__ + ': ' + str(err) + ')', verbose=verbose )
+            continue
+
+        for engine in engines:
+            def func():
+                Regridding( var, dst_grid_file=dst_grid_file, wgt_file=wgt_file,
+                            engine=engine, **kwargs )
+            params = { 'src_grid':src_grid, 'shape':list( np.shape(var) ), 'method':'Conserve',
+                       'engine':engine }
+            run_case( results, 'Regridding', 'apply_weights_' + engine, grid, params, func,
+                      repeat=repeat, verbose=verbose )
+
+
+def bench_Plot_2D(results, grids, workdir, repeat=3, verbose=True):
+    '''
+    Plot_2D setup of SE meshes (vertices across the dateline and region selection),
+    without drawing the figure on screen
+    '''
+    try:
+        import matplotlib
+        matplotlib.use( 'Agg' )
+        import matplotlib.pyplot as plt
+        from Plot_2D import Plot_2D
+    except ImportError as err:
+        skip_case( results, 'Plot_2D', 'all', 'cartopy is not available (' + str(err) + ')',
+                   verbose=verbose )
+        return
+
+    for grid in grids:
+        if grid in FV_grids:
+            continue
+        scrip_file = grid_file( workdir, grid )
+        var = synthetic_emissions( xr.open_dataset( scrip_file ).sizes['grid_size'] )
+
+        cases = { 'global':{}, 'box':{ 'lon_range':[100,150], 'lat_range':[20,50] } }
+        for case, case_kwargs in cases.items():
+            def func():
+                Plot_2D( var, scrip_file=scrip_file, coast=False, country=False,
+                         colorbar=False, lonlat_info=False, **case_kwargs )
+                plt.close( 'all' )
+            params = { 'ncol':len(var) }
+            params.update( { key:str(value) for key, value in case_kwargs.items() } )
+            run_case( results, 'Plot_2D', case, grid, params, func,
+                      repeat=repeat, verbose=verbose )
+# ============================ END Benchmarks ============================
+# ========================================================================
+
+
+# ========================================================================
+# ======================== Results and regressions =======================
+# ========================================================================
+def machine_info():
+    '''
+    Software versions and machine information saved with the results
+    '''
+    import scipy
+    info = { 'created':datetime.datetime.now().isoformat( timespec='seconds' ),
+             'platform':platform.platform(), 'processor':platform.processor(),
+             'cpu_count':os.cpu_count(), 'python':platform.python_version(),
+             'numpy':np.__version__, 'xarray':xr.__version__, 'scipy':scipy.__version__ }
+    try:
+        info['git_commit'] = subprocess.check_output(
+                                 [ 'git', 'rev-parse', 'HEAD' ], cwd=package_dir,
+                                 stderr=subprocess.DEVNULL ).decode().strip()
+    except Exception:
+        info['git_commit'] = None
+
+    return info
+
+
+def compare_results(results, baseline, threshold=1.2, verbose=True):
+    '''
+    Cases slower (minimum time) or larger (peak memory) than the baseline
+    by more than threshold (ratio)
+    '''
+    base = { ( res['benchmark'], res['case'], res['grid'] ):res
+             for res in baseline['results'] if res['status'] == 'ok' }
+
+    regressions = []
+    for res in results:
+        key = ( res['benchmark'], res['case'], res['grid'] )
+        if ( res['status'] != 'ok' ) | ( key not in base ):
+            continue
+        for metric in [ 'time_min_s', 'peak_memory_mb' ]:
+            ratio = res[metric] / max( base[key][metric], 1e-12 )
+            if ratio > threshold:
+                regressions.append( { 'benchmark':key[0], 'case':key[1], 'grid':key[2],
+                                      'metric':metric, 'baseline':base[key][metric],
+                                      'value':res[metric], 'ratio':ratio } )
+                if verbose:
+                    print( 'Regression: ' + ' '.join(key) + ', ' + metric + \
+                           ' %.3f -> %.3f (x%.2f)' % ( base[key][metric], res[metric], ratio ) )
+
+    return regressions
+# ====================== END Results and regressions =====================
+# ========================================================================
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser( description='Benchmarks of vivaldi_a on synthetic grids' )
+    parser.add_argument( '--out', default='bench_vivaldi_a.json', help='JSON file for results' )
+    parser.add_argument( '--workdir', default=None,
+                         help='directory for synthetic grid and weight files (reused)' )
+    parser.add_argument( '--benchmarks', nargs='+', default=['Calc_Emis_T','Regridding','Plot_2D'] )
+    parser.add_argument( '--grids', nargs='+', default=list(FV_grids) + list(SE_grids) )
+    parser.add_argument( '--quick', action='store_true',
+                         help='skip the largest grids (' + ', '.join(large_grids) + ')' )
+    parser.add_argument( '--ntime', type=int, default=12, help='number of time steps' )
+    parser.add_argument( '--repeat', type=int, default=3, help='timed calls for each case' )
+    parser.add_argument( '--baseline', default=None, help='JSON results to compare with' )
+    parser.add_argument( '--threshold', type=float, default=1.2,
+                         help='ratio to the baseline reported as a regression' )
+    args = parser.parse_args( argv )
+
+    grids = [ grid for grid in args.grids if not ( args.quick & ( grid in large_grids ) ) ]
+    workdir = args.workdir
+    if workdir == None:
+        workdir = os.path.join( tempfile.gettempdir(), 'vivaldi_a_benchmark' )
+    os.makedirs( workdir, exist_ok=True )
+
+    results = []
+    if 'Calc_Emis_T' in args.benchmarks:
+        bench_Calc_Emis_T( results, grids, workdir, ntime=args.ntime, repeat=args.repeat )
+    if 'Regridding' in args.benchmarks:
+        bench_Regridding( results, grids, workdir, ntime=args.ntime, repeat=args.repeat )
+    if 'Plot_2D' in args.benchmarks:
+        bench_Plot_2D( results, grids, workdir, repeat=args.repeat )
+
+    output = { 'suite':'vivaldi_a', 'machine':machine_info(),
+               'settings':{ 'grids':grids, 'ntime':args.ntime, 'repeat':args.repeat },
+               'results':results }
+
+    if args.baseline != None:
+        with open( args.baseline ) as f:
+            baseline = json.load( f )
+        output['baseline'] = args.baseline
+        output['regressions'] = compare_results( results, baseline, threshold=args.threshold )
+
+    with open( args.out, 'w' ) as f:
+        json.dump( output, f, indent=1 )
+    print( 'Save benchmark results:', args.out )
+
+    if len( output.get( 'regressions', [] ) ) > 0:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
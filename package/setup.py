@@ -18,8 +18,10 @@ setup(
     keywords=['atmospheric chemistry', 'cesm', 'cam-chem', 'air quality', 'emission'],
     install_requires=[
         'numpy',
+        'scipy',
         'matplotlib',
         'xarray',
+        'pandas',
         'cartopy',
         'cftime',
         'ESMPy>=8.1.0',
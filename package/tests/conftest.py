@@ -0,0 +1,56 @@
+'''
+conftest.py
+modules of vivaldi_a are imported in the same way as they import each other,
+and synthetic emissions shared by the tests
+'''
+
+import sys
+import os
+
+import numpy as np
+import xarray as xr
+import pytest
+
+package_dir = os.path.join( os.path.dirname( os.path.abspath(__file__) ), '..', 'vivaldi_a' )
+sys.path.insert( 0, os.path.join( package_dir, 'analysis' ) )
+sys.path.insert( 0, os.path.join( package_dir, 'plot' ) )
+
+
+@pytest.fixture
+def emission():
+    '''
+    Monthly emissions (kg/m2/s) of 2000 on a 4 x 5 degree grid
+    '''
+    lat = np.arange( -88., 90., 4. )
+    lon = np.arange( 0., 360., 5. )
+    time = np.arange( '2000-01', '2001-01', dtype='datetime64[M]' ).astype( 'datetime64[ns]' ) \
+           + np.timedelta64( 14, 'D' )
+    rng = np.random.default_rng( 0 )
+    values = rng.random( (len(time), len(lat), len(lon)) ) * 1e-10
+    return xr.DataArray( values, dims=('time','lat','lon'), name='CO',
+                         coords={ 'time':time, 'lat':lat, 'lon':lon },
+                         attrs={ 'units':'kg/m2/s', 'molecular_weight':28. } )
+
+
+@pytest.fixture
+def expected_total():
+    '''
+    Emissions (kg) of each month of the emission fixture summed with numpy
+    '''
+    from Calc_Emis import calc_grid_area_FV
+
+    def total(emission, lon_range=None, lat_range=None):
+        lat = emission['lat'].values
+        lon = emission['lon'].values
+        area = calc_grid_area_FV( lat, lon )
+        mask = np.ones( np.shape(area), dtype=bool )
+        if lat_range != None:
+            mask &= ( (lat >= lat_range[0]) & (lat <= lat_range[1]) )[:,np.newaxis]
+        if lon_range != None:
+            # eastward from lon_range[0], also across the dateline (e.g., [170,-130])
+            if lon_range[1] - lon_range[0] < 360.:
+                width = ( lon_range[1] - lon_range[0] ) % 360.
+                mask &= ( ( lon - lon_range[0] ) % 360. <= width )[np.newaxis,:]
+        days = np.array( [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31] )
+        return np.sum( emission.values * area * mask, axis=(1,2) ) * days * 86400.
+    return total
@@ -0,0 +1,32 @@
+'''
+test_Calc_Emis.py
+Emission totals of the batched area-weighted contraction
+'''
+
+import numpy as np
+import pytest
+
+from Calc_Emis import Calc_Emis_T
+
+
+def test_calc_emis(emission, expected_total):
+    emis = Calc_Emis_T( emission, unit='kg/m2/s', print_results=False, ignore_warning=True )
+    np.testing.assert_allclose( emis.emissions_total, expected_total( emission ), rtol=1e-12 )
+
+
+def test_calc_emis_box(emission, expected_total):
+    emis = Calc_Emis_T( emission, unit='kg/m2/s', lon_range=[100,150], lat_range=[20,50],
+                        print_results=False, ignore_warning=True )
+    np.testing.assert_allclose( emis.emissions_total, 
+                                expected_total( emission, [100,150], [20,50] ), rtol=1e-12 )
+
+
+def test_calc_emis_vertical(emission):
+    # altitude layers of 1, 2, and 3 km (edges from midpoints)
+    var = emission.expand_dims( { 'altitude':[0.5, 2., 4.5] }, axis=1 ).copy()
+    var['altitude'].attrs['units'] = 'km'
+    emis = Calc_Emis_T( var, unit='kg/m3/s', print_results=False, ignore_warning=True )
+    emis_2d = Calc_Emis_T( emission, unit='kg/m2/s', print_results=False, ignore_warning=True )
+    np.testing.assert_allclose( emis.emissions_total_v, 
+                                emis_2d.emissions_total[:,np.newaxis] * [1e3, 2e3, 3e3], rtol=1e-12 )
+    np.testing.assert_allclose( emis.emissions_total, emis_2d.emissions_total * 6e3, rtol=1e-12 )
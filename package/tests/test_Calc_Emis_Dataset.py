@@ -0,0 +1,54 @@
+'''
+test_Calc_Emis_Dataset.py
+Multi-species totals with shared grid, time, and area information
+'''
+
+import os
+import numpy as np
+import pytest
+
+from Calc_Emis import Calc_Emis_T, Calc_Emis_T_Dataset
+
+
+@pytest.fixture
+def dataset(emission):
+    '''
+    Three species with different units and molecular weights
+    '''
+    ds = emission.to_dataset( name='CO' )
+    ds['NO'] = emission * 2.
+    ds['NO'].attrs = { 'units':'kg/m2/s', 'molecular_weight':30. }
+    ds['BC'] = emission * 3.
+    ds['BC'].attrs = { 'units':'kg/m2/s', 'molecular_weight':12. }
+    return ds
+
+
+def test_species_same_as_Calc_Emis_T(dataset):
+    regions = { 'EAS':[[100,150],[20,50]], 'PAC':[[170,-130],[-20,20]] }
+    emis = Calc_Emis_T_Dataset( dataset, regions=regions, zonal_bands=30., nthreads=2, 
+                                print_results=False, ignore_warning=True )
+    assert emis.species == ['CO', 'NO', 'BC']
+    for si, fld in enumerate( emis.species ):
+        single = Calc_Emis_T( dataset[fld], regions=regions, zonal_bands=30., 
+                              print_results=False, ignore_warning=True )
+        np.testing.assert_allclose( emis.emissions_total[si], single.emissions_total, rtol=1e-12 )
+        np.testing.assert_allclose( emis.emissions_region[si], single.emissions_region, rtol=1e-12 )
+        np.testing.assert_allclose( emis.emissions_zonal[si], single.emissions_zonal, rtol=1e-12 )
+    np.testing.assert_allclose( emis.emissions_total[1], emis.emissions_total[0] * 2., rtol=1e-12 )
+    # total, 2 regions, and 6 latitude bands for 12 months of each species
+    assert len( emis.table ) == 3 * ( 3 + 6 ) * 12
+    band = emis.table[ ( emis.table['species'] == 'NO' ) & ( emis.table['region'] == 'lat -30~0' ) ]
+    np.testing.assert_allclose( band['emissions [Gg]'].values, 
+                                emis.emissions_zonal[1][:,2] / 1e6, rtol=1e-12 )
+
+
+def test_summed_area_for_each_species(dataset, tmp_path):
+    summed_area = str( tmp_path / 'table.npy' )
+    emis = Calc_Emis_T_Dataset( dataset, summed_area=summed_area, print_results=False, 
+                                ignore_warning=True )
+    for fld in emis.species:
+        assert os.path.exists( str( tmp_path / ( 'table_' + fld + '.npy' ) ) )
+        box = Calc_Emis_T( dataset[fld], lon_range=[100,150], lat_range=[20,50],
+                           print_results=False, ignore_warning=True )
+        np.testing.assert_allclose( emis.emis[fld].box_total( [100,150], [20,50] ), 
+                                    box.emissions_total, rtol=1e-10 )
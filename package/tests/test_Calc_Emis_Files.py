@@ -0,0 +1,134 @@
+'''
+test_Calc_Emis_Files.py
+Totals of many files with the per-file cache of results
+'''
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import Calc_Emis
+from Calc_Emis import Calc_Emis_T, Calc_Emis_T_Files
+
+
+@pytest.fixture
+def emission_files(emission, tmp_path):
+    '''
+    Three files of the emission fixture scaled by 1, 2, and 3
+    '''
+    filenames = []
+    for fi in range(3):
+        filename = str( tmp_path / ( 'emis_' + str(fi) + '.nc' ) )
+        data = emission * ( fi + 1. )
+        data.attrs = emission.attrs
+        data.to_dataset( name='CO' ).to_netcdf( filename )
+        filenames.append( filename )
+    return filenames
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    '''
+    Files calculated by calc_emis_file (in-process with nprocs=1)
+    '''
+    calculated = []
+    calc_emis_file = Calc_Emis.calc_emis_file
+    def counted(filename, kwargs):
+        calculated.append( filename )
+        return calc_emis_file( filename, kwargs )
+    monkeypatch.setattr( Calc_Emis, 'calc_emis_file', counted )
+    return calculated
+
+
+def test_only_new_files_calculated(emission, emission_files, calls, expected_total, tmp_path):
+    cache_file = str( tmp_path / 'cache.jsonl' )
+    emis = Calc_Emis_T_Files( emission_files[:2], nprocs=1, cache_file=cache_file,
+                              print_results=False, ignore_warning=True )
+    assert len( calls ) == 2
+    assert emis.failed == {}
+
+    # rerun with a file added: only the new file is calculated
+    emis = Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                              print_results=False, ignore_warning=True )
+    assert calls[2:] == [ os.path.abspath( emission_files[2] ) ]
+    for fi, filename in enumerate( emission_files ):
+        table = emis.table[ emis.table['file'] == os.path.abspath( filename ) ]
+        np.testing.assert_allclose( table['emissions [Gg]'].values,
+                                    expected_total( emission ) * ( fi + 1. ) / 1e6, rtol=1e-10 )
+
+    # rerun with the same files: nothing is calculated
+    Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                       print_results=False, ignore_warning=True )
+    assert len( calls ) == 3
+
+
+def test_parameters_invalidate_cache(emission, emission_files, calls, tmp_path):
+    cache_file = str( tmp_path / 'cache.jsonl' )
+    Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                       print_results=False, ignore_warning=True )
+    emis = Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                              lon_range=[100,150], lat_range=[20,50],
+                              print_results=False, ignore_warning=True )
+    assert len( calls ) == 6
+    box = Calc_Emis_T( emission, lon_range=[100,150], lat_range=[20,50],
+                       print_results=False, ignore_warning=True )
+    table = emis.table[ emis.table['file'] == os.path.abspath( emission_files[0] ) ]
+    np.testing.assert_allclose( table['emissions [Gg]'].values,
+                                box.emissions_total / 1e6, rtol=1e-10 )
+
+    # options not affecting results share the cache
+    Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file, chunk_mb=1,
+                       print_results=False, ignore_warning=True )
+    assert len( calls ) == 6
+
+
+def test_modified_file_recalculated(emission, emission_files, calls, tmp_path):
+    cache_file = str( tmp_path / 'cache.jsonl' )
+    Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                       print_results=False, ignore_warning=True )
+    data = emission * 10.
+    data.attrs = emission.attrs
+    data.isel( time=slice(0,6) ).to_dataset( name='CO' ).to_netcdf( emission_files[1] )
+    emis = Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                              print_results=False, ignore_warning=True )
+    assert calls[3:] == [ os.path.abspath( emission_files[1] ) ]
+    table = emis.table[ emis.table['file'] == os.path.abspath( emission_files[1] ) ]
+    assert len( table ) == 6
+
+
+def test_csv_output(emission_files, tmp_path):
+    output_file = str( tmp_path / 'totals.csv' )
+    emis = Calc_Emis_T_Files( emission_files, nprocs=1, output_file=output_file,
+                              print_results=False, ignore_warning=True )
+    assert os.path.exists( output_file + '.cache.jsonl' )
+    table = pd.read_csv( output_file )
+    assert list( table.columns ) == ['file', 'species', 'region', 'year', 'month', 'day',
+                                     'emissions [Gg]']
+    assert len( table ) == 3 * 12
+    np.testing.assert_allclose( table['emissions [Gg]'].values,
+                                emis.table['emissions [Gg]'].values, rtol=1e-12 )
+
+
+def test_zonal_bands_and_summed_area(emission, emission_files, calls, tmp_path):
+    cache_file = str( tmp_path / 'cache.jsonl' )
+    Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                       print_results=False, ignore_warning=True )
+    emis = Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file,
+                              zonal_bands=[-90,-30,0,30,90], summed_area=str( tmp_path ),
+                              print_results=False, ignore_warning=True )
+    assert len( calls ) == 6
+    for filename in emission_files:
+        name = os.path.splitext( os.path.basename( filename ) )[0]
+        assert os.path.exists( str( tmp_path / ( name + '_CO.npy' ) ) )
+    single = Calc_Emis_T( emission, zonal_bands=[-90,-30,0,30,90], 
+                          print_results=False, ignore_warning=True )
+    table = emis.table[ ( emis.table['file'] == os.path.abspath( emission_files[0] ) ) & 
+                        ( emis.table['region'] == 'lat -30~0' ) ]
+    np.testing.assert_allclose( table['emissions [Gg]'].values, 
+                                single.emissions_zonal[:,1] / 1e6, rtol=1e-10 )
+    
+    # other band edges: calculated again
+    Calc_Emis_T_Files( emission_files, nprocs=1, cache_file=cache_file, zonal_bands=30.,
+                       summed_area=str( tmp_path ), print_results=False, ignore_warning=True )
+    assert len( calls ) == 9
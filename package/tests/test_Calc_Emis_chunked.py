@@ -0,0 +1,39 @@
+'''
+test_Calc_Emis_chunked.py
+Out-of-core mode (chunk_mb): totals read and reduced chunk by chunk along time
+'''
+
+import numpy as np
+import xarray as xr
+import pytest
+
+from Calc_Emis import Calc_Emis_T
+
+
+@pytest.mark.parametrize( 'chunk_mb', [0.05, 0.2, 64] )
+def test_chunked_same_as_eager(emission, tmp_path, chunk_mb):
+    filename = str( tmp_path / 'emission.nc' )
+    emission.to_netcdf( filename )
+    eager = Calc_Emis_T( emission, unit='kg/m2/s', print_results=False, ignore_warning=True )
+    # from 1 (0.05 MB) to all 12 time steps (64 MB) per chunk
+    with xr.open_dataset( filename ) as ds:
+        chunked = Calc_Emis_T( ds['CO'], unit='kg/m2/s', chunk_mb=chunk_mb, print_results=False, 
+                               ignore_warning=True )
+    np.testing.assert_allclose( chunked.emissions_total, eager.emissions_total, rtol=1e-12 )
+
+
+def test_chunked_dask(emission):
+    pytest.importorskip( 'dask' )
+    eager = Calc_Emis_T( emission, unit='kg/m2/s', print_results=False, ignore_warning=True )
+    chunked = Calc_Emis_T( emission.chunk( { 'time':5 } ), unit='kg/m2/s', chunk_mb=0.1,
+                           print_results=False, ignore_warning=True )
+    np.testing.assert_allclose( chunked.emissions_total, eager.emissions_total, rtol=1e-12 )
+
+
+def test_chunked_date_range(emission, expected_total):
+    chunked = Calc_Emis_T( emission, unit='kg/m2/s', chunk_mb=0.05, 
+                           date_range=['2000-03-01','2000-05-31'],
+                           print_results=False, ignore_warning=True )
+    expected = np.zeros( 12 )
+    expected[2:5] = expected_total( emission )[2:5]
+    np.testing.assert_allclose( chunked.emissions_total, expected, rtol=1e-12 )
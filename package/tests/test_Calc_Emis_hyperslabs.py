@@ -0,0 +1,49 @@
+'''
+test_Calc_Emis_hyperslabs.py
+Regions read from lazily opened files as longitude runs (hyperslabs),
+also across the dateline and the edge of the longitude array
+'''
+
+import numpy as np
+import xarray as xr
+import pytest
+
+from Calc_Emis import Calc_Emis_T
+
+
+@pytest.fixture
+def emission_file(emission, tmp_path):
+    '''
+    The emission fixture on a -180~175 longitude grid, saved in a netCDF file
+    '''
+    data = emission.roll( lon=36, roll_coords=True )
+    data = data.assign_coords( lon=np.where( data['lon'] >= 180, data['lon'] - 360.,
+                                             data['lon'] ) )
+    data.attrs = emission.attrs
+    filename = str( tmp_path / 'emis.nc' )
+    data.to_dataset( name='CO' ).to_netcdf( filename )
+    return filename
+
+
+@pytest.mark.parametrize( 'lon_range, nruns', [ ([170,-130], 2),    # across the dateline
+                                                ([100,150], 1),
+                                                ([-180,180], 1) ] )
+def test_lazy_runs_same_as_eager(emission_file, expected_total, lon_range, nruns):
+    with xr.open_dataset( emission_file ) as ds:
+        lazy = Calc_Emis_T( ds['CO'], lon_range=lon_range, lat_range=[-20,20],
+                            print_results=False, ignore_warning=True )
+        assert len( lazy.space_pieces ) == nruns
+        eager = Calc_Emis_T( ds['CO'].load(), lon_range=lon_range, lat_range=[-20,20],
+                             print_results=False, ignore_warning=True )
+        expected = expected_total( ds['CO'], lon_range, [-20,20] )
+    np.testing.assert_allclose( lazy.emissions_total, eager.emissions_total, rtol=1e-12 )
+    np.testing.assert_allclose( lazy.emissions_total, expected, rtol=1e-10 )
+
+
+def test_lazy_runs_chunked(emission_file, expected_total):
+    with xr.open_dataset( emission_file ) as ds:
+        emis = Calc_Emis_T( ds['CO'], lon_range=[170,-130], lat_range=[-20,20], chunk_mb=0.001,
+                            print_results=False, ignore_warning=True )
+        expected = expected_total( ds['CO'], [170,-130], [-20,20] )
+    assert len( emis.space_pieces ) == 2
+    np.testing.assert_allclose( emis.emissions_total, expected, rtol=1e-10 )
@@ -0,0 +1,55 @@
+'''
+test_Calc_Emis_polygon_regions.py
+Polygon and mask regions with fractional cell coverage, cached membership
+'''
+
+import os
+import numpy as np
+import xarray as xr
+import pytest
+
+import Calc_Emis
+from Calc_Emis import Calc_Emis_T
+
+
+# cells with centers in [100,150] x [20,48] of the 4 x 5 degree emission fixture
+box = [[100,150],[20,50]]
+polygon = [ [97.5,18.], [152.5,18.], [152.5,50.], [97.5,50.] ]
+
+
+def test_polygon_and_mask_same_as_box(emission, expected_total):
+    mask = xr.zeros_like( emission.isel( time=0 ), dtype='i4' )
+    mask = mask.where( ~( ( mask['lon'] >= 100 ) & ( mask['lon'] <= 150 ) & 
+                          ( mask['lat'] >= 20 ) & ( mask['lat'] <= 50 ) ), 3 )
+    regions = { 'box':box, 'polygon':{ 'polygon':polygon, 'nsub':4 },
+                'mask':{ 'mask':mask, 'value':3 } }
+    emis = Calc_Emis_T( emission, unit='kg/m2/s', regions=regions, print_results=False, 
+                        ignore_warning=True )
+    for name in regions.keys():
+        np.testing.assert_allclose( emis.emissions_region[emis.region_names.index( name )],
+                                    expected_total( emission, *box ), rtol=1e-12 )
+
+
+def test_polygon_fraction(emission, expected_total):
+    # half of each cell in the western column [97.5,102.5] 
+    half = [ [100.,18.], [152.5,18.], [152.5,50.], [100.,50.] ]
+    emis = Calc_Emis_T( emission, unit='kg/m2/s', regions={ 'half':{ 'polygon':half, 'nsub':10 } },
+                        print_results=False, ignore_warning=True )
+    expected = expected_total( emission, [105,150], [20,50] ) + \
+               expected_total( emission, [100,100], [20,50] ) / 2.
+    np.testing.assert_allclose( emis.emissions_region[0], expected, rtol=1e-12 )
+
+
+def test_region_cache(emission, tmp_path):
+    regions = { 'polygon':{ 'polygon':polygon, 'nsub':4 } }
+    emis = Calc_Emis_T( emission, unit='kg/m2/s', regions=regions, region_cache_dir=str(tmp_path),
+                        print_results=False, ignore_warning=True )
+    assert len( [ ff for ff in os.listdir( tmp_path ) if ff.startswith( 'region_matrix_' ) ] ) == 1
+    again = Calc_Emis_T( emission, unit='kg/m2/s', regions=regions, print_results=False, 
+                         ignore_warning=True )
+    assert again.region_matrix is emis.region_matrix
+    # bounded in memory
+    for lon_west in np.arange( 0., 200., 5. ):
+        Calc_Emis_T( emission, unit='kg/m2/s', regions={ 'box':[[lon_west,lon_west+10.],[0,30]] },
+                     print_results=False, ignore_warning=True )
+    assert len( Calc_Emis._region_matrix_cache ) <= 16
@@ -0,0 +1,38 @@
+'''
+test_Calc_Emis_regions.py
+Batch totals of many regions in a single pass (regions)
+'''
+
+import numpy as np
+import pytest
+
+from Calc_Emis import Calc_Emis_T
+
+
+regions = { 'EAS':[[100,150],[20,50]], 'PAC':[[170,-130],[-20,20]], 'GLB':[[0,360],[-90,90]] }
+
+
+@pytest.mark.parametrize( 'chunk_mb', [None, 0.2] )
+def test_regions_same_as_boxes(emission, expected_total, chunk_mb):
+    emis = Calc_Emis_T( emission, unit='kg/m2/s', regions=regions, chunk_mb=chunk_mb,
+                        print_results=False, ignore_warning=True )
+    assert np.shape( emis.emissions_region ) == ( len(regions), 12 )
+    for name, ( lon_range, lat_range ) in regions.items():
+        region = emis.region_names.index( name )
+        box = Calc_Emis_T( emission, unit='kg/m2/s', lon_range=lon_range, lat_range=lat_range,
+                           print_results=False, ignore_warning=True )
+        np.testing.assert_allclose( emis.emissions_region[region], box.emissions_total, rtol=1e-12 )
+        np.testing.assert_allclose( emis.emissions_region[region], 
+                                    expected_total( emission, lon_range, lat_range ), rtol=1e-12 )
+    np.testing.assert_allclose( emis.emissions_total, expected_total( emission ), rtol=1e-12 )
+
+
+def test_regions_with_box(emission, expected_total):
+    # lon_range/lat_range limit emissions_total, regions are calculated as defined
+    emis = Calc_Emis_T( emission, unit='kg/m2/s', regions=regions, lon_range=[120,200], 
+                        lat_range=[0,90], print_results=False, ignore_warning=True )
+    region = emis.region_names.index( 'EAS' )
+    np.testing.assert_allclose( emis.emissions_region[region], 
+                                expected_total( emission, [100,150], [20,50] ), rtol=1e-12 )
+    np.testing.assert_allclose( emis.emissions_total, 
+                                expected_total( emission, [120,200], [0,90] ), rtol=1e-12 )
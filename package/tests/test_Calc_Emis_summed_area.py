@@ -0,0 +1,83 @@
+'''
+test_Calc_Emis_summed_area.py
+Box totals from the summed-area table, and reuse of a table saved in a .npy file
+'''
+
+import os
+import numpy as np
+import xarray as xr
+import pytest
+
+from Calc_Emis import Calc_Emis_T, values_key
+
+
+@pytest.fixture
+def emission_file(emission, tmp_path):
+    filename = str( tmp_path / 'emis.nc' )
+    emission.to_dataset( name='CO' ).to_netcdf( filename )
+    return filename
+
+
+def summed_area_emis(emission, summed_area):
+    return Calc_Emis_T( emission, summed_area=summed_area, print_results=False,
+                        ignore_warning=True, verbose=True )
+
+
+@pytest.mark.parametrize( 'lon_range, lat_range', [ ([100,150], [20,50]),
+                                                     ([170,-130], [-20,20]),
+                                                     ([340,20], [-90,90]) ] )
+def test_box_total(emission, expected_total, lon_range, lat_range):
+    emis = summed_area_emis( emission, True )
+    np.testing.assert_allclose( emis.box_total( lon_range, lat_range ),
+                                expected_total( emission, lon_range, lat_range ), rtol=1e-10 )
+
+
+def test_saved_table_reused(emission_file, expected_total, tmp_path, capsys):
+    summed_area = str( tmp_path / 'table.npy' )
+    with xr.open_dataset( emission_file ) as ds:
+        summed_area_emis( ds['CO'], summed_area )
+    assert os.path.exists( summed_area + '.key' )
+    assert 'Read summed-area table' not in capsys.readouterr().out
+
+    # same file: the table is reused
+    with xr.open_dataset( emission_file ) as ds:
+        emis = summed_area_emis( ds['CO'], summed_area )
+        expected = expected_total( ds['CO'], [100,150], [20,50] )
+    assert 'Read summed-area table' in capsys.readouterr().out
+    np.testing.assert_allclose( emis.box_total( [100,150], [20,50] ), expected, rtol=1e-10 )
+
+
+def test_saved_table_rebuilt(emission, emission_file, expected_total, tmp_path, capsys):
+    summed_area = str( tmp_path / 'table.npy' )
+    with xr.open_dataset( emission_file ) as ds:
+        summed_area_emis( ds['CO'], summed_area )
+
+    # the file is changed: the table is rebuilt
+    data = emission * 2.
+    data.attrs = emission.attrs
+    data.to_dataset( name='CO' ).to_netcdf( emission_file )
+    with xr.open_dataset( emission_file ) as ds:
+        emis = summed_area_emis( ds['CO'], summed_area )
+    assert 'Read summed-area table' not in capsys.readouterr().out
+    np.testing.assert_allclose( emis.box_total( [100,150], [20,50] ),
+                                expected_total( data, [100,150], [20,50] ), rtol=1e-10 )
+
+    # another subset of the same shape: the table is rebuilt
+    with xr.open_dataset( emission_file ) as ds:
+        summed_area_emis( ds['CO'].isel( time=slice(0,6) ), summed_area )
+        emis = summed_area_emis( ds['CO'].isel( time=slice(6,12) ), summed_area )
+        expected = expected_total( ds['CO'].load(), [100,150], [20,50] )[6:12]
+    assert 'Read summed-area table' not in capsys.readouterr().out
+    np.testing.assert_allclose( emis.box_total( [100,150], [20,50] ), expected, rtol=1e-10 )
+
+
+def test_values_key(emission_file):
+    with xr.open_dataset( emission_file ) as ds:
+        lazy = values_key( ds['CO'] )
+        loaded = values_key( ds['CO'].load() )
+        # values in memory without a source file
+        copied = ds['CO'].copy()
+        copied.encoding = {}
+        assert type( values_key( copied ) ) == np.ndarray
+    assert lazy[0] == os.path.abspath( emission_file )
+    assert lazy == loaded
@@ -0,0 +1,35 @@
+'''
+test_Calc_Emis_units.py
+Unit conversion applied to the reduced totals (no full-size converted array)
+'''
+
+import numpy as np
+import pytest
+
+from Calc_Emis import Calc_Emis_T
+
+
+# molecules / mole
+Avo = 6.022e23
+
+
+@pytest.mark.parametrize( 'unit, factor', [ ('molecules/cm2/s', 1e4), ('molecules/m2/s', 1.),
+                                            ('molecules cm-2 s-1', 1e4) ] )
+def test_molecules(emission, unit, factor):
+    kg = Calc_Emis_T( emission, unit='kg/m2/s', print_results=False, ignore_warning=True )
+    # kg/m2/s -> molecules per area of the unit
+    molecules = emission * 1e3 / 28. * Avo / factor
+    emis = Calc_Emis_T( molecules, unit=unit, mw=28., print_results=False, ignore_warning=True )
+    np.testing.assert_allclose( emis.emissions_total, kg.emissions_total, rtol=1e-12 )
+
+
+def test_float32_input(emission):
+    var = emission.astype( 'f4' )
+    values = np.copy( var.values )
+    emis = Calc_Emis_T( var, unit='kg/m2/s', print_results=False, ignore_warning=True )
+    emis_f8 = Calc_Emis_T( var.astype( 'f8' ), unit='kg/m2/s', print_results=False, 
+                           ignore_warning=True )
+    # float32 blocks accumulated in float64, input not modified
+    np.testing.assert_allclose( emis.emissions_total, emis_f8.emissions_total, rtol=1e-6 )
+    np.testing.assert_array_equal( var.values, values )
+    assert not hasattr( emis, 'var_kg_m2_s' )
@@ -0,0 +1,69 @@
+'''
+test_ESMF_Transfer.py
+Batched ESMF regridding (engine='ESMF') against the sparse weight matrix,
+for slice counts not a multiple of the batch size and two leading dimensions
+'''
+
+import numpy as np
+import pytest
+
+import Regridding_ESMF
+from Regridding_ESMF import Regridding, ESMF_Transfer, grid_dataset_FV, read_weight_file
+
+pytestmark = pytest.mark.skipif( Regridding_ESMF.ESMF == None, reason='ESMPy is not available' )
+
+lat = np.arange( -87.5, 90., 5. )
+lon = np.arange( 2.5, 360., 5. )
+dst_lat = np.arange( -84., 90., 12. )
+dst_lon = np.arange( 7.5, 360., 15. )
+
+
+@pytest.fixture
+def regrid_kwargs(tmp_path):
+    '''
+    Keywords of Regridding with conservative weights from 5 to 12 x 15 degree grids
+    '''
+    kwargs = { 'src_grid_file':grid_dataset_FV( lat, lon ),
+               'dst_grid_file':grid_dataset_FV( dst_lat, dst_lon ),
+               'wgt_file':str( tmp_path / 'wgt_FV5_to_FV12.nc' ), 'method':'Conserve',
+               'save_results':False, 'speed_up':False, 'creation_date':False,
+               'check_timings':False }
+    Regridding( np.zeros( (len(lat), len(lon)) ), dimension=['lat','lon'],
+                dim_var={ 'lat':lat, 'lon':lon }, save_wgt_file=True, save_wgt_file_only=True,
+                **kwargs )
+    return kwargs
+
+
+@pytest.mark.parametrize( 'nslice', [3, 4, 10] )
+def test_batches_same_as_weight_matrix(regrid_kwargs, nslice):
+    regrid = Regridding( np.zeros( (len(lat), len(lon)) ), dimension=['lat','lon'],
+                         dim_var={ 'lat':lat, 'lon':lon }, engine='ESMF', **regrid_kwargs )
+    transfer = ESMF_Transfer( regrid.src_grid, regrid.dst_grid, regrid_kwargs['wgt_file'], 4 )
+    assert transfer.src_data.shape == ( 4, len(lat), len(lon) )
+    assert transfer.dst_data.shape == ( 4, len(dst_lat), len(dst_lon) )
+
+    var = np.random.default_rng(0).random( (nslice, len(lat), len(lon)) )
+    var_dst = np.full( (nslice, len(dst_lat), len(dst_lon)), np.nan )
+    transfer( var, var_dst )
+    weight_matrix = read_weight_file( regrid_kwargs['wgt_file'] )
+    expected = ( weight_matrix @ np.reshape( var, (nslice, -1) ).T ).T
+    np.testing.assert_allclose( np.reshape( var_dst, (nslice, -1) ), expected,
+                                rtol=1e-10, atol=1e-14 )
+
+    with pytest.raises( ValueError ):
+        transfer( var[:,:,:-1], var_dst )
+
+
+@pytest.mark.parametrize( 'nbatch', [1, 4, 5] )
+def test_ESMF_same_as_sparse_two_leading_dims(regrid_kwargs, nbatch):
+    # 7 x 3 slices, batches of nbatch slices (chunk_mb of nbatch source slices)
+    var = np.random.default_rng(1).random( (7, 3, len(lat), len(lon)) )
+    kwargs = dict( regrid_kwargs, dimension=['time','lev','lat','lon'],
+                   dim_var={ 'time':np.arange(7), 'lev':np.arange(3), 'lat':lat, 'lon':lon },
+                   chunk_mb=nbatch * len(lat) * len(lon) * 8. / 1024**2, pipeline=False )
+    Regridding_ESMF._esmf_transfer_cache.clear()
+    esmf = Regridding( var, engine='ESMF', **kwargs )
+    sparse = Regridding( var, engine='sparse', **kwargs )
+    assert esmf.esmf_transfer.nbatch == nbatch
+    assert np.shape( esmf.var_dst ) == ( 7, 3, len(dst_lat), len(dst_lon) )
+    np.testing.assert_allclose( esmf.var_dst, sparse.var_dst, rtol=1e-10, atol=1e-14 )
@@ -0,0 +1,73 @@
+'''
+test_Regridding_Session.py
+Regridding of many files in a process pool with the same weights
+'''
+
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from Regridding_ESMF import Regridding_Session, grid_dataset_FV
+from test_Regridding_sparse import src_lat, src_lon, dst_grid, expected, wgt_file
+from test_Regridding_conservation import wgt_file_area
+
+
+@pytest.fixture
+def emission_files(tmp_path):
+    '''
+    Three files of 2 time steps (e.g., daily files)
+    '''
+    os.makedirs( str( tmp_path / 'input' ) )
+    filenames = []
+    for fi in range(3):
+        var = np.random.default_rng(fi).random( (2, len(src_lat), len(src_lon)) )
+        filename = str( tmp_path / 'input' / ( 'emis_' + str(fi) + '.nc' ) )
+        xr.Dataset( { 'CO':( ('time','lat','lon'), var, { 'units':'kg/m2/s' } ) },
+                    coords={ 'time':np.arange(2) + 2 * fi, 'lat':src_lat, 'lon':src_lon }
+                  ).to_netcdf( filename )
+        filenames.append( filename )
+    return filenames
+
+
+def session_kwargs(wgt_file):
+    return { 'fields':['CO'], 'src_grid_file':grid_dataset_FV( src_lat, src_lon ),
+             'dst_grid_file':dst_grid(), 'wgt_file':wgt_file, 'engine':'sparse' }
+
+
+@pytest.mark.parametrize( 'nprocs', [1, 2] )
+def test_files_regridded(emission_files, wgt_file_area, tmp_path, nprocs):
+    output_dir = str( tmp_path / 'output' )
+    conservation_file = str( tmp_path / 'conservation.csv' )
+    session = Regridding_Session( emission_files, output_dir=output_dir, nprocs=nprocs,
+                                  conservation_file=conservation_file, 
+                                  **session_kwargs( wgt_file_area ) )
+    assert session.failed == {}
+    assert session.dst_files == [ os.path.join( output_dir, os.path.basename( filename ) )
+                                  for filename in emission_files ]
+    for filename, dst_file in zip( emission_files, session.dst_files ):
+        with xr.open_dataset( filename ) as src, xr.open_dataset( dst_file ) as dst:
+            np.testing.assert_allclose( dst['CO'].values, expected( src['CO'].values ), rtol=1e-6 )
+        # a conservation table of each file
+        table = pd.read_csv( str( tmp_path / ( 'conservation_' +
+                                               os.path.splitext( os.path.basename( dst_file ) )[0] +
+                                               '.csv' ) ) )
+        assert len( table ) == 2
+    assert not os.path.exists( conservation_file )
+
+
+def test_concat_file(emission_files, wgt_file, tmp_path):
+    concat_file = str( tmp_path / 'regridded.nc' )
+    session = Regridding_Session( emission_files, concat_file=concat_file, nprocs=2,
+                                  **session_kwargs( wgt_file ) )
+    assert session.failed == {}
+    assert not os.path.exists( concat_file + '.parts' )
+    source = []
+    for filename in emission_files:
+        with xr.open_dataset( filename ) as src:
+            source.append( src['CO'].values )
+    with xr.open_dataset( concat_file ) as dst:
+        assert len( dst['time'] ) == 6
+        np.testing.assert_allclose( dst['CO'].values, expected( np.concatenate( source ) ),
+                                    rtol=1e-6 )
@@ -0,0 +1,73 @@
+'''
+test_Regridding_conservation.py
+Source/destination totals and relative errors of all slices (conservation_check)
+with cell areas of the weight file
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from netCDF4 import Dataset
+
+from Regridding_ESMF import Regridding, grid_dataset_FV
+from test_Regridding_sparse import src_lat, src_lon, dst_grid, expected, wgt_file
+
+# cell areas [sr] of the weight file: source cells in C-order (lat, lon), destination cells
+area_a = np.array( [ 1., 2., 3., 1.5, 2.5, 3.5 ] )
+area_b = np.array( [ 6., 7. ] )
+Earth_rad = 6.371e6
+
+
+@pytest.fixture
+def wgt_file_area(wgt_file):
+    fid = Dataset( wgt_file, 'a' )
+    fid.createVariable( 'area_a', 'f8', ('n_a',) )[:] = area_a
+    fid.createVariable( 'area_b', 'f8', ('n_b',) )[:] = area_b
+    fid.close()
+    return wgt_file
+
+
+def test_conservation_table(wgt_file_area, tmp_path):
+    time = np.arange(4) * 10.
+    lev = np.arange(3) + 1.
+    var = np.random.default_rng(0).random( (len(time), len(lev), len(src_lat), len(src_lon)) )
+    conservation_file = str( tmp_path / 'conservation.csv' )
+    regrid = Regridding( var, dimension=['time','lev','lat','lon'],
+                         dim_var={ 'time':time, 'lev':lev, 'lat':src_lat, 'lon':src_lon },
+                         src_grid_file=grid_dataset_FV( src_lat, src_lon ), dst_grid_file=dst_grid(),
+                         wgt_file=wgt_file_area, engine='sparse', save_results=False, speed_up=False,
+                         conservation_regions={ 'south':[[0,360],[-90,0]] },
+                         conservation_file=conservation_file,
+                         creation_date=False, check_timings=False )
+    table = regrid.conservation_table
+    assert list( table.columns ) == ['field', 'time', 'lev', 'region', 'source_total',
+                                     'destination_total', 'relative_error']
+    assert len( table ) == len(time) * len(lev) * 2
+    assert set( table['field'] ) == { 'regridded_field' }
+
+    var_dst = expected(var)
+    src_var = np.reshape( var, var.shape[:2] + (-1,) )
+    regions = { 'global':( np.ones( 6, dtype=bool ), np.ones( 2, dtype=bool ) ),
+                'south':( np.repeat( src_lat < 0, len(src_lon) ), np.array( [True, False] ) ) }
+    for region, ( src_in, dst_in ) in regions.items():
+        rows = table[ table['region'] == region ]
+        src_total = np.sum( src_var[...,src_in] * area_a[src_in], axis=-1 ) * Earth_rad**2
+        dst_total = np.sum( var_dst[...,dst_in] * area_b[dst_in], axis=-1 ) * Earth_rad**2
+        for ti, tt in enumerate( time ):
+            for li, ll in enumerate( lev ):
+                row = rows[ ( rows['time'] == tt ) & ( rows['lev'] == ll ) ]
+                assert len(row) == 1
+                np.testing.assert_allclose( row['source_total'].values, src_total[ti,li], rtol=1e-12 )
+                np.testing.assert_allclose( row['destination_total'].values, dst_total[ti,li],
+                                            rtol=1e-12 )
+                np.testing.assert_allclose( row['relative_error'].values,
+                                            ( dst_total[ti,li] - src_total[ti,li] ) / src_total[ti,li],
+                                            rtol=1e-10 )
+
+    saved = pd.read_csv( conservation_file )
+    assert list( saved.columns ) == list( table.columns )
+    assert list( saved['region'] ) == list( table['region'] )
+    np.testing.assert_allclose( saved[['time', 'lev', 'source_total', 'destination_total',
+                                       'relative_error']].values,
+                                table[['time', 'lev', 'source_total', 'destination_total',
+                                       'relative_error']].values, rtol=1e-12 )
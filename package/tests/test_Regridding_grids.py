@@ -0,0 +1,144 @@
+'''
+test_Regridding_grids.py
+In-memory grids (grid_dataset_FV, create_grid_FV, create_mesh_SE) against grid files
+(Add_bounds, SCRIP). Tests generating weights need ESMPy and are skipped without it
+'''
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import Regridding_ESMF
+from Regridding_ESMF import Add_bounds, Regridding, grid_dataset_FV, grid_file_key, \
+                            read_weight_file
+
+
+requires_ESMF = pytest.mark.skipif( Regridding_ESMF.ESMF == None, reason='ESMPy is not available' )
+
+
+def FV_grid_file(tmp_path, lat, lon, name):
+    '''
+    Grid information file of lat/lon centers written by Add_bounds
+    '''
+    center_file = str( tmp_path / ( name + '.nc' ) )
+    xr.Dataset( coords={ 'lat':( 'lat', lat, { 'units':'degrees_north' } ),
+                         'lon':( 'lon', lon, { 'units':'degrees_east' } ) } ).to_netcdf( center_file )
+    grid_file = str( tmp_path / ( name + '_grid.nc' ) )
+    Add_bounds( center_file, newfilename=grid_file, creation_date=False )
+    return grid_file
+
+
+def scrip_dataset(lat_edges, lon_edges):
+    '''
+    SCRIP grid of lat/lon cells as an unstructured mesh: cells of the northern row 
+    are pentagons (a node in the middle of the northern edge), and the other cells 
+    are quadrilaterals padded to 5 corners by repeating the last corner
+    '''
+    lon_w, lat_s = np.meshgrid( lon_edges[:-1], lat_edges[:-1] )
+    lon_e, lat_n = np.meshgrid( lon_edges[1:], lat_edges[1:] )
+    corner_lon = np.stack( [ lon_w, lon_e, lon_e, lon_w, lon_w ], axis=-1 )
+    corner_lat = np.stack( [ lat_s, lat_s, lat_n, lat_n, lat_n ], axis=-1 )
+    # pentagons: SW, SE, NE, N (middle), NW
+    corner_lon[-1,:,3] = ( lon_w[-1,:] + lon_e[-1,:] ) / 2.
+    corner_lon[-1,:,4] = lon_w[-1,:]
+    corner_lon = np.reshape( corner_lon, (-1, 5) )
+    corner_lat = np.reshape( corner_lat, (-1, 5) )
+    ncol = len( corner_lon )
+    return xr.Dataset( { 'grid_dims':( ('grid_rank',), np.array( [ncol], dtype='i4' ) ),
+                         'grid_center_lat':( ('grid_size',), ( (lat_s + lat_n) / 2. ).ravel(), 
+                                             { 'units':'degrees' } ),
+                         'grid_center_lon':( ('grid_size',), ( (lon_w + lon_e) / 2. ).ravel(), 
+                                             { 'units':'degrees' } ),
+                         'grid_imask':( ('grid_size',), np.ones( ncol, dtype='i4' ) ),
+                         'grid_corner_lat':( ('grid_size','grid_corners'), corner_lat, 
+                                             { 'units':'degrees' } ),
+                         'grid_corner_lon':( ('grid_size','grid_corners'), corner_lon, 
+                                             { 'units':'degrees' } ) } )
+
+
+def weights(tmp_path, name, lat, lon, src_grid_file, dst_grid_file):
+    '''
+    Conservative weights (sparse matrix) of a lat/lon source generated by Regridding
+    '''
+    wgt_file = str( tmp_path / ( 'wgt_' + name + '.nc' ) )
+    Regridding( np.ones( (1, len(lat), len(lon)) ), dimension=['time','lat','lon'],
+                dim_var={ 'time':[0], 'lat':lat, 'lon':lon }, src_grid_file=src_grid_file,
+                dst_grid_file=dst_grid_file, wgt_file=wgt_file, save_wgt_file=True,
+                save_wgt_file_only=True, method='Conserve', unmapped_action='ignore',
+                save_results=False, speed_up=False, creation_date=False, check_timings=False )
+    return read_weight_file( wgt_file )
+
+
+def test_grid_dataset_FV_same_as_Add_bounds(tmp_path):
+    lat = np.arange( -89.5, 90., 1. )
+    lon = np.arange( 0.5, 360., 1. )
+    grid_file = FV_grid_file( tmp_path, lat, lon, 'FV_1deg' )
+    grid = grid_dataset_FV( lat, lon )
+    with xr.open_dataset( grid_file ) as grid_info:
+        for name in ['lat', 'lon', 'lat_bnds', 'lon_bnds']:
+            assert grid[name].dtype == grid_info[name].dtype
+            np.testing.assert_array_equal( grid[name].values, grid_info[name].values )
+    assert grid_file_key( grid ) == grid_file_key( grid_file )
+
+
+def test_grid_file_key_kept_for_dataset(monkeypatch):
+    lat = np.arange( -87.5, 90., 5. )
+    lon = np.arange( 2.5, 360., 5. )
+    calls = []
+    grid_fingerprint = Regridding_ESMF.grid_fingerprint
+    def counted(*items):
+        calls.append( len(items) )
+        return grid_fingerprint( *items )
+    monkeypatch.setattr( Regridding_ESMF, 'grid_fingerprint', counted )
+    grid = grid_dataset_FV( lat, lon )
+    key = grid_file_key( grid )
+    assert grid_file_key( grid ) == key
+    assert len( calls ) == 1
+    # another Dataset of the same grid
+    assert grid_file_key( grid_dataset_FV( lat, lon ) ) == key
+    assert len( calls ) == 2
+
+
+def test_grid_dataset_FV_bounds_not_limited_at_poles():
+    lat = np.arange( -90., 91., 2. )
+    grid = grid_dataset_FV( lat, np.arange( 0., 360., 2. ) )
+    assert grid['lat_bnds'].values[0,0] == -91.
+    assert grid['lat_bnds'].values[-1,1] == 91.
+
+
+@requires_ESMF
+@pytest.mark.parametrize( 'lat_range, lon_range', [ ( (-90., 90.), (0., 360.) ),
+                                                    ( (20., 50.), (100., 150.) ) ] )
+def test_in_memory_FV_weights(tmp_path, lat_range, lon_range):
+    src_lat = np.arange( lat_range[0] + 0.5, lat_range[1], 1. )
+    src_lon = np.arange( lon_range[0] + 0.5, lon_range[1], 1. )
+    dst_lat = np.arange( lat_range[0] + 1.25, lat_range[1], 2.5 )
+    dst_lon = np.arange( lon_range[0] + 1.25, lon_range[1], 2.5 )
+    src_grid_file = FV_grid_file( tmp_path, src_lat, src_lon, 'src' )
+    dst_grid_file = FV_grid_file( tmp_path, dst_lat, dst_lon, 'dst' )
+
+    wgt_file = weights( tmp_path, 'file', src_lat, src_lon, src_grid_file, dst_grid_file )
+    wgt_memory = weights( tmp_path, 'memory', src_lat, src_lon, 
+                          grid_dataset_FV( src_lat, src_lon ), grid_dataset_FV( dst_lat, dst_lon ) )
+    # source grid derived from lat/lon of the field
+    wgt_derived = weights( tmp_path, 'derived', src_lat, src_lon, None, dst_grid_file )
+    for wgt in [ wgt_memory, wgt_derived ]:
+        assert wgt.shape == wgt_file.shape
+        assert abs( wgt - wgt_file ).max() < 1e-10
+
+
+@requires_ESMF
+def test_in_memory_SE_weights(tmp_path):
+    src_lat = np.arange( -89.5, 90., 1. )
+    src_lon = np.arange( 0.5, 360., 1. )
+    src_grid_file = FV_grid_file( tmp_path, src_lat, src_lon, 'src' )
+    mesh = scrip_dataset( np.arange( 20., 50.1, 3. ), np.arange( 100., 150.1, 5. ) )
+    mesh_file = str( tmp_path / 'mesh_scrip.nc' )
+    mesh.to_netcdf( mesh_file )
+
+    wgt_file = weights( tmp_path, 'file', src_lat, src_lon, src_grid_file, mesh_file )
+    wgt_memory = weights( tmp_path, 'memory', src_lat, src_lon, src_grid_file, mesh )
+    assert wgt_memory.shape == wgt_file.shape == ( mesh.sizes['grid_size'], len(src_lat) * len(src_lon) )
+    assert abs( wgt_memory - wgt_file ).max() < 1e-10
+    # the source covers the mesh: weights of each element sum up to 1
+    np.testing.assert_allclose( np.asarray( wgt_memory.sum( axis=1 ) ).ravel(), 1., rtol=1e-10 )
@@ -0,0 +1,69 @@
+'''
+test_Regridding_output_profiles.py
+Chunking, compression, and chunk cache of NetCDF output profiles
+'''
+
+import numpy as np
+import xarray as xr
+import pytest
+from netCDF4 import Dataset
+
+from Regridding_ESMF import Regridding, create_output_variable, get_output_profile, \
+                            grid_dataset_FV
+from test_Regridding_sparse import src_lat, src_lon, dst_grid, expected, wgt_file
+
+
+@pytest.fixture
+def emission(tmp_path):
+    '''
+    Two fields of 6 time steps, read from a file
+    '''
+    var = np.random.default_rng(0).random( (6, len(src_lat), len(src_lon)) )
+    coords = { 'time':np.arange(6), 'lat':src_lat, 'lon':src_lon }
+    filename = str( tmp_path / 'emission.nc' )
+    xr.Dataset( { 'CO':( ('time','lat','lon'), var, { 'units':'kg/m2/s' } ),
+                  'NO':( ('time','lat','lon'), var * 2., { 'units':'kg/m2/s' } ) },
+                coords=coords ).to_netcdf( filename )
+    with xr.open_dataset( filename ) as ds:
+        yield ds
+
+
+@pytest.mark.parametrize( 'output_profile, filters, chunks',
+                          [ (None, None, None),
+                            ('time_slab', { 'zlib':True, 'shuffle':True, 'complevel':4 }, [1, 2]),
+                            ('time_series', { 'zlib':True, 'shuffle':True, 'complevel':4 }, [6, 2]),
+                            ({ 'profile':'time_series', 'time_chunk':4, 'compression':'zstd',
+                               'complevel':3, 'shuffle':False },
+                             { 'zstd':True, 'shuffle':False, 'complevel':3 }, [4, 2]) ] )
+@pytest.mark.parametrize( 'speed_up', [True, False] )
+def test_output_profile(emission, wgt_file, tmp_path, output_profile, filters, chunks, speed_up):
+    dst_file = str( tmp_path / 'regridded.nc' )
+    Regridding( emission, fields=['CO','NO'], src_grid_file=grid_dataset_FV( src_lat, src_lon ),
+                dst_grid_file=dst_grid(), wgt_file=wgt_file, engine='sparse', dst_file=dst_file,
+                output_profile=output_profile, speed_up=speed_up, creation_date=False,
+                check_timings=False )
+    fid = Dataset( dst_file, 'r' )
+    for fld in ['CO', 'NO']:
+        var = fid.variables[fld]
+        if filters == None:
+            assert fid.data_model == 'NETCDF3_64BIT_DATA'
+        else:
+            assert fid.data_model == 'NETCDF4'
+            assert { key:var.filters()[key] for key in filters } == filters
+        assert var.chunking() == chunks
+        np.testing.assert_allclose( var[:], expected( emission[fld].values ), rtol=1e-6 )
+    fid.close()
+
+
+def test_chunk_cache_shared_by_fields(tmp_path):
+    profile = get_output_profile( { 'profile':'time_series', 'chunk_kb':1, 'cache_mb':1 } )
+    fid = Dataset( str( tmp_path / 'cache.nc' ), 'w', format='NETCDF4' )
+    fid.createDimension( 'time', None )
+    fid.createDimension( 'ncol', 100000 )
+    sizes = []
+    for nfields in [1, 4]:
+        var = create_output_variable( fid, 'field' + str(nfields), 'f4', ('time','ncol'),
+                                      shape=(12, 100000), profile=profile, nfields=nfields )
+        sizes.append( var.get_var_chunk_cache()[0] )
+    fid.close()
+    assert sizes == [ 1024**2, 1024**2 // 4 ]
@@ -0,0 +1,109 @@
+'''
+test_Regridding_sparse.py
+Regridding with a hand-built ESMF weight file (read_weight_file, engine='sparse'), 
+without ESMPy. The ESMF engine is compared when ESMPy is available
+'''
+
+import numpy as np
+import xarray as xr
+import pytest
+from netCDF4 import Dataset
+
+import Regridding_ESMF
+from Regridding_ESMF import Regridding, grid_dataset_FV, read_weight_file
+
+
+# source: 2 x 3 lat/lon cells, destination: 2 SE cells
+src_lat = np.array( [-45., 45.] )
+src_lon = np.array( [60., 180., 300.] )
+
+# (destination, source lat, source lon, weight), source cells in C-order (lat, lon)
+weights = [ ( 0, 0, 0, 1./3. ), ( 0, 0, 1, 1./3. ), ( 0, 0, 2, 1./3. ),
+            ( 1, 1, 0, 0.25 ), ( 1, 1, 2, 0.75 ) ]
+
+
+def dst_grid():
+    '''
+    SCRIP grid of 2 cells (southern and northern hemispheres)
+    '''
+    return xr.Dataset( { 'grid_dims':( ('grid_rank',), np.array( [2], dtype='i4' ) ),
+                         'grid_center_lat':( ('grid_size',), np.array( [-45., 45.] ), 
+                                             { 'units':'degrees' } ),
+                         'grid_center_lon':( ('grid_size',), np.array( [180., 180.] ),
+                                             { 'units':'degrees' } ),
+                         'grid_imask':( ('grid_size',), np.ones( 2, dtype='i4' ) ),
+                         'grid_corner_lat':( ('grid_size','grid_corners'), 
+                                             np.array( [ [-90., -90., 0., 0.], [0., 0., 90., 90.] ] ),
+                                             { 'units':'degrees' } ),
+                         'grid_corner_lon':( ('grid_size','grid_corners'),
+                                             np.array( [ [0., 360., 360., 0.], [0., 360., 360., 0.] ] ),
+                                             { 'units':'degrees' } ) } )
+
+
+@pytest.fixture
+def wgt_file(tmp_path):
+    '''
+    ESMF weight file (1-based row/col) of the weights
+    '''
+    filename = str( tmp_path / 'wgt_FV_to_SE.nc' )
+    fid = Dataset( filename, 'w' )
+    fid.createDimension( 'n_a', len(src_lat) * len(src_lon) )
+    fid.createDimension( 'n_b', 2 )
+    fid.createDimension( 'n_s', len(weights) )
+    fid.createVariable( 'S', 'f8', ('n_s',) )[:] = [ ww[3] for ww in weights ]
+    fid.createVariable( 'row', 'i4', ('n_s',) )[:] = [ ww[0] + 1 for ww in weights ]
+    fid.createVariable( 'col', 'i4', ('n_s',) )[:] = [ ww[1] * len(src_lon) + ww[2] + 1 
+                                                       for ww in weights ]
+    fid.close()
+    return filename
+
+
+def expected(var):
+    '''
+    Regridded values of var (..., lat, lon) by a loop over the weights
+    '''
+    out = np.zeros( np.shape(var)[:-2] + (2,) )
+    for dst, ilat, ilon, ww in weights:
+        out[...,dst] += ww * var[...,ilat,ilon]
+    return out
+
+
+def test_read_weight_file(wgt_file):
+    weight_matrix = read_weight_file( wgt_file )
+    assert weight_matrix.shape == ( 2, 6 )
+    np.testing.assert_allclose( weight_matrix.toarray(), 
+                                [ [1./3., 1./3., 1./3., 0., 0., 0.], [0., 0., 0., 0.25, 0., 0.75] ] )
+    # kept for the same file
+    assert read_weight_file( wgt_file ) is weight_matrix
+
+
+@pytest.mark.parametrize( 'dimension', [ ['time','lat','lon'], ['time','lev','lat','lon'] ] )
+def test_sparse_regridding(wgt_file, dimension):
+    shape = { 'time':4, 'lev':3, 'lat':len(src_lat), 'lon':len(src_lon) }
+    var = np.random.default_rng(0).random( [ shape[dim] for dim in dimension ] )
+    dim_var = { dim:np.arange( shape[dim] ) for dim in dimension }
+    dim_var.update( { 'lat':src_lat, 'lon':src_lon } )
+    regrid = Regridding( var, dimension=dimension, dim_var=dim_var, 
+                         src_grid_file=grid_dataset_FV( src_lat, src_lon ), dst_grid_file=dst_grid(),
+                         wgt_file=wgt_file, engine='sparse', save_results=False, 
+                         speed_up=False, creation_date=False, check_timings=False )
+    assert np.shape( regrid.var_dst ) == np.shape(var)[:-2] + (2,)
+    np.testing.assert_allclose( regrid.var_dst, expected(var), rtol=1e-12 )
+
+
+@pytest.mark.skipif( Regridding_ESMF.ESMF == None, reason='ESMPy is not available' )
+def test_sparse_same_as_ESMF(tmp_path):
+    lat = np.arange( -87.5, 90., 5. )
+    lon = np.arange( 2.5, 360., 5. )
+    dst_lat = np.arange( -84., 90., 12. )
+    dst_lon = np.arange( 7.5, 360., 15. )
+    var = np.random.default_rng(0).random( (3, len(lat), len(lon)) )
+    kwargs = { 'dimension':['time','lat','lon'], 'dim_var':{ 'time':np.arange(3), 'lat':lat, 'lon':lon },
+               'src_grid_file':grid_dataset_FV( lat, lon ), 
+               'dst_grid_file':grid_dataset_FV( dst_lat, dst_lon ),
+               'wgt_file':str( tmp_path / 'wgt_FV5_to_FV12.nc' ), 'method':'Conserve', 
+               'save_results':False, 'speed_up':False, 'creation_date':False, 'check_timings':False }
+    Regridding( var, save_wgt_file=True, save_wgt_file_only=True, **kwargs )
+    sparse = Regridding( var, engine='sparse', **kwargs )
+    esmf = Regridding( var, engine='ESMF', **kwargs )
+    np.testing.assert_allclose( sparse.var_dst, esmf.var_dst, rtol=1e-10, atol=1e-14 )
@@ -0,0 +1,83 @@
+'''
+test_Regridding_zarr.py
+Zarr store output: blocks written concurrently, and a rerun of the same job
+rewriting only the blocks that are not recorded as written
+'''
+
+import os
+import numpy as np
+import xarray as xr
+import pytest
+
+zarr = pytest.importorskip( 'zarr' )
+
+import Regridding_ESMF
+from Regridding_ESMF import Regridding, grid_dataset_FV
+from test_Regridding_sparse import src_lat, src_lon, dst_grid, expected, wgt_file
+
+
+@pytest.fixture
+def emission_file(tmp_path):
+    '''
+    Two fields of 6 time steps in a file
+    '''
+    var = np.random.default_rng(0).random( (6, len(src_lat), len(src_lon)) )
+    coords = { 'time':np.arange(6), 'lat':src_lat, 'lon':src_lon }
+    filename = str( tmp_path / 'emission.nc' )
+    xr.Dataset( { 'CO':( ('time','lat','lon'), var, { 'units':'kg/m2/s' } ),
+                  'NO':( ('time','lat','lon'), var * 2., { 'units':'kg/m2/s' } ) },
+                coords=coords ).to_netcdf( filename )
+    return filename
+
+
+@pytest.fixture
+def written(monkeypatch):
+    '''
+    (field, first index) of blocks written to Zarr stores
+    '''
+    blocks = []
+    write_block = Regridding_ESMF.Zarr_Variable.write_block
+    def recorded(self, index, value):
+        blocks.append( ( self.name, index.start if type(index) == slice else index ) )
+        write_block( self, index, value )
+    monkeypatch.setattr( Regridding_ESMF.Zarr_Variable, 'write_block', recorded )
+    return blocks
+
+
+def regrid_zarr(emission_file, wgt_file, dst_file):
+    with xr.open_dataset( emission_file ) as ds:
+        # blocks of 2 time steps (2 fields x 6 source cells x 8 bytes per time step)
+        Regridding( ds, fields=['CO','NO'], src_grid_file=grid_dataset_FV( src_lat, src_lon ),
+                    dst_grid_file=dst_grid(), wgt_file=wgt_file, engine='sparse',
+                    dst_file=dst_file, output_backend='zarr', chunk_mb=192. / 1024**2,
+                    zarr_workers=2, creation_date=False, check_timings=False )
+
+
+def test_zarr_resume(emission_file, wgt_file, written, tmp_path):
+    dst_file = str( tmp_path / 'regridded.zarr' )
+    regrid_zarr( emission_file, wgt_file, dst_file )
+    assert sorted( written ) == [ (fld, start) for fld in ['CO','NO'] for start in [0, 2, 4] ]
+
+    # an interrupted run: one block of CO is not recorded as written
+    marker_dir = str( tmp_path / '.regridded.zarr.blocks' )
+    os.remove( os.path.join( marker_dir, 'CO.2-4' ) )
+    zarr.open_group( dst_file, mode='a' )['CO'][2:4] = np.nan
+    del written[:]
+    regrid_zarr( emission_file, wgt_file, dst_file )
+    assert written == [ ('CO', 2) ]
+
+    with xr.open_dataset( emission_file ) as ds:
+        source = ds.load()
+    store = xr.open_zarr( dst_file, chunks=None )
+    for fld in ['CO', 'NO']:
+        assert store[fld].dims == ('time', 'ncol')
+        np.testing.assert_allclose( store[fld].values, expected( source[fld].values ), rtol=1e-6 )
+    assert store['CO'].attrs['units'] == 'kg/m2/s'
+
+    # another input file: a new store
+    with xr.open_dataset( emission_file ) as ds:
+        ds = ds.load()
+    ( ds * 3. ).assign_attrs( ds.attrs ).to_netcdf( emission_file )
+    del written[:]
+    regrid_zarr( emission_file, wgt_file, dst_file )
+    assert len( written ) == 6
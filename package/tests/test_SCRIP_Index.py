@@ -0,0 +1,75 @@
+'''
+test_SCRIP_Index.py
+Spatial index of SE grid cells against a search over all columns, and the session cache
+'''
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import Calc_Emis
+from Calc_Emis import SCRIP_Index, get_SCRIP_index, lon_in_range
+
+
+@pytest.fixture
+def cells():
+    '''
+    Random cell centers (-180~180) with 4 corners 1 degree around each center
+    '''
+    rng = np.random.default_rng( 0 )
+    center_lon = rng.uniform( -180., 180., 2000 )
+    center_lat = np.degrees( np.arcsin( rng.uniform( -1., 1., 2000 ) ) )
+    dlon = np.array( [-1., 1., 1., -1.] )
+    dlat = np.array( [-1., -1., 1., 1.] )
+    corner_lon = center_lon[:,np.newaxis] + dlon
+    corner_lat = np.clip( center_lat[:,np.newaxis] + dlat, -90., 90. )
+    return center_lon, center_lat, corner_lon, corner_lat
+
+
+@pytest.mark.parametrize( 'lon_range, lat_range', [ ([100,150], [20,50]),
+                                                     ([170,-170], [-30,10]),
+                                                     ([-180,180], [60,90]),
+                                                     ([350,10], [-90,-70]) ] )
+def test_query_box(cells, lon_range, lat_range):
+    center_lon, center_lat, corner_lon, corner_lat = cells
+    index = SCRIP_Index( center_lon, center_lat, corner_lon=corner_lon, corner_lat=corner_lat,
+                         band_width=2. )
+    expected = np.where( lon_in_range( center_lon, lon_range ) &
+                         ( center_lat >= lat_range[0] ) & ( center_lat <= lat_range[1] ) )[0]
+    np.testing.assert_array_equal( index.query_box( lon_range, lat_range ), expected )
+    # cells overlapping the box include the cells with centers in the box
+    overlap = index.query_box( lon_range, lat_range, overlap=True )
+    assert np.all( np.isin( expected, overlap ) )
+
+
+def test_nearest(cells):
+    center_lon, center_lat = cells[:2]
+    index = SCRIP_Index( center_lon, center_lat )
+    inds, dist = index.nearest( [10., -120.], [45., -60.] )
+    for ii, ( lon, lat ) in enumerate( [ (10., 45.), (-120., -60.) ] ):
+        cos_dist = np.sin( np.radians(lat) ) * np.sin( np.radians(center_lat) ) + \
+                   np.cos( np.radians(lat) ) * np.cos( np.radians(center_lat) ) * \
+                   np.cos( np.radians( center_lon - lon ) )
+        assert inds[ii] == np.argmax( cos_dist )
+
+
+def test_cached_index(cells, tmp_path):
+    center_lon, center_lat, corner_lon, corner_lat = cells
+    scrip = xr.Dataset( { 'grid_center_lon':( 'grid_size', center_lon ),
+                          'grid_center_lat':( 'grid_size', center_lat ),
+                          'grid_corner_lon':( ('grid_size', 'grid_corners'), corner_lon ),
+                          'grid_corner_lat':( ('grid_size', 'grid_corners'), corner_lat ) } )
+    scrip_file = str( tmp_path / 'scrip.nc' )
+    scrip.to_netcdf( scrip_file )
+    index = get_SCRIP_index( scrip_file )
+    assert get_SCRIP_index( scrip_file ) is index
+    # the same cells in 0~360 longitudes
+    assert get_SCRIP_index( center_lon=center_lon % 360., center_lat=center_lat,
+                            corner_lon=corner_lon % 360., corner_lat=corner_lat ) is \
+           get_SCRIP_index( center_lon=center_lon, center_lat=center_lat,
+                            corner_lon=corner_lon, corner_lat=corner_lat )
+
+    # the number of indexes kept in memory is bounded
+    for band_width in [1., 2., 3., 4., 5.]:
+        get_SCRIP_index( center_lon=center_lon, center_lat=center_lat, band_width=band_width )
+    assert len( Calc_Emis._SCRIP_index_cache ) <= 4
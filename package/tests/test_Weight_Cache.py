@@ -0,0 +1,91 @@
+'''
+test_Weight_Cache.py
+Content-addressed store of weight files: hits and misses, the 'auto' unmapped action,
+and removal of the least recently used weight files
+'''
+
+import os
+import json
+import shutil
+import numpy as np
+import pytest
+
+from Regridding_ESMF import Regridding, Weight_Cache, grid_dataset_FV
+from test_Regridding_sparse import src_lat, src_lon, dst_grid, expected, wgt_file
+
+
+def store_file(cache, key, nbytes=1000):
+    temp_file = cache.temp_path( key )
+    with open( temp_file, 'wb' ) as fid:
+        fid.write( b'0' * nbytes )
+    return cache.store( key, temp_file, info={ 'pair_key':key } )
+
+
+def test_hit_and_miss(tmp_path):
+    cache = Weight_Cache( str( tmp_path / 'cache' ) )
+    src_grid = grid_dataset_FV( src_lat, src_lon )
+    key = cache.key( src_grid, dst_grid(), 'Conserve', 'error' )
+    assert cache.lookup( key ) == None
+
+    wgt_path = store_file( cache, key )
+    assert wgt_path == cache.path( key )
+    assert cache.lookup( key ) == wgt_path
+    # the same grids from files, other method or unmapped action
+    src_file = str( tmp_path / 'src.nc' )
+    src_grid.to_netcdf( src_file )
+    assert cache.key( src_file, dst_grid(), 'conserve', 'error' ) == key
+    assert cache.key( src_file, dst_grid(), 'bilinear', 'error' ) != key
+    assert cache.key( src_file, dst_grid(), 'Conserve', 'ignore' ) != key
+    assert not any( filename.endswith( '.tmp' ) for filename in os.listdir( cache.cache_dir ) )
+
+
+def test_auto_unmapped_action(wgt_file, tmp_path):
+    cache_dir = str( tmp_path / 'cache' )
+    cache = Weight_Cache( cache_dir )
+    src_grid = grid_dataset_FV( src_lat, src_lon )
+    keys = { action:cache.key( src_grid, dst_grid(), 'Conserve', action )
+             for action in ['error', 'ignore'] }
+    var = np.random.default_rng(0).random( (4, len(src_lat), len(src_lon)) )
+    kwargs = { 'dimension':['time','lat','lon'],
+               'dim_var':{ 'time':np.arange(4), 'lat':src_lat, 'lon':src_lon },
+               'src_grid_file':src_grid, 'dst_grid_file':dst_grid(), 'wgt_cache_dir':cache_dir,
+               'engine':'sparse', 'save_results':False, 'speed_up':False,
+               'creation_date':False, 'check_timings':False }
+
+    # weights of 'ignore' if those of 'error' are not available
+    shutil.copy( wgt_file, cache.temp_path( keys['ignore'] ) )
+    cache.store( keys['ignore'], cache.temp_path( keys['ignore'] ) )
+    regrid = Regridding( var, **kwargs )
+    assert regrid.wgt_file == cache.path( keys['ignore'] )
+    np.testing.assert_allclose( regrid.var_dst, expected(var), rtol=1e-12 )
+
+    # weights of 'error' first
+    shutil.copy( wgt_file, cache.temp_path( keys['error'] ) )
+    cache.store( keys['error'], cache.temp_path( keys['error'] ) )
+    assert Regridding( var, **kwargs ).wgt_file == cache.path( keys['error'] )
+    assert Regridding( var, unmapped_action='ignore', **kwargs ).wgt_file == \
+           cache.path( keys['ignore'] )
+
+
+def test_least_recently_used_removed(tmp_path):
+    cache = Weight_Cache( str( tmp_path / 'cache' ), max_size_gb=2500. / 1024.**3,
+                          grace_period=0. )
+    for key in ['a', 'b']:
+        store_file( cache, key )
+    # 'a' used after 'b'
+    with open( cache.index_file ) as fid:
+        index = json.load( fid )
+    index['a']['last_used'] = index['b']['last_used'] + 1.
+    cache.write_index( index )
+
+    store_file( cache, 'c' )
+    assert os.path.exists( cache.path( 'a' ) )
+    assert not os.path.exists( cache.path( 'b' ) )
+    assert os.path.exists( cache.path( 'c' ) )
+    assert sorted( cache.read_index().keys() ) == ['a', 'c']
+
+    # weight files used within the grace period are kept
+    cache.grace_period = 600.
+    store_file( cache, 'd' )
+    assert all( os.path.exists( cache.path( key ) ) for key in ['a', 'c', 'd'] )
+    assert os.path.exists( cache.lock_file )
@@ -0,0 +1,49 @@
+'''
+test_calc_grid_area_FV.py
+Exact spherical areas of lat/lon grid cells (cached)
+'''
+
+import numpy as np
+import pytest
+
+import Calc_Emis
+from Calc_Emis import calc_grid_area_FV
+
+
+# radius of the Earth [m]
+Earth_rad = 6.371e6
+
+
+@pytest.mark.parametrize( 'lat', [ np.arange( -89.5, 90., 1. ),
+                                   np.arange( -88., 90., 4. ),
+                                   np.arange( 88., -90., -4. ),
+                                   # Gaussian latitudes
+                                   np.degrees( np.arcsin( np.polynomial.legendre.leggauss( 64 )[0] ) ) ] )
+def test_area_of_sphere(lat):
+    lon = np.arange( 0., 360., 2.5 )
+    area = calc_grid_area_FV( lat, lon, Earth_rad=Earth_rad )
+    assert np.shape( area ) == ( len(lat), len(lon) )
+    assert np.all( area > 0 )
+    np.testing.assert_allclose( np.sum( area ), 4. * np.pi * Earth_rad**2, rtol=1e-12 )
+
+
+def test_area_of_latitude_band():
+    # cells between 30S and 30N: 2 pi R^2 ( sin(30) - sin(-30) )
+    lat = np.arange( -29.5, 30., 1. )
+    lat_bnds = np.stack( [ lat - 0.5, lat + 0.5 ], axis=1 )
+    lon = np.arange( 0.5, 360., 1. )
+    area = calc_grid_area_FV( lat, lon, lat_bnds=lat_bnds, Earth_rad=Earth_rad )
+    np.testing.assert_allclose( np.sum( area ), 2. * np.pi * Earth_rad**2, rtol=1e-12 )
+    # rows: 2 pi R^2 ( sin(north) - sin(south) ) / 360 per degree of longitude
+    np.testing.assert_allclose( area[:,0], 2. * np.pi * Earth_rad**2 / 360. * 
+                                np.diff( np.sin( np.radians( lat_bnds ) ), axis=1 )[:,0], rtol=1e-12 )
+
+
+def test_area_cache_bounded():
+    lon = np.arange( 0., 360., 10. )
+    area = calc_grid_area_FV( np.arange( -85., 90., 10. ), lon )
+    assert calc_grid_area_FV( np.arange( -85., 90., 10. ), lon ) is area
+    assert not area.flags.writeable
+    for shift in np.linspace( 0.01, 1., 40 ):
+        calc_grid_area_FV( np.arange( -85., 90., 10. ) + shift, lon )
+    assert len( Calc_Emis._grid_area_cache ) <= 16
@@ -0,0 +1,74 @@
+'''
+test_calc_time_info.py
+Calendar-aware time information (year, month, day, seconds of time steps), cached
+'''
+
+import numpy as np
+import xarray as xr
+import cftime
+import pytest
+
+from Calc_Emis import calc_time_info
+
+
+@pytest.mark.parametrize( 'calendar, feb_days', [ ('noleap', 28), ('360_day', 30), ('julian', 29),
+                                                  ('standard', 28), ('all_leap', 29) ] )
+def test_monthly(calendar, feb_days):
+    # monthly values of 1900 (a leap year only in the julian calendar)
+    time = np.array( [ cftime.datetime( 1900, month, 15, calendar=calendar ) 
+                       for month in range( 1, 13 ) ] )
+    info = calc_time_info( time )
+    assert info['interval'] == 'monthly'
+    np.testing.assert_array_equal( info['year'], 1900 )
+    np.testing.assert_array_equal( info['month'], np.arange( 1, 13 ) )
+    np.testing.assert_array_equal( info['day'], 15 )
+    days = np.array( [ cftime.datetime( 1900 + month // 12, month % 12 + 1, 1, calendar=calendar )
+                       - cftime.datetime( 1900, month, 1, calendar=calendar ) 
+                       for month in range( 1, 13 ) ] )
+    np.testing.assert_array_equal( info['nseconds'], [ dd.total_seconds() for dd in days ] )
+    assert info['nseconds'][1] == feb_days * 86400.
+    assert [ ( dd.year, dd.month, dd.day ) for dd in info['date'] ] == \
+           [ ( tt.year, tt.month, tt.day ) for tt in time ]
+
+
+@pytest.mark.parametrize( 'calendar', ['noleap', '360_day', 'julian', 'proleptic_gregorian'] )
+def test_daily(calendar):
+    time = cftime.num2date( np.arange( 0, 800 ) + 0.5, 'days since 1899-01-01', calendar=calendar )
+    info = calc_time_info( time )
+    assert info['interval'] == 'daily'
+    np.testing.assert_array_equal( info['nseconds'], 86400. )
+    np.testing.assert_array_equal( info['year'], [ tt.year for tt in time ] )
+    np.testing.assert_array_equal( info['month'], [ tt.month for tt in time ] )
+    np.testing.assert_array_equal( info['day'], [ tt.day for tt in time ] )
+
+
+def test_gregorian_reform():
+    # standard calendar: 4 October 1582 (julian) is followed by 15 October 1582
+    time = np.array( [ cftime.datetime( 1582, 10, 4, calendar='standard' ),
+                       cftime.datetime( 1582, 10, 15, calendar='standard' ) ] )
+    info = calc_time_info( time )
+    assert info['ndays'][1] - info['ndays'][0] == 1
+    np.testing.assert_array_equal( info['day'], [4, 15] )
+
+
+def test_time_bnds():
+    time = np.array( [ '2000-01-15', '2000-02-15' ], dtype='datetime64[ns]' )
+    time_bnds = np.array( [ [ '2000-01-01', '2000-02-01' ], [ '2000-02-01', '2000-03-01' ] ],
+                          dtype='datetime64[ns]' )
+    info = calc_time_info( time, time_bnds=time_bnds )
+    assert info['interval'] == 'time_bnds'
+    np.testing.assert_array_equal( info['nseconds'], [ 31 * 86400., 29 * 86400. ] )
+
+
+def test_cache():
+    time = cftime.num2date( np.arange( 12 ) * 30 + 15, 'days since 2001-01-01', calendar='360_day' )
+    info = calc_time_info( time )
+    assert calc_time_info( time ) is info
+    # pandas index of xarray: the same object for variables of a dataset
+    ds = xr.Dataset( { 'A':( ('time',), np.ones(12) ), 'B':( ('time',), np.ones(12) ) },
+                     coords={ 'time':time } )
+    info = calc_time_info( ds['A'].indexes['time'] )
+    assert calc_time_info( ds['B'].indexes['time'] ) is info
+    # dates are created when requested
+    assert 'date' not in info.keys()
+    assert len( info['date'] ) == 12
@@ -3,6 +3,9 @@ Calc_Emis.py
 this code is designed for calculating emission total amount in a specific region (or global)
 can be used for either finite volume or spectral element (+ regional refinement)
 (1) Emission calculation (class Calc_Emis_T)
+(2) Emission calculation for multiple species in a Dataset (class Calc_Emis_T_Dataset)
+(3) Emission calculation for many files in a process pool (class Calc_Emis_T_Files)
+(4) Spatial index of SE grid cells for region, nearest-cell, and radius queries (class SCRIP_Index)
 
 MODIFICATION HISTORY:
     Duseong Jo, 22, JAN, 2021: VERSION 1.00
@@ -21,14 +24,31 @@ MODIFICATION HISTORY:
     - in case xarray can't decode time variables
     Duseong Jo, 16, MAR, 2021: VERSION 2.20
     - Add additional vertical dimension variable to deal with CAMS-AIR
+    vivaldi_a contributors, 17, OCT, 2026: VERSION 3.00
+    - Performance and feature update (details in the git history):
+      batched and out-of-core (chunk_mb) totals, cached FV grid areas,
+      multiple/polygon/mask regions, multi-species Datasets (Calc_Emis_T_Dataset),
+      vectorized calendars, multi-file runs (Calc_Emis_T_Files), hybrid vertical
+      integration, lazy regional reads, summed-area tables (box_total),
+      SE spatial index (SCRIP_Index), and zonal bands
 '''
 
 ### Module import ###
 import numpy as np
 import xarray as xr
 import cftime
-import calendar
 import datetime
+import hashlib
+import weakref
+from scipy import sparse
+from scipy.spatial import cKDTree
+from matplotlib.path import Path
+import os
+import copy
+import pandas as pd
+import glob
+import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 
 class Calc_Emis_T(object):
@@ -52,16 +72,53 @@ class Calc_Emis_T(object):
                                        'lon':[-179.95,-179.85,...,179.85,179.95] }
                             dim_var = {'time':[2000-01-15,2000-02-15,...,2020-12-15],
                                        'ncol':[0,1,...,97417] }
+                      optional 'lat_bnds' and 'lon_bnds' (n x 2) are used for grid area
+                      optional 'time_bnds' (ntime x 2) is used for seconds of time intervals
+                      and 'calendar' for the calendar of 'time' (default: standard)
+                      for hybrid sigma-pressure levels ('lev' dimension with 'hyai' and 
+                      'hybi'), 'hyai', 'hybi', 'P0' (default: 1e5 Pa), 'PS', and 'T' 
+                      (for per volume units) are used (also taken from xarray coordinates
+                      if available). Without hyai/hybi, 'lev' is handled as 'level'
            unit: unit of the provided emission array
                  e.g., unit = 'molecules/cm2/s', 'kg/m2/s'
+                 for hybrid levels, also per volume ('molecules/cm3/s', 'kg/m3/s') or 
+                 mixing ratio tendency ('kg/kg/s', 'mol/mol/s') units
            mw: molecular weight of the species in g/mol (e.g., 28 for CO)
                if provided, it overwrites mw of xarray (if available)
            date_range: 2-elements list with date ranges to calculate emissions
                        e.g., [2000,05,01, 2001,04,30]
            lon_range: 2-elements list with longitude ranges to calculate emissions
            lat_range: 2-elements list with latitude ranges to calculate emissions
+           regions: dictionary of regions for batch calculation in a single pass,
+                    results are saved in emissions_region (region x time)
+                    e.g., regions = {'EUS':[[-95,-75],[25,50]], 'EAS':[[100,150],[20,50]]}
+                    ([lon_range, lat_range], lon_range can cross the dateline, e.g. [170,-170])
+                    a region can also be a polygon or a region mask, with fractional 
+                    coverage of partially covered cells (nsub x nsub points per cell)
+                    e.g., {'polygon':[[lon1,lat1],[lon2,lat2],...], 'nsub':10}
+                          {'mask':xarray (lat,lon) mask, 'value':3}
+           region_cache_dir: directory to save/read region membership of grid cells,
+                             so that it is calculated only once per grid and regions
+                             (and the spatial index of the scrip file for SE grids)
            ndays: number of days for emission arrays when time dimension doesn't exist
            scrip_file: a scrip filename for spectral element model output 
+           chunk_mb: if provided, out-of-core mode - the emission array is not loaded 
+                     into memory at once, but read and reduced chunk by chunk along time,
+                     each chunk being about chunk_mb megabytes. 
+                     var can be a lazily opened (or dask-backed) xarray variable
+           summed_area: if True (or a .npy filename to save/memory-map), a summed-area 
+                        table of emissions for each time step is calculated (FV only),
+                        so that totals of any lon/lat box are calculated with 
+                        four lookups per time step (box_total method).
+                        A saved table is reused only if the emission values, grid area,
+                        time selection, and vertical weights are the same (a key
+                        saved in the .npy filename + '.key' file)
+                        e.g., emis = Calc_Emis_T( var, summed_area=True )
+                              emis.box_total( [100,150], [20,50] )
+           zonal_bands: latitude band width in degrees (e.g., 5) or band edges 
+                        (e.g., [-90,-30,0,30,90]) for a zonal breakdown in the same pass,
+                        results are saved in emissions_zonal (time x band) with band edges
+                        in zonal_edges (cells are assigned to bands by center latitudes)
            print_results: print results?
            ignore_warning: ignore warning?
            verbose: Display detailed information on what is being done
@@ -69,7 +126,8 @@ class Calc_Emis_T(object):
     
     def __init__(self, var, dimension=[], dim_var={}, unit='', mw=None,
                  date_range=[], lon_range=[], lat_range=[], 
-                 ndays=31, scrip_file="", print_results=True, ignore_warning=False,
+                 regions=None, region_cache_dir=None, ndays=31, scrip_file="", chunk_mb=None, 
+                 summed_area=None, zonal_bands=None, print_results=True, ignore_warning=False, 
                  verbose=False):
         
         # ========================================================================
@@ -79,7 +137,6 @@ class Calc_Emis_T(object):
         if type(var) in [ xr.core.dataset.Dataset, xr.core.dataarray.DataArray ]:
             self.xarray_flag = True
             
-            self.var = var.values
             self.dimension = list( var.dims )
             self.dim_var = {}
             for dim in self.dimension:
@@ -87,43 +144,45 @@ class Calc_Emis_T(object):
                     self.dim_var[dim] = dim_var[dim]
                 else:
                     self.dim_var[dim] = np.copy( var[dim].values )
-            self.attrs = list( var.attrs.keys() )
+            # cell bounds for the area calculation if available
+            for bnd in ['lat_bnds', 'lon_bnds', 'time_bnds']:
+                if bnd in dim_var.keys():
+                    self.dim_var[bnd] = dim_var[bnd]
+                elif bnd in var.coords:
+                    if bnd == 'time_bnds':
+                        # not modified: the same array for the same dataset (cached time info)
+                        self.dim_var[bnd] = var[bnd].values
+                    else:
+                        self.dim_var[bnd] = np.copy( var[bnd].values )
+            # hybrid sigma-pressure coefficients, surface pressure, and temperature
+            # (PS and T are kept as provided and read for each time step)
+            for hyb in ['hyai', 'hybi', 'P0', 'PS', 'T']:
+                if hyb in dim_var.keys():
+                    self.dim_var[hyb] = dim_var[hyb]
+                elif hyb in var.coords:
+                    self.dim_var[hyb] = var[hyb]
+            # calendar of the time dimension
+            self.time_attrs = {}
+            self.time_index = None
+            if 'time' in self.dimension:
+                self.time_attrs.update( var['time'].attrs )
+                self.time_attrs.update( var['time'].encoding )
+                # the same index object for the same dataset (key of cached time info)
+                if ( 'time' not in dim_var.keys() ) & ( 'time' in var.indexes ):
+                    self.time_index = var.indexes['time']
             
-            if unit != '':
-                self.unit = unit.lower()
-            elif 'unit' in self.attrs:
-                self.unit = var.unit.lower()
-            elif 'units' in self.attrs:
-                self.unit = var.units.lower()
-            else:  
-                raise ValueError( "xarray doesn't have an unit attribute, " + \
-                                  "unit keyword must be provided" )
-            
-            if mw != None:
-                self.mw = mw
-                
-            elif 'molecular_weight' in self.attrs:
-                if type( var.molecular_weight ) == str:
-                    self.mw = np.copy( var.molecular_weight.replace('.f','') ).astype('f')
-                elif type( var.molecular_weight ) in [int, float, np.float32, np.float64]:
-                    self.mw = np.copy( var.molecular_weight ).astype('f')
-                else:
-                    raise ValueError( "Check molecular weight variable in NetCDF file!" )
-            else:
-                raise ValueError( "input array doesn't have an molecular weight attribute, " + \
-                                  "mw keyword must be provided" )
-              
-                    
-            if 'molecular_weight_units' in self.attrs:
-                self.mw_unit = var.molecular_weight_units.lower()
-            else:
-                if not ignore_warning:
-                    print( 'Warning: the unit of molecular weight is not available, ' + \
-                           'assuming g/mol')
+            # emission values, unit, and molecular weight
+            self.set_species( var, unit=unit, mw=mw, chunk_mb=chunk_mb, 
+                              ignore_warning=ignore_warning )
 
         else:
             self.xarray_flag = False
-            self.var = np.copy( var )
+            self.time_index = None
+            self.var_name = None
+            if chunk_mb == None:
+                self.var = np.asarray( var ) # not modified, no need to copy
+            else:
+                self.var = var # e.g., np.memmap or netCDF4 variable, read by chunk
             
             if dimension == []:
                 raise ValueError( '"dimension" must be provided for non-xarray varaible' )
@@ -162,6 +221,12 @@ class Calc_Emis_T(object):
             self.region_calc = True
             
         
+        # regions check
+        if regions != None:
+            if type(regions) != dict:
+                raise ValueError( '"regions" must be a dictionary, ' + \
+                                  'e.g., {"EAS":[[100,150],[20,50]]}' )
+        
         # Check whether the grid is FV or SE
         if 'ncol' in self.dimension:
             self.grid_type = 'SE'
@@ -171,16 +236,45 @@ class Calc_Emis_T(object):
             raise ValueError( 'Check dimensions!' )
          
         # Check altitude/vertical coordinatess
+        self.hybrid = False
         if 'altitude' in self.dimension:
             self.vert = True
             self.vert_name = 'altitude'
         elif 'level' in self.dimension:
             self.vert = True
             self.vert_name = 'level'
+        elif 'lev' in self.dimension:
+            self.vert = True
+            self.vert_name = 'lev'
+            # hybrid sigma-pressure levels (CAM-chem) if the coefficients are provided,
+            # otherwise layer thickness from lev values as for 'level'
+            if ( 'hyai' in self.dim_var.keys() ) & ( 'hybi' in self.dim_var.keys() ):
+                self.hybrid = True
         else:
             self.vert = False
             
-        if self.vert:
+        if self.hybrid:
+            
+            self.vert_mid = self.dim_var[self.vert_name]
+            
+            for hyb in ['hyai', 'hybi', 'PS']:
+                if hyb not in self.dim_var.keys():
+                    raise ValueError( '"' + hyb + '" must be provided in dim_var ' + \
+                                      'for hybrid sigma-pressure levels (lev)' )
+            self.hyai = np.asarray( self.dim_var['hyai'], dtype='f8' )
+            self.hybi = np.asarray( self.dim_var['hybi'], dtype='f8' )
+            if 'P0' in self.dim_var.keys():
+                self.P0 = float( np.asarray( self.dim_var['P0'] ) )
+            else:
+                self.P0 = 1e5 # Pa
+            if len(self.hyai) != len(self.vert_mid) + 1:
+                raise ValueError( 'Check hyai/hybi! Their length must be (number of lev) + 1' )
+            
+            # layer weights are calculated from PS for each time step, 
+            # no additional thickness afterwards
+            self.vert_thick = np.ones( len(self.vert_mid) )
+            
+        elif self.vert:
 
             self.vert_mid = self.dim_var[self.vert_name]
 
@@ -188,23 +282,20 @@ class Calc_Emis_T(object):
                 self.vert_int = self.dim_var['altitude_int']
             else:
                 self.vert_int = np.zeros( len(self.vert_mid)+1 )
-                for vi in np.arange( len(self.vert_mid)-1 ):
-                    self.vert_int[vi] = self.vert_mid[vi] - \
-                                        (self.vert_mid[vi+1] - self.vert_mid[vi]) / 2.
+                self.vert_int[:-2] = self.vert_mid[:-1] - np.diff( self.vert_mid ) / 2.
                 self.vert_int[-1] = self.vert_mid[-1] + \
                                     (self.vert_mid[-1] - self.vert_mid[-2]) / 2.
                 self.vert_int[-2] = self.vert_mid[-2] + \
                                     (self.vert_mid[-2] - self.vert_mid[-3]) / 2.
             
             # Thickness
-            self.vert_thick = np.zeros( len(self.vert_mid) )
-
             if self.xarray_flag:
-                if var[self.vert_name].units == 'km':
+                vert_unit = var[self.vert_name].attrs.get( 'units' )
+                if vert_unit == 'km':
                     self.vert_fac = 1000
-                elif var[self.vert_name].units == 'm':
+                elif vert_unit == 'm':
                     self.vert_fac = 1
-                elif var[self.vert_name].units == 'cm':
+                elif vert_unit == 'cm':
                     self.vert_fac = 0.1
                 else:
                     if not ignore_warning:
@@ -217,8 +308,7 @@ class Calc_Emis_T(object):
                                'assuming km')
                     self.vert_fac = 1000                
                 
-            for vi in np.arange( len(self.vert_mid) ):
-                self.vert_thick[vi] = (self.vert_int[vi+1] - self.vert_int[vi]) * self.vert_fac
+            self.vert_thick = np.diff( self.vert_int ) * self.vert_fac
 
             
         # Read scrip file in case of SE model output
@@ -237,9 +327,15 @@ class Calc_Emis_T(object):
             self.grid_area_rad2 = np.copy( ds_scrip.grid_area.values )
 
         # Save remaining input keywords info
+        self.regions = regions
+        self.region_cache_dir = region_cache_dir
+        self.scrip_index = None
         self.ndays = ndays
         self.date_range = date_range
         self.scrip_file = scrip_file
+        self.chunk_mb = chunk_mb
+        self.summed_area = summed_area
+        self.zonal_bands = zonal_bands
         self.print_results = print_results
         self.verbose = verbose
         # === END Error check and pass input values to class-accessible values ===
@@ -269,7 +365,7 @@ class Calc_Emis_T(object):
         if 'time' in self.dimension:
             self.construct_time_array()
         
-        # convert emission unit first: any unit to kg/m2/s
+        # conversion factor of emission unit: any unit to kg/m2/s
         self.convert_unit()
         
         # calculate grid area in m2
@@ -277,6 +373,10 @@ class Calc_Emis_T(object):
 
         # calculate emissions in Gg
         self.calc_emis()
+        
+        # summed-area table for box totals
+        if self.summed_area not in [None, False]:
+            self.calc_summed_area()
 
         # print results
         if self.print_results:
@@ -295,13 +395,75 @@ class Calc_Emis_T(object):
                            str(self.emissions_total[ti]/1e6) )
             else:
                     print( str(self.emissions_total/1e6) )
+            
+            if self.regions != None:
+                print( 'region, emissions [Gg]' )
+                for ri, name in enumerate(self.region_names):
+                    print( name + ', ' + str( np.sum( self.emissions_region[ri] )/1e6 ) )
+            
+            if self.zonal_bands is not None:
+                print( 'latitude band, emissions [Gg]' )
+                zonal_sum = np.reshape( self.emissions_zonal, (-1, len(self.zonal_lat)) )
+                for bi in np.arange( len(self.zonal_lat) ):
+                    print( str(self.zonal_edges[bi]) + ' ~ ' + str(self.zonal_edges[bi+1]) + \
+                           ', ' + str( np.sum( zonal_sum[:,bi] )/1e6 ) )
 
+    # ========================================================================
+    # ======================= Species (variable) info ========================
+    # ========================================================================
+    def set_species(self, var, unit='', mw=None, chunk_mb=None, ignore_warning=False):
+        '''
+        Set emission values, unit, and molecular weight from an xarray variable.
+        Also used to reuse grid/time/area information for another species 
+        on the same grid (see Calc_Emis_T_Dataset)
+        '''
+        # values are not loaded here: lazily opened (or dask-backed) values are read
+        # only for the region of the calculation (and by chunk in out-of-core mode)
+        self.var = var.variable
+        self.var_name = var.name
+        self.attrs = list( var.attrs.keys() )
+        
+        if unit != '':
+            self.unit = unit.lower()
+        elif 'unit' in self.attrs:
+            self.unit = var.unit.lower()
+        elif 'units' in self.attrs:
+            self.unit = var.units.lower()
+        else:  
+            raise ValueError( "xarray doesn't have an unit attribute, " + \
+                              "unit keyword must be provided" )
+        
+        if mw != None:
+            self.mw = mw
+            
+        elif 'molecular_weight' in self.attrs:
+            if type( var.molecular_weight ) == str:
+                self.mw = np.copy( var.molecular_weight.replace('.f','') ).astype('f')
+            elif type( var.molecular_weight ) in [int, float, np.float32, np.float64]:
+                self.mw = np.copy( var.molecular_weight ).astype('f')
+            else:
+                raise ValueError( "Check molecular weight variable in NetCDF file!" )
+        else:
+            raise ValueError( "input array doesn't have an molecular weight attribute, " + \
+                              "mw keyword must be provided" )
+          
+                
+        if 'molecular_weight_units' in self.attrs:
+            self.mw_unit = var.molecular_weight_units.lower()
+        else:
+            if not ignore_warning:
+                print( 'Warning: the unit of molecular weight is not available, ' + \
+                       'assuming g/mol')
+    # ===================== END Species (variable) info ======================
+    # ========================================================================
+    
     # ========================================================================
     # =========================== Unit conversion ============================
     # ========================================================================
-    # convert any unit to kg/m2/s
+    # conversion factor from any unit to kg/m2/s
     def convert_unit(self):
         Avo = 6.022e23 # molecules / mole
+        Mw_air = 28.966 # g/mol, dry air
         
         self.conversion_factor = 1.
         if self.unit in ['molecules/cm2/s', 'molecules cm-2 s-1', 'molecules/cm^2/s']:
@@ -312,10 +474,31 @@ class Calc_Emis_T(object):
             self.conversion_factor *= (self.mw / 1e3) / Avo
         elif self.unit in ['kg/m2/s', 'kg m-2 s-1']:
             self.conversion_factor = 1.
+        elif self.unit in ['kg/m3/s', 'kg m-3 s-1']:
+            self.conversion_factor = 1.
+        elif self.unit in ['kg/kg/s', 'kg kg-1 s-1']:
+            self.conversion_factor = 1.
+        elif self.unit in ['mol/mol/s', 'mol mol-1 s-1']:
+            self.conversion_factor *= self.mw / Mw_air # kg/kg/s
         else:
             raise ValueError( "This unit is currently not supported: ", self.unit )
         
-        self.var_kg_m2_s = self.var * self.conversion_factor    
+        # per volume units are integrated over layer thickness (m), 
+        # mixing ratio tendencies over layer air mass (kg/m2)
+        if self.unit in ['kg/kg/s', 'kg kg-1 s-1', 'mol/mol/s', 'mol mol-1 s-1']:
+            if not self.hybrid:
+                raise ValueError( 'Mixing ratio tendency (' + self.unit + ') is supported ' + \
+                                  'for hybrid sigma-pressure levels (lev) only' )
+            self.vert_weight = 'mass'
+        else:
+            self.vert_weight = 'thickness'
+        if ( self.hybrid ) & ( self.vert_weight == 'thickness' ) & \
+           ( 'T' not in self.dim_var.keys() ):
+            raise ValueError( '"T" (temperature) must be provided in dim_var to calculate ' + \
+                              'layer thickness of hybrid sigma-pressure levels' )
+        
+        # the conversion factor is a scalar, applied to the time weights in calc_emis
+        # instead of the full emission array
     # ========================== END Unit conversion =========================
     # ========================================================================
     
@@ -333,31 +516,11 @@ class Calc_Emis_T(object):
             if 'lon' not in self.dim_var.keys():
                 raise ValueError( 'Check your dimension variables! ' + \
                                   'Longitude (lon) values are not available' )              
-                       
-            self.grid_area = np.zeros( ( len(self.dim_var['lat']), 
-                                         len(self.dim_var['lon']) ) )
-            
-            for jj in np.arange( len(self.dim_var['lat']) ):
-                if (jj == 0) & ( (self.dim_var['lat'][jj] + 90.) < 0.001 ):
-                    self.dlat = self.dim_var['lat'][jj+1] - self.dim_var['lat'][jj]
-                    self.dlon = self.dim_var['lon'][jj+1] - self.dim_var['lon'][jj]
-                    sedge = ( self.dim_var['lat'][jj] ) * np.pi / 180.
-                    nedge = ( self.dim_var['lat'][jj] + self.dlat / 2. ) * np.pi / 180.
-                elif (jj == len(self.dim_var['lat'])-1) & ( (self.dim_var['lat'][jj] - 90.) < 0.001 ):
-                    self.dlat = self.dim_var['lat'][jj] - self.dim_var['lat'][jj-1]
-                    self.dlon = self.dim_var['lon'][jj] - self.dim_var['lon'][jj-1]
-                    sedge = ( self.dim_var['lat'][jj] - self.dlat / 2. ) * np.pi / 180.
-                    nedge = ( self.dim_var['lat'][jj] ) * np.pi / 180.
-                else:
-                    self.dlat = self.dim_var['lat'][jj+1] - self.dim_var['lat'][jj]
-                    self.dlon = self.dim_var['lon'][jj+1] - self.dim_var['lon'][jj]                    
-                    sedge = ( self.dim_var['lat'][jj] - self.dlat / 2. ) * np.pi / 180.
-                    nedge = ( self.dim_var['lat'][jj] + self.dlat / 2. ) * np.pi / 180.
-                    
-                    
-                self.grid_area[jj,:] = self.dlon * (np.pi/180.) * Earth_rad**(2) \
-                                       * ( np.sin(nedge) - np.sin(sedge) )
             
+            self.grid_area = calc_grid_area_FV( self.dim_var['lat'], self.dim_var['lon'],
+                                                lat_bnds=self.dim_var.get('lat_bnds'),
+                                                lon_bnds=self.dim_var.get('lon_bnds'),
+                                                Earth_rad=Earth_rad )
                 
         elif self.grid_type == 'SE':
             
@@ -374,274 +537,795 @@ class Calc_Emis_T(object):
     # ========================================================================
     def calc_emis(self):
         
+        # ===== Spatial selection: index and area for the region =====
+        # the region is read as hyperslabs (FV) or an index set (SE), so that
+        # only the region is read from lazily opened files
         if self.region_calc:
             if self.grid_type == 'FV':
-            
-                self.lon_inds = np.where( (self.dim_var['lon'] >= self.lon_range[0]) & \
-                                          (self.dim_var['lon'] <= self.lon_range[1]) )[0]
+                self.lon_inds = np.where( lon_in_range( self.dim_var['lon'], 
+                                                        self.lon_range ) )[0]
                 self.lat_inds = np.where( (self.dim_var['lat'] >= self.lat_range[0]) & \
                                           (self.dim_var['lat'] <= self.lat_range[1]) )[0]
-                if 'time' in self.dimension:
-                    self.emissions_total = np.zeros( len(self.dim_var['time']) )
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( (len(self.dim_var['time']),
-                                                            len(self.dim_var[self.vert_name])) )
-                        for ti in self.time_inds:
-                            for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                                self.emissions_total_v[ti,vi] = \
-                                    np.sum(self.var_kg_m2_s[ti,vi, 
-                                                            self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                            self.lon_inds[0]:self.lon_inds[-1]+1] \
-                                     * self.grid_area[self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                      self.lon_inds[0]:self.lon_inds[-1]+1]) \
-                                * self.time_nseconds[ti] * self.vert_thick[vi]
-                            
-                            self.emissions_total[ti] = np.sum( self.emissions_total_v[ti,:] )
-
-                    else:
-                        for ti in self.time_inds:
-                            self.emissions_total[ti] = \
-                              np.sum(self.var_kg_m2_s[ti,self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                         self.lon_inds[0]:self.lon_inds[-1]+1] \
-                                     * self.grid_area[self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                      self.lon_inds[0]:self.lon_inds[-1]+1]) \
-                              * self.time_nseconds[ti]
-                        
-                else:
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( len(self.dim_var[self.vert_name]) )
-                        for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                            self.emissions_total_v[vi] = np.sum( \
-                                    self.var_kg_m2_s[vi, self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                         self.lon_inds[0]:self.lon_inds[-1]+1] \
-                                         * self.grid_area[self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                          self.lon_inds[0]:self.lon_inds[-1]+1] ) \
-                                         * self.ndays * 86400. * self.vert_thick[vi]
-                            
-                        self.emissions_total = np.sum( self.emissions_total_v )
-                        
-                    else:
-                        self.emissions_total = np.sum( \
-                                     self.var_kg_m2_s[self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                      self.lon_inds[0]:self.lon_inds[-1]+1] \
-                                     * self.grid_area[self.lat_inds[0]:self.lat_inds[-1]+1,
-                                                      self.lon_inds[0]:self.lon_inds[-1]+1] ) \
-                                     * self.ndays * 86400.
-                    
+                if ( len(self.lon_inds) == 0 ) | ( len(self.lat_inds) == 0 ):
+                    raise ValueError( 'No grid cells in lon_range/lat_range!' )
+                # contiguous runs of longitude indices, e.g., two runs for a range 
+                # across the dateline (or the edge of the longitude array), 
+                # each read and summed separately without a rolled copy
+                lon_runs = np.split( self.lon_inds, 
+                                     np.where( np.diff( self.lon_inds ) > 1 )[0] + 1 )
+                self.space_pieces = [ ( slice( self.lat_inds[0], self.lat_inds[-1]+1 ),
+                                        slice( run[0], run[-1]+1 ) ) for run in lon_runs ]
             elif self.grid_type == 'SE':
-                self.ncol_inds = np.where( \
-                                   ( self.dim_var['center_lon'] >= self.lon_range[0] ) & \
-                                   ( self.dim_var['center_lon'] <= self.lon_range[-1] ) & \
-                                   ( self.dim_var['center_lat'] >= self.lat_range[0] ) & \
-                                   ( self.dim_var['center_lat'] <= self.lat_range[-1] ) )[0]
-                if 'time' in self.dimension:
-                    self.emissions_total = np.zeros( len(self.dim_var['time']) )
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( (len(self.dim_var['time']),
-                                                            len(self.dim_var[self.vert_name])) )
-                        for ti in self.time_inds:
-                            for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                                self.emissions_total_v[ti,vi] = \
-                                      np.sum(self.var_kg_m2_s[ti,vi,self.ncol_inds] \
-                                                   * self.grid_area[self.ncol_inds]) \
-                                                   * self.time_nseconds[ti] * self.vert_thick[vi]
-                            self.emissions_total[ti] = np.sum( self.emissions_total_v[ti,:] )
-                    else:
-                        for ti in self.time_inds:
-                            self.emissions_total[ti] = np.sum(self.var_kg_m2_s[ti,self.ncol_inds] \
-                                                      * self.grid_area[self.ncol_inds]) \
-                                                      * self.time_nseconds[ti]
+                self.ncol_inds = self.cells_in_box( self.lon_range, self.lat_range )
+                if len(self.ncol_inds) == 0:
+                    raise ValueError( 'No grid cells in lon_range/lat_range!' )
+                self.space_pieces = [ ( self.ncol_inds, ) ]
+        else:
+            self.space_pieces = [ ( slice(None), ) * np.ndim( self.grid_area ) ]
+        
+        # ===== Batch regions: read the full grid once for all regions =====
+        if self.regions != None:
+            self.calc_region_matrix()
+            read_pieces = [ ( slice(None), ) * np.ndim( self.grid_area ) ]
+            if self.region_calc:
+                # area of the lon_range/lat_range region on the full grid
+                area_full = np.zeros( np.shape( self.grid_area ) )
+                for piece in self.space_pieces:
+                    area_full[piece] = self.grid_area[piece]
+                area_pieces = [ area_full ]
+            else:
+                area_pieces = [ self.grid_area ]
+        else:
+            read_pieces = self.space_pieces
+            area_pieces = [ self.grid_area[piece] for piece in self.space_pieces ]
+        
+        # ===== Region and latitude band weights of each piece =====
+        # regions and bands are rows of a single sparse matrix for each piece
+        nregion = len(self.region_names) if self.regions != None else 0
+        if self.zonal_bands is not None:
+            self.calc_zonal_band()
+        piece_matrices = []
+        for area_piece, read_piece in zip( area_pieces, read_pieces ):
+            matrices = []
+            if self.regions != None:
+                matrices.append( self.region_matrix )
+            if self.zonal_bands is not None:
+                matrices.append( self.zonal_matrix( area_piece, read_piece ) )
+            if len(matrices) > 0:
+                piece_matrices.append( sparse.vstack( matrices ).tocsr() )
+            else:
+                piece_matrices.append( None )
+        
+        # ===== Time selection and seconds per time step =====
+        time_weight = self.calc_time_weight()
+        
+        # ===== Area-weighted contraction over (time, level, space) =====
+        # emission * m2 summed over the spatial axes for all time steps and levels at once
+        emis_rate, emis_rate_matrix = self.contract_blocks( area_pieces[0], read_pieces[0],
+                                                            matrix=piece_matrices[0] )
+        for area_piece, read_piece, matrix in zip( area_pieces[1:], read_pieces[1:],
+                                                   piece_matrices[1:] ):
+            rate, rate_matrix = self.contract_blocks( area_piece, read_piece, matrix=matrix )
+            emis_rate = emis_rate + rate
+            if matrix is not None:
+                emis_rate_matrix = emis_rate_matrix + rate_matrix
+        
+        # seconds (time) and thickness (vertical) applied as broadcast vectors
+        emis_tv = self.apply_weights( emis_rate, time_weight )
+        
+        if 'time' in self.dimension:
+            self.emissions_total = np.zeros( len(self.dim_var['time']) )
+            if self.vert:
+                self.emissions_total_v = np.zeros( (len(self.dim_var['time']),
+                                                    len(self.dim_var[self.vert_name])) )
+                self.emissions_total_v[self.time_inds,:] = emis_tv
+                self.emissions_total[self.time_inds] = np.sum( emis_tv, axis=-1 )
+            else:
+                self.emissions_total[self.time_inds] = emis_tv
+        else:
+            if self.vert:
+                self.emissions_total_v = emis_tv
+                self.emissions_total = np.sum( emis_tv )
+            else:
+                self.emissions_total = emis_tv
+        
+        # ===== Region x time table =====
+        if self.regions != None:
+            # region axis first: (region, time, vertical)
+            emis_tv_region = self.apply_weights( np.moveaxis( 
+                                                 emis_rate_matrix[...,:nregion], -1, 0 ),
+                                                 time_weight )
+            if self.vert:
+                emis_t_region = np.sum( emis_tv_region, axis=-1 )
+            else:
+                emis_t_region = emis_tv_region
+            
+            if 'time' in self.dimension:
+                self.emissions_region = np.zeros( ( len(self.region_names), 
+                                                    len(self.dim_var['time']) ) )
+                self.emissions_region[:,self.time_inds] = emis_t_region
+                if self.vert:
+                    self.emissions_region_v = np.zeros( ( len(self.region_names), 
+                                                          len(self.dim_var['time']),
+                                                          len(self.dim_var[self.vert_name]) ) )
+                    self.emissions_region_v[:,self.time_inds,:] = emis_tv_region
+            else:
+                self.emissions_region = emis_t_region
+                if self.vert:
+                    self.emissions_region_v = emis_tv_region
+        
+        # ===== Time x latitude band table =====
+        if self.zonal_bands is not None:
+            # band axis last: (time, vertical, band)
+            emis_tv_zonal = np.moveaxis( self.apply_weights( np.moveaxis( 
+                                         emis_rate_matrix[...,nregion:], -1, 0 ), 
+                                         time_weight ), 0, -1 )
+            if self.vert:
+                emis_t_zonal = np.sum( emis_tv_zonal, axis=-2 )
+            else:
+                emis_t_zonal = emis_tv_zonal
+            
+            nband = len(self.zonal_lat)
+            if 'time' in self.dimension:
+                self.emissions_zonal = np.zeros( ( len(self.dim_var['time']), nband ) )
+                self.emissions_zonal[self.time_inds,:] = emis_t_zonal
+                if self.vert:
+                    self.emissions_zonal_v = np.zeros( ( len(self.dim_var['time']),
+                                                         len(self.dim_var[self.vert_name]),
+                                                         nband ) )
+                    self.emissions_zonal_v[self.time_inds,:,:] = emis_tv_zonal
+            else:
+                self.emissions_zonal = emis_t_zonal
+                if self.vert:
+                    self.emissions_zonal_v = emis_tv_zonal
     
-                else:
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( len(self.dim_var[self.vert_name]) )
-                        for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                            self.emissions_total_v[vi] = np.sum(self.var_kg_m2_s[vi,self.ncol_inds] \
-                                                      * self.grid_area[self.ncol_inds]) \
-                                                      * self.ndays * 86400. * self.vert_thick[vi]
-                        self.emissions_total = np.sum( self.emissions_total_v )
-                    else:
-                        self.emissions_total = np.sum(self.var_kg_m2_s[self.ncol_inds] \
-                                              * self.grid_area[self.ncol_inds]) \
-                                              * self.ndays * 86400.
-
+    
+    # ===== Seconds per time step with the unit conversion factor =====
+    def calc_time_weight(self):
+        '''
+        (emission unit * m2) -> kg/s -> kg for the selected time steps
+        '''
+        if 'time' in self.dimension:
+            return self.time_nseconds[self.time_inds] * self.conversion_factor
+        else:
+            return np.array( self.ndays * 86400. * self.conversion_factor )
+    
+    
+    # ===== Apply seconds per time step and layer thickness =====
+    def apply_weights(self, emis_rate, time_weight):
+        '''
+        emis_rate: area-weighted emissions with trailing (time, vertical) axes as available
+        time_weight: seconds per time step multiplied by the unit conversion factor
+        '''
+        if self.vert:
+            return emis_rate * time_weight[..., np.newaxis] * self.vert_thick
+        else:
+            return emis_rate * time_weight
+    
+    
+    # ===== Membership matrix of batch regions =====
+    def calc_region_matrix(self):
+        '''
+        Sparse (region x grid cell) matrix with grid area (m2) of cells in each region,
+        multiplied by the fraction of each cell covered by the region,
+        so that all region totals are a single weighted gather (sparse matrix product).
+        The matrix is cached per grid and region definitions in this session
+        (the last max_cache matrices), and saved to (read from) region_cache_dir if provided
+        '''
+        # number of region matrices kept in memory
+        max_cache = 16
+        
+        self.region_names = list( self.regions.keys() )
+        
+        if self.grid_type == 'FV':
+            grid_items = [ self.dim_var['lat'], self.dim_var['lon'], 
+                           self.dim_var.get('lat_bnds'), self.dim_var.get('lon_bnds') ]
+        elif self.grid_type == 'SE':
+            grid_items = [ self.dim_var['center_lon'], self.dim_var['center_lat'],
+                           self.dim_var['corner_lon'], self.dim_var['corner_lat'] ]
+        key = grid_fingerprint( self.grid_type, grid_items, self.grid_area, self.region_names,
+                                [ self.regions[name] for name in self.region_names ] )
+        
+        if key in _region_matrix_cache:
+            self.region_matrix = _region_matrix_cache[key]
+            return
+        
+        if self.region_cache_dir != None:
+            cache_file = os.path.join( self.region_cache_dir, 'region_matrix_' + key + '.npz' )
+            if os.path.exists( cache_file ):
+                if self.verbose:
+                    print( 'Read region membership file:', cache_file )
+                self.region_matrix = sparse.load_npz( cache_file ).tocsr()
+                if len( _region_matrix_cache ) >= max_cache:
+                    _region_matrix_cache.pop( next( iter( _region_matrix_cache ) ) )
+                _region_matrix_cache[key] = self.region_matrix
+                return
+        
+        self.set_cell_geometry()
+        
+        rows = []
+        cols = []
+        fracs = []
+        for ri, name in enumerate( self.region_names ):
+            inds, frac = self.region_membership( self.regions[name] )
+            rows.append( np.full( len(inds), ri ) )
+            cols.append( inds )
+            fracs.append( frac )
+        rows = np.concatenate( rows )
+        cols = np.concatenate( cols )
+        fracs = np.concatenate( fracs )
+        
+        area = np.ravel( self.grid_area )
+        self.region_matrix = sparse.csr_matrix( ( area[cols] * fracs, (rows, cols) ), 
+                                                shape=( len(self.region_names), len(area) ) )
+        if len( _region_matrix_cache ) >= max_cache:
+            _region_matrix_cache.pop( next( iter( _region_matrix_cache ) ) )
+        _region_matrix_cache[key] = self.region_matrix
+        
+        if self.region_cache_dir != None:
+            os.makedirs( self.region_cache_dir, exist_ok=True )
+            sparse.save_npz( cache_file, self.region_matrix )
+            if self.verbose:
+                print( 'Save region membership file:', cache_file )
+    
+    
+    # ===== Latitude band of grid cells =====
+    def calc_zonal_band(self):
+        '''
+        Band edges (zonal_edges), centers (zonal_lat), and the band of each grid cell 
+        by its center latitude (zonal_band, -1 outside the bands), per latitude 
+        for FV (nlat x 1) and per column for SE (ncol), cached per grid and bands
+        '''
+        # number of band assignments kept in memory
+        max_cache = 16
+        
+        if np.ndim( self.zonal_bands ) == 0:
+            self.zonal_edges = np.append( np.arange( -90., 90., self.zonal_bands ), 90. )
         else:
+            self.zonal_edges = np.asarray( self.zonal_bands, dtype='f8' )
+        self.zonal_lat = ( self.zonal_edges[:-1] + self.zonal_edges[1:] ) / 2.
+        
+        if self.grid_type == 'FV':
+            cell_lat = self.dim_var['lat']
+        elif self.grid_type == 'SE':
+            cell_lat = self.dim_var['center_lat']
+        key = grid_fingerprint( self.grid_type, np.asarray( cell_lat, dtype='f8' ), 
+                                self.zonal_edges )
+        
+        if key not in _zonal_band_cache:
+            nband = len(self.zonal_lat)
+            band = np.searchsorted( self.zonal_edges, cell_lat, side='right' ) - 1
+            # the last edge is included in the last band
+            band[cell_lat == self.zonal_edges[-1]] = nband - 1
+            band[( band < 0 ) | ( band >= nband )] = -1
             if self.grid_type == 'FV':
-                if 'time' in self.dimension:
-                    self.emissions_total = np.zeros( len(self.dim_var['time']) )
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( (len(self.dim_var['time']),
-                                                            len(self.dim_var[self.vert_name])) )
-                        for ti in self.time_inds:
-                            for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                                self.emissions_total_v[ti,vi] = np.sum(self.var_kg_m2_s[ti,vi,:,:] \
-                                                     * self.grid_area) * self.time_nseconds[ti] \
-                                                     * self.vert_thick[vi]
-                            self.emissions_total[ti] = np.sum( self.emissions_total_v[ti,:] )
-                    else:
-                        for ti in self.time_inds:
-                            self.emissions_total[ti] = np.sum(self.var_kg_m2_s[ti,:,:] \
-                                                      * self.grid_area) * self.time_nseconds[ti]
-                else:
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( len(self.dim_var[self.vert_name]) )
-                        for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                            self.emissions_total_v[vi] = np.sum( self.var_kg_m2_s[vi,:,:] * \
-                                                                 self.grid_area ) \
-                                                     * self.ndays * 86400. * self.vert_thick[vi]
-                        self.emissions_total = np.sum( self.emissions_total_v )
-                    else:
-                        self.emissions_total = np.sum( self.var_kg_m2_s * self.grid_area ) \
-                                              * self.ndays * 86400.
-
-            elif self.grid_type == 'SE':
-                if 'time' in self.dimension:
-                    self.emissions_total = np.zeros( len(self.dim_var['time']) )
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( (len(self.dim_var['time']),
-                                                            len(self.dim_var[self.vert_name])) )
-                        for ti in self.time_inds:
-                            for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                                self.emissions_total_v[ti,vi] = np.sum(self.var_kg_m2_s[ti,vi,:] \
-                                                      * self.grid_area) * self.time_nseconds[ti] \
-                                                      * self.vert_thick[vi]
-                            self.emissions_total[ti] = np.sum( self.emissions_total_v[ti,:] )
-                    else:
-                        for ti in self.time_inds:
-                            self.emissions_total[ti] = np.sum(self.var_kg_m2_s[ti,:] \
-                                                      * self.grid_area) * self.time_nseconds[ti]
-                else:
-                    if self.vert:
-                        self.emissions_total_v = np.zeros( len(self.dim_var[self.vert_name]) )
-                        for vi, vt in enumerate(self.dim_var[self.vert_name]):
-                            self.emissions_total_v[vi] = np.sum(self.var_kg_m2_s[vi,:] \
-                                                              * self.grid_area) \
-                                                    * self.ndays * 86400. * self.vert_thick[vi]
-                        self.emissions_total = np.sum( self.emissions_total_v )
-                    else:
-                        self.emissions_total = np.sum(self.var_kg_m2_s * self.grid_area) \
-                                              * self.ndays * 86400.
+                band = band[:,np.newaxis]
+            band.setflags( write=False )
+            if len( _zonal_band_cache ) >= max_cache:
+                _zonal_band_cache.pop( next( iter( _zonal_band_cache ) ) )
+            _zonal_band_cache[key] = band
+        
+        self.zonal_band = _zonal_band_cache[key]
+    
+    
+    # ===== Weight matrix of latitude bands =====
+    def zonal_matrix(self, area, read_index):
+        '''
+        Sparse (band x grid cell) matrix with area of cells in each latitude band
+        for a piece of the grid (area and read_index of the piece)
+        '''
+        band = np.ravel( np.broadcast_to( self.zonal_band[read_index[0]], np.shape(area) ) )
+        cells = np.where( band >= 0 )[0]
+        
+        return sparse.csr_matrix( ( np.ravel( area )[cells], ( band[cells], cells ) ),
+                                  shape=( len(self.zonal_lat), np.size(area) ) )
+    
+    
+    # ===== Grid cell centers and extents for region membership =====
+    def set_cell_geometry(self):
+        
+        if self.grid_type == 'FV':
+            sin_s, sin_n, lon_w, dlon = calc_grid_edges_FV( self.dim_var['lat'], self.dim_var['lon'],
+                                                            lat_bnds=self.dim_var.get('lat_bnds'),
+                                                            lon_bnds=self.dim_var.get('lon_bnds') )
+            self.cell_edges = ( sin_s, sin_n, lon_w, dlon )
+            cell_lon, cell_lat = np.meshgrid( self.dim_var['lon'], self.dim_var['lat'] )
+            self.cell_lon = np.ravel( cell_lon )
+            self.cell_lat = np.ravel( cell_lat )
+            
+            lat_s = np.arcsin( sin_s ) * 180. / np.pi
+            lat_n = np.arcsin( sin_n ) * 180. / np.pi
+            self.cell_half_lon = np.max( dlon ) / 2.
+            self.cell_half_lat = np.max( np.maximum( np.abs( lat_n - self.dim_var['lat'] ),
+                                                     np.abs( self.dim_var['lat'] - lat_s ) ) )
+            
+        elif self.grid_type == 'SE':
+            self.cell_lon = self.dim_var['center_lon']
+            self.cell_lat = self.dim_var['center_lat']
+            
+            # corners relative to the center, unwrapped across the dateline
+            corner_dlon = ( self.dim_var['corner_lon'] - self.cell_lon[:,np.newaxis] + 180. ) \
+                          % 360. - 180.
+            self.cell_corner_lon = self.cell_lon[:,np.newaxis] + corner_dlon
+            self.cell_corner_lat = self.dim_var['corner_lat']
+            self.cell_half_lon = np.max( np.abs( corner_dlon ) )
+            self.cell_half_lat = np.max( np.abs( self.cell_corner_lat - 
+                                                 self.cell_lat[:,np.newaxis] ) )
+    
+    
+    # ===== Sub-sampling points in grid cells =====
+    def cell_subpoints(self, inds, nsub):
+        '''
+        nsub x nsub points in each cell of inds (flat cell indices), 
+        evenly distributed in area for FV (uniform in longitude and sine of latitude)
+        and bilinear in the corners for SE quadrilaterals.
+        Returns longitude and latitude arrays (len(inds) x nsub**2)
+        '''
+        uu, vv = np.meshgrid( ( np.arange(nsub) + 0.5 ) / nsub, ( np.arange(nsub) + 0.5 ) / nsub )
+        uu = np.ravel( uu )[np.newaxis,:]
+        vv = np.ravel( vv )[np.newaxis,:]
+        
+        if self.grid_type == 'FV':
+            sin_s, sin_n, lon_w, dlon = self.cell_edges
+            jj = inds // len(self.dim_var['lon'])
+            ii = inds % len(self.dim_var['lon'])
+            point_lon = lon_w[ii,np.newaxis] + uu * dlon[ii,np.newaxis]
+            point_lat = np.arcsin( sin_s[jj,np.newaxis] + vv * 
+                                   ( sin_n[jj,np.newaxis] - sin_s[jj,np.newaxis] ) ) * 180. / np.pi
+            
+        elif self.grid_type == 'SE':
+            if np.shape( self.cell_corner_lon )[1] != 4:
+                # not a quadrilateral mesh: cell centers only
+                return self.cell_lon[inds,np.newaxis], self.cell_lat[inds,np.newaxis]
+            
+            point_lon = 0.
+            point_lat = 0.
+            for ci, cw in enumerate( [ (1-uu)*(1-vv), uu*(1-vv), uu*vv, (1-uu)*vv ] ):
+                point_lon = point_lon + cw * self.cell_corner_lon[inds,ci,np.newaxis]
+                point_lat = point_lat + cw * self.cell_corner_lat[inds,ci,np.newaxis]
+        
+        return point_lon, point_lat
+    
+    
+    # ===== Cells with centers in a lon/lat box =====
+    def cells_in_box(self, lon_range, lat_range):
+        '''
+        Sorted flat indices of cells with centers in lon_range/lat_range (inclusive).
+        For SE grids, the spatial index of the SCRIP file (built once per grid, 
+        saved to region_cache_dir if provided) is used instead of a search over all columns
+        '''
+        if self.grid_type == 'SE':
+            if self.scrip_index == None:
+                self.scrip_index = get_SCRIP_index( scrip_file=self.scrip_file,
+                                                    cache_dir=self.region_cache_dir,
+                                                    verbose=self.verbose )
+            return self.scrip_index.query_box( lon_range, lat_range )
+        
+        return np.where( lon_in_range( self.cell_lon, lon_range ) & \
+                         ( self.cell_lat >= lat_range[0] ) & \
+                         ( self.cell_lat <= lat_range[-1] ) )[0]
+    
+    
+    # ===== Cells in a region and their covered fractions =====
+    def region_membership(self, region, chunk_cells=20000):
+        '''
+        region: [lon_range, lat_range] for a box (cell centers),
+                {'polygon': (N x 2) lon/lat vertices or list of polygons, 'nsub': 10}, or
+                {'mask': xarray (lat, lon) integer region mask, 'value': mask value(s), 'nsub': 10}
+        For polygons and masks, the fraction of each cell in the region is estimated 
+        with nsub x nsub sub-sampling points per cell
+        Returns flat cell indices and fractions
+        '''
+        if type(region) != dict:
+            region_lon_range, region_lat_range = region
+            inds = self.cells_in_box( region_lon_range, region_lat_range )
+            return inds, np.ones( len(inds) )
+        
+        nsub = region.get( 'nsub', 10 )
+        
+        if 'polygon' in region.keys():
+            polygons = region['polygon']
+            if np.ndim( polygons[0] ) == 1: # a single polygon
+                polygons = [ polygons ]
+            
+            frac_all = {}
+            for poly in polygons:
+                poly = np.asarray( poly, dtype='f8' )
+                path = Path( poly )
+                poly_lon_min = np.min( poly[:,0] )
+                
+                # candidate cells overlapping the bounding box of the polygon
+                cand = self.cells_in_box( [ poly_lon_min - self.cell_half_lon,
+                                            np.max( poly[:,0] ) + self.cell_half_lon ],
+                                          [ np.min( poly[:,1] ) - self.cell_half_lat,
+                                            np.max( poly[:,1] ) + self.cell_half_lat ] )
+                
+                for ci in np.arange( 0, len(cand), chunk_cells ):
+                    inds = cand[ci:ci+chunk_cells]
+                    point_lon, point_lat = self.cell_subpoints( inds, nsub )
+                    # longitudes in the convention of the polygon
+                    point_lon = poly_lon_min + ( point_lon - poly_lon_min ) % 360.
+                    inside = path.contains_points( np.column_stack( ( np.ravel(point_lon),
+                                                                      np.ravel(point_lat) ) ) )
+                    frac = np.mean( np.reshape( inside, np.shape(point_lon) ), axis=1 )
+                    for ind, fr in zip( inds[frac > 0], frac[frac > 0] ):
+                        frac_all[ind] = min( frac_all.get( ind, 0. ) + fr, 1. )
+            
+            inds = np.array( sorted( frac_all.keys() ), dtype='i8' )
+            return inds, np.array( [ frac_all[ind] for ind in inds ] )
+        
+        elif 'mask' in region.keys():
+            mask = region['mask'].transpose( 'lat', 'lon' )
+            mask_lat = mask['lat'].values
+            mask_lon = mask['lon'].values
+            if 'value' in region.keys():
+                in_mask = np.isin( mask.values, region['value'] )
+            else:
+                in_mask = ( mask.values != 0 ) & np.isfinite( mask.values )
+            
+            if not np.any( in_mask ):
+                return np.zeros( 0, dtype='i8' ), np.zeros( 0 )
+            
+            # candidate cells overlapping the bounding box of the masked pixels
+            mask_lat_in = mask_lat[ np.any( in_mask, axis=1 ) ]
+            mask_lon_in = mask_lon[ np.any( in_mask, axis=0 ) ]
+            cand = self.cells_in_box( [ np.min( mask_lon_in ) - self.cell_half_lon,
+                                        np.max( mask_lon_in ) + self.cell_half_lon ],
+                                      [ np.min( mask_lat_in ) - self.cell_half_lat,
+                                        np.max( mask_lat_in ) + self.cell_half_lat ] )
+            
+            inds_all = []
+            frac_all = []
+            for ci in np.arange( 0, len(cand), chunk_cells ):
+                inds = cand[ci:ci+chunk_cells]
+                point_lon, point_lat = self.cell_subpoints( inds, nsub )
+                lat_ind = nearest_index( mask_lat, point_lat )
+                lon_ind = nearest_index( mask_lon, point_lon, period=360. )
+                frac = np.mean( in_mask[lat_ind, lon_ind], axis=1 )
+                inds_all.append( inds[frac > 0] )
+                frac_all.append( frac[frac > 0] )
+            
+            return np.concatenate( inds_all ), np.concatenate( frac_all )
+        
+        else:
+            raise ValueError( 'Check region definition! ' + \
+                              'Supported: [lon_range, lat_range], {"polygon":...}, {"mask":...}' )
+    
+    
+    # ===== Read a block of the emission array for the region =====
+    def read_block(self, time_index=None, space_index=None, var=None):
+        '''
+        time_index: slice or index array along time (None: not indexed in time)
+        space_index: index of spatial axes (default: the first piece of the region)
+        var: array to be read (default: the emission array), e.g., PS or T
+        In out-of-core mode (chunk_mb), only this block is read from the source array.
+        Values are returned in the original unit and data type (e.g., float32)
+        '''
+        if space_index is None:
+            space_index = self.space_pieces[0]
+        
+        if var is None:
+            block = self.var
+        else:
+            block = var
+        
+        # time and space are indexed one after the other,
+        # as two index arrays in one key would be broadcast together
+        if time_index is not None:
+            block = block[time_index]
+        block = block[ (Ellipsis,) + space_index ]
+        
+        return np.asarray( block )
+    
+    
+    # ===== Time indices of the calculation as a slice if contiguous =====
+    def time_inds_block(self, inds=None):
+        if 'time' not in self.dimension:
+            return None
+        if inds is None:
+            inds = self.time_inds
+        if ( len(inds) > 0 ) & ( inds[-1] - inds[0] + 1 == len(inds) ):
+            # contiguous time window: use a view instead of a copy
+            return slice( inds[0], inds[-1]+1 )
+        else:
+            return inds
+    
+    
+    # ===== Time blocks to be read: (output index, time index) =====
+    def time_blocks(self, read_size):
+        '''
+        read_size: number of grid cells to be read for each time step and level
+        '''
+        lead_shape = list( np.shape(self.var)[:np.ndim(self.var)-np.ndim(self.grid_area)] )
+        
+        if ('time' in self.dimension) & (self.chunk_mb != None):
+            # memory of a single time step in the source data type
+            # (float64 temporaries in area_contract are limited to its block_size)
+            step_bytes = int( np.prod( lead_shape[1:] ) ) * read_size * \
+                         np.dtype( self.var.dtype ).itemsize
+            if self.hybrid:
+                # layer weights and weighted values in float64
+                step_bytes += int( np.prod( lead_shape[1:] ) ) * read_size * 16
+            self.chunk_ntime = max( 1, int( self.chunk_mb * 1024**2 // step_bytes ) )
+            if self.verbose:
+                print( 'Out-of-core mode: ' + str(self.chunk_ntime) + ' time steps per chunk' )
+        elif ( 'time' in self.dimension ) & ( self.hybrid ):
+            # layer weights depend on PS: calculated for each time step
+            self.chunk_ntime = 1
+        elif 'time' in self.dimension:
+            self.chunk_ntime = max( len(self.time_inds), 1 )
+        
+        if 'time' in self.dimension:
+            return [ ( slice( ci, ci+self.chunk_ntime ), 
+                       self.time_inds_block( self.time_inds[ci:ci+self.chunk_ntime] ) ) 
+                     for ci in np.arange( 0, len(self.time_inds), self.chunk_ntime ) ]
+        else:
+            # no time dimension to stream along: single block
+            return [ ( Ellipsis, None ) ]
+    
+    
+    # ===== Area-weighted contraction of all blocks =====
+    def contract_blocks(self, area, read_index, matrix=None):
+        '''
+        Read the emission array block by block (a single block in the default mode,
+        time chunks in out-of-core mode, time steps for hybrid levels) and contract 
+        each block in space. For hybrid levels, each block is multiplied by layer 
+        weights (thickness or air mass) from PS of the same time steps first.
+        Returns area-weighted emissions (emission unit * m2) for the region and, 
+        with a sparse (group x grid cell) weight matrix of batch regions and/or 
+        latitude bands, for each group (group as the last axis)
+        '''
+        read_size = np.size( self.grid_area[read_index] )
+        lead_shape = list( np.shape(self.var)[:np.ndim(self.var)-np.ndim(self.grid_area)] )
+        blocks = self.time_blocks( read_size )
+        if 'time' in self.dimension:
+            lead_shape[0] = len(self.time_inds)
+        
+        emis_rate = np.zeros( lead_shape )
+        if matrix is not None:
+            emis_rate_matrix = np.zeros( lead_shape + [matrix.shape[0]] )
+        else:
+            emis_rate_matrix = None
+        
+        for out_index, time_index in blocks:
+            block = self.read_block( time_index, read_index )
+            if self.hybrid:
+                block = block * self.hybrid_weight( time_index, read_index )
+            rate, rate_matrix = self.area_contract( block, area, region_matrix=matrix )
+            emis_rate[out_index] = rate
+            if matrix is not None:
+                emis_rate_matrix[out_index] = rate_matrix
+        
+        return emis_rate, emis_rate_matrix
+    
+    
+    # ===== Layer weights of hybrid sigma-pressure levels =====
+    def hybrid_weight(self, time_index, space_index):
+        '''
+        Layer weights for a block of the emission array on hybrid levels, 
+        (time, lev, space) or (lev, space), from interface pressures
+        p = hyai * P0 + hybi * PS
+        - air mass (kg/m2) = dp / g for mixing ratio tendencies
+        - thickness (m) = Rd * T / g * dp / p_mid for per volume units (hydrostatic)
+        '''
+        g = 9.80616 # m/s2
+        Rd = 287.04 # J/kg/K, gas constant of dry air
+        
+        nspace_dims = np.ndim( self.grid_area )
+        
+        # surface pressure of the block, with or without time dimension
+        PS = self.dim_var['PS']
+        if ( time_index is not None ) & ( np.ndim(PS) == nspace_dims + 1 ):
+            ps = self.read_block( time_index, space_index, var=PS )
+        else:
+            ps = self.read_block( None, space_index, var=PS )
+        ps = np.expand_dims( np.asarray( ps, dtype='f8' ), axis=-nspace_dims-1 )
+        
+        # interface pressure (time, ilev, space)
+        int_shape = (len(self.hyai),) + (1,) * nspace_dims
+        p_int = np.reshape( self.hyai * self.P0, int_shape ) + \
+                np.reshape( self.hybi, int_shape ) * ps
+        upper = (Ellipsis, slice(None,-1)) + (slice(None),) * nspace_dims
+        lower = (Ellipsis, slice(1,None)) + (slice(None),) * nspace_dims
+        dp = np.abs( p_int[lower] - p_int[upper] )
+        
+        if self.vert_weight == 'mass':
+            return dp / g
+        else:
+            p_mid = ( p_int[lower] + p_int[upper] ) / 2.
+            T = self.read_block( time_index, space_index, var=self.dim_var['T'] )
+            return Rd * np.asarray( T, dtype='f8' ) / g * dp / p_mid
+    
+    
+    # ===== Area-weighted spatial contraction =====
+    def area_contract(self, var, area, region_matrix=None, block_size=2**22):
+        '''
+        Sum var * area over the trailing spatial axes (lat/lon for FV, ncol for SE)
+        for all leading (time, vertical) indices.
+        Rows are processed in blocks of about block_size elements, and each row is
+        summed on its own, so results do not depend on how the rows are chunked.
+        var stays in its data type (e.g., float32), and each block is multiplied by 
+        area (float64) and accumulated in float64
+        
+        region_matrix: if provided, also sum var over each region 
+                       (sparse region x grid cell matrix of area weights)
+        '''
+        space_shape = np.shape( area )
+        nspace = int( np.prod( space_shape ) )
+        lead_shape = np.shape( var )[:np.ndim(var)-len(space_shape)]
+        nlead = int( np.prod( lead_shape ) )
+        
+        var_rows = np.reshape( var, (nlead,) + space_shape )
+        nrow = max( 1, block_size // max( nspace, 1 ) )
+        
+        emis_rate = np.zeros( nlead )
+        if region_matrix is not None:
+            emis_rate_region = np.zeros( (nlead, region_matrix.shape[0]) )
+        for ri in np.arange( 0, nlead, nrow ):
+            rows = var_rows[ri:ri+nrow]
+            block = rows * area
+            emis_rate[ri:ri+nrow] = np.sum( np.reshape( block, (len(block), nspace) ), axis=1 )
+            
+            if region_matrix is not None:
+                emis_rate_region[ri:ri+nrow] = \
+                    ( region_matrix @ np.reshape( rows, (len(rows), nspace) ).T ).T
+        
+        if region_matrix is not None:
+            return ( np.reshape( emis_rate, lead_shape ), 
+                     np.reshape( emis_rate_region, lead_shape + (region_matrix.shape[0],) ) )
+        else:
+            return np.reshape( emis_rate, lead_shape ), None
 
     # ========================== END Calculate emission ======================
     # ========================================================================    
     
     
+    # ========================================================================
+    # ================= Summed-area table for box totals (FV) ================
+    # ========================================================================
+    def calc_summed_area(self):
+        '''
+        Summed-area table (time x (nlat+1) x (nlon+1)) of emissions * area in 
+        storage order, i.e., sum of cells [:j,:i] at [t,j,i], for the selected time steps
+        (vertically integrated). If summed_area is a .npy filename, the table is 
+        saved in the file and memory-mapped, and reused if the file exists with 
+        the same key (emission values, grid area, time selection, vertical weights)
+        in summed_area + '.key'
+        '''
+        if self.grid_type != 'FV':
+            raise ValueError( 'summed_area is available for FV grids only' )
+        
+        nlat, nlon = np.shape( self.grid_area )
+        if 'time' in self.dimension:
+            ntime = len(self.time_inds)
+        else:
+            ntime = 1
+        table_shape = ( ntime, nlat+1, nlon+1 )
+        
+        if type(self.summed_area) == str:
+            key_file = self.summed_area + '.key'
+            if self.hybrid:
+                vert_items = [ self.hyai, self.hybi, self.P0, self.vert_weight, 
+                               values_key( self.dim_var['PS'] ), 
+                               values_key( self.dim_var.get('T') ) ]
+            elif self.vert:
+                vert_items = [ self.vert_thick ]
+            else:
+                vert_items = None
+            coords = [ self.dim_var.get( dim ) for dim in self.dimension ]
+            key = grid_fingerprint( 'summed_area', self.var_name, 
+                                    values_key( self.var, coords=coords ),
+                                    self.dimension, self.grid_area, table_shape,
+                                    self.time_inds if 'time' in self.dimension else None,
+                                    vert_items )
+            if os.path.exists( self.summed_area ) & os.path.exists( key_file ):
+                with open( key_file, 'r' ) as f:
+                    saved_key = f.read().strip()
+                if saved_key == key:
+                    if self.verbose:
+                        print( 'Read summed-area table: ' + self.summed_area )
+                    self.summed_area_table = np.load( self.summed_area, mmap_mode='r' )
+                    return
+            # the key is written after the table is complete
+            if os.path.exists( key_file ):
+                os.remove( key_file )
+            table = np.lib.format.open_memmap( self.summed_area, mode='w+', dtype='f8',
+                                               shape=table_shape )
+        else:
+            table = np.zeros( table_shape )
+        
+        read_index = ( slice(None), slice(None) )
+        for out_index, time_index in self.time_blocks( nlat * nlon ):
+            block = self.read_block( time_index, read_index )
+            if self.hybrid:
+                block = block * self.hybrid_weight( time_index, read_index )
+            block = block * self.grid_area
+            if self.vert:
+                # layer thickness and vertical sum: (time, lat, lon)
+                block = np.tensordot( block, self.vert_thick, axes=([-3], [0]) )
+            if 'time' not in self.dimension:
+                block = block[np.newaxis]
+            table[out_index,1:,1:] = np.cumsum( np.cumsum( block, axis=-2 ), axis=-1 )
+        
+        if type(self.summed_area) == str:
+            table.flush()
+            del table
+            with open( key_file, 'w' ) as f:
+                f.write( key + '\n' )
+            table = np.load( self.summed_area, mmap_mode='r' )
+        self.summed_area_table = table
+    
+    
+    # ===== Emission totals of a lon/lat box from the summed-area table =====
+    def box_total(self, lon_range, lat_range):
+        '''
+        Emission totals (kg) of a lon/lat box for each time step, with four lookups
+        per time step for each contiguous run of longitudes (two runs for a box 
+        across the dateline or the edge of the longitude array)
+        lon_range: 2-elements list, e.g., [100,150] or [170,-170] (across the dateline)
+        lat_range: 2-elements list, e.g., [20,50]
+        '''
+        if not hasattr( self, 'summed_area_table' ):
+            raise ValueError( 'summed_area keyword must be provided for box_total' )
+        
+        lon_inds = np.where( lon_in_range( self.dim_var['lon'], lon_range ) )[0]
+        lat_inds = np.where( (self.dim_var['lat'] >= lat_range[0]) & \
+                             (self.dim_var['lat'] <= lat_range[1]) )[0]
+        
+        table = self.summed_area_table
+        emis_rate = np.zeros( table.shape[0] )
+        if ( len(lon_inds) > 0 ) & ( len(lat_inds) > 0 ):
+            j0, j1 = lat_inds[0], lat_inds[-1]+1
+            for run in np.split( lon_inds, np.where( np.diff( lon_inds ) > 1 )[0] + 1 ):
+                i0, i1 = run[0], run[-1]+1
+                emis_rate += table[:,j1,i1] - table[:,j0,i1] - table[:,j1,i0] + table[:,j0,i0]
+        
+        emis = emis_rate * self.calc_time_weight()
+        if 'time' in self.dimension:
+            emissions_box = np.zeros( len(self.dim_var['time']) )
+            emissions_box[self.time_inds] = emis
+            return emissions_box
+        else:
+            return emis[0]
+    # =============== END Summed-area table for box totals (FV) ==============
+    # ========================================================================
+    
+    
     # ========================================================================
     # ========================= Contruct time array ==========================
     # ========================================================================
     def construct_time_array(self):
         
-        # ===== Retrieve time info =====
+        # ===== Retrieve time info (vectorized for all CF calendars, cached) =====
+        calendar = self.dim_var.get( 'calendar' )
         if self.xarray_flag:
-            if type( self.dim_var['time'][0] ) == np.datetime64:
-                self.time_year = \
-                  self.dim_var['time'].astype('datetime64[Y]').astype('I') + 1970
-                self.time_month = \
-                  self.dim_var['time'].astype('datetime64[M]').astype('I') % 12 + 1
-                self.time_day = \
-                  ( self.dim_var['time'].astype('datetime64[D]') - \
-                    self.dim_var['time'].astype('datetime64[M]') + 1 ).astype('I')
-
-            elif type( self.dim_var['time'][0] ) in [cftime._cftime.DatetimeGregorian, 
-                                                     cftime._cftime.DatetimeNoLeap]:
-                self.time_year = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_month = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_day = np.zeros( len(self.dim_var['time']) ).astype('I')
-
-                for ti, timeraw in enumerate( self.dim_var['time'] ):
-                    self.time_year[ti] = timeraw.year
-                    self.time_month[ti] = timeraw.month
-                    self.time_day[ti] = timeraw.day
-                    
-            elif ( type( self.dim_var['time'][0] ) == str ) & \
-                 (  len( self.dim_var['time'][0].split('-') ) == 3 ):
-                self.time_year = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_month = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_day = np.zeros( len(self.dim_var['time']) ).astype('I')
-                
-                for ti, timeraw in enumerate( self.dim_var['time'] ):
-                    self.time_year[ti], self.time_month[ti], self.time_day[ti] = \
-                        np.array( self.dim_var['time'][ti].split('-') ).astype('I')
-                    
-            else:
-                raise ValueError( 'Currently ' + str(type( self.dim_var['time'][0] )) \
-                                + ' is not supported! Check type of the time dimension' )
-        
-        else:
-            if type( self.dim_var['time'][0] ) == np.datetime64:
-                self.time_year = \
-                  self.dim_var['time'].astype('datetime64[Y]').astype('I') + 1970
-                self.time_month = \
-                  self.dim_var['time'].astype('datetime64[M]').astype('I') % 12 + 1
-                self.time_day = \
-                  ( self.dim_var['time'].astype('datetime64[D]') - \
-                    self.dim_var['time'].astype('datetime64[M]') + 1 ).astype('I')
-
-            elif type( self.dim_var['time'][0] ) in [cftime._cftime.DatetimeGregorian, 
-                                                     cftime._cftime.DatetimeNoLeap]:
-                self.time_year = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_month = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_day = np.zeros( len(self.dim_var['time']) ).astype('I')
-
-                for ti, timeraw in enumerate( self.dim_var['time'] ):
-                    self.time_year[ti] = timeraw.year
-                    self.time_month[ti] = timeraw.month
-                    self.time_day[ti] = timeraw.day
-
-            elif ( type( self.dim_var['time'][0] ) == str ) & \
-                 (  len( self.dim_var['time'][0].split('-') ) == 3 ):
-                self.time_year = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_month = np.zeros( len(self.dim_var['time']) ).astype('I')
-                self.time_day = np.zeros( len(self.dim_var['time']) ).astype('I')
-                
-                for ti, timeraw in enumerate( self.dim_var['time'] ):
-                    self.time_year[ti], self.time_month[ti], self.time_day[ti] = \
-                        np.array( self.dim_var['time'][ti].split('-') ).astype('I')
-                    
-            else:
-                raise ValueError( 'Currently ' + str(type( self.dim_var['time'][0] )) \
-                                + ' is not supported! Check type of the time dimension' )
+            calendar = self.time_attrs.get( 'calendar', calendar )
+        
+        if self.time_index is not None:
+            time = self.time_index
+        else:
+            time = self.dim_var['time']
+        time_info = calc_time_info( time, time_bnds=self.dim_var.get('time_bnds'),
+                                    calendar=calendar, verbose=self.verbose )
+        self.time_info = time_info
+        
+        self.calendar = time_info['calendar']
+        self.time_year = time_info['year']
+        self.time_month = time_info['month']
+        self.time_day = time_info['day']
         # ===== END Retrieve time info =====
         
         
         # ===== Calculate time array for consistency in calculation =====
-        # Reference day
-        Sdate = datetime.date( 1950, 1, 1 )
-        
-        self.ndays = np.zeros( len(self.time_year) ).astype('I')
-        self.date = []
-        # Number of days in this case        
-        for ti, timeraw in enumerate( self.dim_var['time'] ):
-            self.ndays[ti] = ( datetime.date( self.time_year[ti], self.time_month[ti], 
-                                              self.time_day[ti] ) - Sdate ).days
-            self.date.append( datetime.datetime( self.time_year[ti], self.time_month[ti],
-                                                 self.time_day[ti] ) )
-                
-        # check whether emission is daily, monthly, or yearly
-        if ( ( self.ndays[1] - self.ndays[0] ) > 364 ) & \
-           ( ( self.ndays[1] - self.ndays[0] ) < 367 ): # yearly
-            self.emis_interval = 'yearly'
-            self.time_nseconds = np.zeros( len(self.time_year) )
-            for iy, yy in enumerate(self.time_year):
-                if calendar.isleap(yy):
-                    self.time_nseconds[iy] = 366. * 86400.
-                else:
-                    self.time_nseconds[iy] = 365. * 86400.
-            
-        elif ( ( self.ndays[1] - self.ndays[0] ) > 27 ) & \
-             ( ( self.ndays[1] - self.ndays[0] ) < 32 ): # monthly
-            self.emis_interval = 'monthly'
-            self.time_nseconds = np.zeros( len(self.time_month) )
-            for im, mm in enumerate(self.time_month):
-                dom = calendar.monthrange( self.time_year[im], self.time_month[im] )[1]
-                self.time_nseconds[im] = dom * 86400.
-        
-        elif ( ( self.ndays[1] - self.ndays[0] ) > 0.9 ) & \
-             ( ( self.ndays[1] - self.ndays[0] ) < 1.1 ): # daily
-            self.emis_interval = 'daily'
-            self.time_nseconds = np.zeros( len(self.time_day) )
-            for ii, dd in enumerate(self.time_day):
-                self.time_nseconds[ii] = 86400.
+        # Number of days since 1950-01-01 in this case
+        self.ndays = time_info['ndays']
+        
+        # emission is daily, monthly, yearly, or from time bounds
+        self.emis_interval = time_info['interval']
+        self.time_nseconds = time_info['nseconds']
+        if self.emis_interval == None:
+            raise ValueError( 'Unable to determine the emission time interval ' + 
+                              '(yearly, monthly, or daily), provide "time_bnds" in dim_var' )
         
         if self.verbose:
             print( 'Emission time interval: ', self.emis_interval )
@@ -654,12 +1338,10 @@ class Calc_Emis_T(object):
             self.date_end_year, self.date_end_month, self.date_end_day = \
                 np.array( self.date_range[1].split('-') ).astype('I')
             
-            self.date_start_ndays =  ( datetime.date( self.date_start_year, 
-                                                      self.date_start_month, 
-                                                      self.date_start_day ) - Sdate ).days
-            self.date_end_ndays =  ( datetime.date( self.date_end_year, 
-                                                    self.date_end_month, 
-                                                    self.date_end_day ) - Sdate ).days
+            self.date_start_ndays = ymd_to_days( self.date_start_year, self.date_start_month,
+                                                 self.date_start_day, self.calendar )
+            self.date_end_ndays = ymd_to_days( self.date_end_year, self.date_end_month,
+                                               self.date_end_day, self.calendar )
              
             self.time_inds = np.where( ( self.ndays >= self.date_start_ndays ) &
                                        ( self.ndays <= self.date_end_ndays ) )[0]
@@ -669,7 +1351,1307 @@ class Calc_Emis_T(object):
     # ========================================================================
     
     
+    # ===== datetime objects of time steps, created when requested =====
+    @property
+    def date(self):
+        if not hasattr( self, 'time_info' ):
+            raise AttributeError( 'date is available for emission arrays with time dimension' )
+        return self.time_info['date']
+    
+    
     # ===== Defining __call__ method =====
     def __call__(self):
         print( '=== var ===')
         print( np.shape(var) )
+
+
+
+class Calc_Emis_T_Dataset(object):
+    '''
+    NAME:
+           Calc_Emis_T_Dataset
+
+    PURPOSE:
+           Calculate total emissions of multiple species in an xarray Dataset.
+           Grid, time, and area information are set up once and shared by all species,
+           and species are calculated concurrently in a thread pool
+
+    INPUTS:
+           ds: an xarray Dataset with emission variables
+           fields: list of variable names to be calculated. If not provided, all emission
+                   variables with the same dimensions as the first one are calculated
+           unit: unit of emission arrays, for all species (str) or for each species (dict)
+                 if not provided, unit attribute of each variable is used
+           mw: molecular weight in g/mol, for all species (number) or for each species (dict)
+               if not provided, molecular_weight attribute of each variable is used
+           nthreads: number of threads (default: number of fields, up to 8)
+           date_range, lon_range, lat_range, regions, region_cache_dir, ndays, 
+           scrip_file, chunk_mb, zonal_bands: same as Calc_Emis_T
+           summed_area: same as Calc_Emis_T, for all species (True or a .npy filename, 
+                        '_<species>' is added to the filename for each species)
+                        or for each species (dict)
+           print_results: print results?
+           ignore_warning: ignore warning?
+           verbose: Display detailed information on what is being done
+           
+    OUTPUTS:
+           species: list of calculated fields
+           emissions_total: emission totals (species x time) in kg
+           emissions_region: emission totals of regions (species x region x time) in kg
+           emissions_zonal: emission totals of latitude bands (species x time x band) in kg
+                            with band edges in zonal_edges
+           table: pandas DataFrame with species, region ('total', region names, and 
+                  latitude bands, e.g., 'lat -30~0'), (year, month, day), 
+                  and emissions [Gg] columns
+           emis: dictionary of Calc_Emis_T objects for each species
+    '''
+    
+    def __init__(self, ds, fields=[], unit='', mw=None, nthreads=None,
+                 date_range=[], lon_range=[], lat_range=[], 
+                 regions=None, region_cache_dir=None, ndays=31, scrip_file="", chunk_mb=None, 
+                 summed_area=None, zonal_bands=None, print_results=True, ignore_warning=False, 
+                 verbose=False):
+        
+        # ========================================================================
+        # ===== Error check and pass input values to class-accessible values =====
+        # ========================================================================
+        if type(ds) != xr.core.dataset.Dataset:
+            raise ValueError( '"ds" must be an xarray Dataset, use Calc_Emis_T for a variable' )
+        
+        if fields == []:
+            for fld in list( ds.data_vars ):
+                if fld in ['lon_bnds', 'lat_bnds', 'time_bnds', 'date', 'datesec',
+                           'crs', 'gridcell_area', 'area', 'PS', 'T', 'Z3', 
+                           'hyam', 'hybm', 'hyai', 'hybi', 'P0', 'gw']:
+                    continue
+                dims = list( ds[fld].dims )
+                if ('ncol' in dims) | ( ('lat' in dims) & ('lon' in dims) ):
+                    if fields == []:
+                        self.fields_dims = dims
+                    if dims == self.fields_dims:
+                        fields = fields + [fld]
+            if fields == []:
+                raise ValueError( 'No emission variables with "lat"/"lon" or "ncol" dimensions!' )
+        
+        self.species = list( fields )
+        self.ds = ds
+        self.unit = unit
+        self.mw = mw
+        self.chunk_mb = chunk_mb
+        self.summed_area = summed_area
+        self.ignore_warning = ignore_warning
+        self.print_results = print_results
+        self.verbose = verbose
+        if nthreads == None:
+            self.nthreads = min( len(self.species), 8 )
+        else:
+            self.nthreads = nthreads
+        # === END Error check and pass input values to class-accessible values ===
+        # ========================================================================
+        
+        # ===== Grid, time, and area setup with the first species =====
+        if verbose:
+            print( 'Set up grid, time, and area information with ' + self.species[0] )
+        dim_var = {}
+        if 'time' in ds.dims:
+            time_bnds_name = ds['time'].attrs.get( 'bounds', 'time_bnds' )
+            if time_bnds_name in ds.variables:
+                dim_var['time_bnds'] = ds[time_bnds_name].values
+        if 'lev' in ds[self.species[0]].dims:
+            # hybrid sigma-pressure levels: coefficients, PS, and T (if available)
+            for hyb in ['hyai', 'hybi', 'P0', 'PS', 'T']:
+                if hyb in ds.variables:
+                    dim_var[hyb] = ds[hyb]
+        
+        template = Calc_Emis_T( ds[self.species[0]], dim_var=dim_var,
+                                unit=self.species_value( self.unit, self.species[0], '' ),
+                                mw=self.species_value( self.mw, self.species[0], None ),
+                                date_range=date_range, lon_range=lon_range, lat_range=lat_range,
+                                regions=regions, region_cache_dir=region_cache_dir, 
+                                ndays=ndays, scrip_file=scrip_file, chunk_mb=chunk_mb,
+                                summed_area=self.species_summed_area( self.species[0] ),
+                                zonal_bands=zonal_bands, print_results=False, 
+                                ignore_warning=ignore_warning, verbose=verbose )
+        self.release_memory( template )
+        self.template = template
+        
+        # ===== Other species in a thread pool =====
+        self.emis = { self.species[0]:template }
+        with ThreadPoolExecutor( max_workers=max( self.nthreads, 1 ) ) as executor:
+            results = executor.map( self.calc_species, self.species[1:] )
+            for fld, emis in zip( self.species[1:], results ):
+                self.emis[fld] = emis
+        
+        # ===== Collect results =====
+        self.emissions_total = np.array( [ self.emis[fld].emissions_total 
+                                           for fld in self.species ] )
+        if regions != None:
+            self.region_names = template.region_names
+            self.emissions_region = np.array( [ self.emis[fld].emissions_region
+                                                for fld in self.species ] )
+        self.zonal_bands = zonal_bands
+        if zonal_bands is not None:
+            self.zonal_edges = template.zonal_edges
+            self.zonal_names = [ 'lat ' + '{:g}'.format( self.zonal_edges[bi] ) + '~' + \
+                                 '{:g}'.format( self.zonal_edges[bi+1] ) 
+                                 for bi in np.arange( len(self.zonal_edges) - 1 ) ]
+            self.emissions_zonal = np.array( [ self.emis[fld].emissions_zonal
+                                               for fld in self.species ] )
+        self.construct_table()
+        
+        if self.print_results:
+            print( self.table.to_string( index=False ) )
+    
+    
+    # ===== value for each species from a scalar or a dictionary =====
+    def species_value(self, value, fld, default):
+        if type(value) == dict:
+            return value.get( fld, default )
+        else:
+            return value
+    
+    
+    # ===== summed_area of a species: a table file for each species =====
+    def species_summed_area(self, fld):
+        summed_area = self.species_value( self.summed_area, fld, None )
+        if type(self.summed_area) == str:
+            root, ext = os.path.splitext( summed_area )
+            summed_area = root + '_' + fld + ext
+        return summed_area
+    
+    
+    # ===== Calculate emission of a species with the shared grid information =====
+    def calc_species(self, fld):
+        emis = copy.copy( self.template )
+        emis.set_species( self.ds[fld], unit=self.species_value( self.unit, fld, '' ),
+                          mw=self.species_value( self.mw, fld, None ), chunk_mb=self.chunk_mb,
+                          ignore_warning=self.ignore_warning )
+        emis.convert_unit()
+        emis.calc_emis()
+        emis.summed_area = self.species_summed_area( fld )
+        if emis.summed_area not in [None, False]:
+            emis.calc_summed_area()
+        elif hasattr( emis, 'summed_area_table' ):
+            # table of the first species
+            del emis.summed_area_table
+        self.release_memory( emis )
+        if self.verbose:
+            print( 'Finished: ' + fld )
+        return emis
+    
+    
+    # ===== Release emission arrays, keeping results only =====
+    def release_memory(self, emis):
+        emis.var = None
+    
+    
+    # ===== Tidy table of results =====
+    def construct_table(self):
+        
+        columns = { 'species':[], 'region':[] }
+        if 'time' in self.template.dimension:
+            for key in ['year', 'month', 'day']:
+                columns[key] = []
+        columns['emissions [Gg]'] = []
+        
+        region_names = ['total']
+        if self.template.regions != None:
+            region_names = region_names + self.region_names
+        nregion = len(region_names)
+        if self.zonal_bands is not None:
+            region_names = region_names + self.zonal_names
+        
+        for si, fld in enumerate( self.species ):
+            for ri, name in enumerate( region_names ):
+                if ri == 0:
+                    values = np.atleast_1d( self.emissions_total[si] )
+                elif ri < nregion:
+                    values = np.atleast_1d( self.emissions_region[si, ri-1] )
+                else:
+                    # (time x band) or (band)
+                    values = np.atleast_1d( self.emissions_zonal[si][..., ri-nregion] )
+                columns['species'] += [fld] * len(values)
+                columns['region'] += [name] * len(values)
+                if 'time' in self.template.dimension:
+                    columns['year'] += list( self.template.time_year )
+                    columns['month'] += list( self.template.time_month )
+                    columns['day'] += list( self.template.time_day )
+                columns['emissions [Gg]'] += list( values / 1e6 )
+        
+        self.table = pd.DataFrame( columns )
+        
+        
+    # ===== Defining __call__ method =====
+    def __call__(self):
+        print( '=== species ===')
+        print( self.species )
+
+
+
+class Calc_Emis_T_Files(object):
+    '''
+    NAME:
+           Calc_Emis_T_Files
+
+    PURPOSE:
+           Calculate total emissions of multiple species in many emission files
+           (e.g., daily or monthly files in a directory) in a process pool, 
+           and collect results in a single table.
+           Results of each file are saved in a cache file, keyed by file path, size, 
+           modification time, and calculation parameters, so that only new or 
+           modified files are calculated when the calculation is repeated
+
+    INPUTS:
+           filenames: list of emission files, or a file pattern (e.g., '/path/qfed2.emis_co.*.nc4')
+           fields: list of variable names to be calculated (default: all emission variables)
+           nprocs: number of processes (default: number of CPUs)
+           cache_file: cache file name for results of each file (JSON lines)
+                       if not provided, output_file name + '.cache.jsonl' is used 
+                       when output_file is provided
+           output_file: if provided, results are saved in this file (.csv or .nc)
+           unit, mw, date_range, lon_range, lat_range, regions, region_cache_dir, 
+           ndays, scrip_file, chunk_mb, zonal_bands: same as Calc_Emis_T_Dataset
+           summed_area: a directory to save summed-area tables of each file 
+                        (<directory>/<file name without extension>_<species>.npy)
+           print_results: print results?
+           ignore_warning: ignore warning?
+           verbose: Display detailed information on what is being done
+           
+    OUTPUTS:
+           table: pandas DataFrame with file, species, region, (year, month, day), 
+                  and emissions [Gg] columns
+           failed: dictionary of files failed in the calculation with error messages
+    '''
+    
+    def __init__(self, filenames, fields=[], nprocs=None, cache_file=None, output_file=None,
+                 unit='', mw=None, date_range=[], lon_range=[], lat_range=[], 
+                 regions=None, region_cache_dir=None, ndays=31, scrip_file="", chunk_mb=None, 
+                 summed_area=None, zonal_bands=None, print_results=True, ignore_warning=False, 
+                 verbose=False):
+        
+        # ========================================================================
+        # ===== Error check and pass input values to class-accessible values =====
+        # ========================================================================
+        if type(filenames) == str:
+            filenames = sorted( glob.glob( filenames ) )
+        if len(filenames) == 0:
+            raise ValueError( 'No emission files are found!' )
+        self.filenames = [ os.path.abspath( filename ) for filename in filenames ]
+        
+        if nprocs == None:
+            self.nprocs = min( os.cpu_count(), len(self.filenames) )
+        else:
+            self.nprocs = nprocs
+        
+        if ( cache_file == None ) & ( output_file != None ):
+            cache_file = output_file + '.cache.jsonl'
+        self.cache_file = cache_file
+        self.output_file = output_file
+        self.print_results = print_results
+        self.ignore_warning = ignore_warning
+        self.verbose = verbose
+        
+        # keywords for Calc_Emis_T_Dataset of each file
+        self.kwargs = { 'fields':fields, 'unit':unit, 'mw':mw, 'date_range':date_range, 
+                        'lon_range':lon_range, 'lat_range':lat_range, 'regions':regions,
+                        'region_cache_dir':region_cache_dir, 'ndays':ndays, 
+                        'scrip_file':scrip_file, 'chunk_mb':chunk_mb, 'nthreads':1,
+                        'summed_area':summed_area, 'zonal_bands':zonal_bands,
+                        'ignore_warning':ignore_warning }
+        # parameters affecting results (and summed_area, so that tables are saved 
+        # in a new directory)
+        self.params_key = grid_fingerprint( { key:self.kwargs[key] for key in self.kwargs.keys()
+                                              if key not in ['chunk_mb', 'nthreads', 
+                                                             'ignore_warning', 
+                                                             'region_cache_dir'] } )
+        # === END Error check and pass input values to class-accessible values ===
+        # ========================================================================
+        
+        self.read_cache()
+        self.calc_files()
+        self.construct_table()
+        
+        if self.output_file != None:
+            self.save_table()
+        
+        if self.print_results:
+            print( self.table.to_string( index=False ) )
+    
+    
+    # ===== Cache key of a file: path, size, modification time, and parameters =====
+    def file_key(self, filename):
+        return grid_fingerprint( *file_state( filename ), self.params_key )
+    
+    
+    # ===== Read results of files already calculated =====
+    def read_cache(self):
+        self.cache = {}
+        if self.cache_file == None:
+            return
+        if os.path.exists( self.cache_file ):
+            with open( self.cache_file, 'r' ) as f:
+                for line in f:
+                    if line.strip() == '':
+                        continue
+                    item = json.loads( line )
+                    self.cache[item['key']] = item['records']
+            if self.verbose:
+                print( 'Read ' + str(len(self.cache)) + ' results from ' + self.cache_file )
+    
+    
+    # ===== Calculate files not in the cache =====
+    def calc_files(self):
+        self.keys = { filename:self.file_key( filename ) for filename in self.filenames }
+        new_files = [ filename for filename in self.filenames 
+                      if self.keys[filename] not in self.cache.keys() ]
+        self.failed = {}
+        
+        if self.verbose:
+            print( str(len(self.filenames) - len(new_files)) + ' files from cache, ' + 
+                   str(len(new_files)) + ' files to be calculated' )
+        if len(new_files) == 0:
+            return
+        
+        if self.nprocs > 1:
+            with ProcessPoolExecutor( max_workers=self.nprocs ) as executor:
+                futures = { executor.submit( calc_emis_file, filename, self.kwargs ):filename
+                            for filename in new_files }
+                for future in as_completed( futures ):
+                    self.add_result( futures[future], future )
+        else:
+            for filename in new_files:
+                self.add_result( filename, None )
+        
+        if ( len(self.failed) > 0 ) & ( not self.ignore_warning ):
+            print( 'Warning: calculation failed for ' + str(len(self.failed)) + ' files' )
+            for filename in self.failed.keys():
+                print( filename + ': ' + self.failed[filename] )
+    
+    
+    # ===== Save results of a file in the cache =====
+    def add_result(self, filename, future):
+        try:
+            if future == None:
+                records = calc_emis_file( filename, self.kwargs )
+            else:
+                records = future.result()
+        except Exception as error:
+            self.failed[filename] = repr( error )
+            return
+        
+        self.cache[self.keys[filename]] = records
+        if self.cache_file != None:
+            with open( self.cache_file, 'a' ) as f:
+                f.write( json.dumps( { 'key':self.keys[filename], 'file':filename,
+                                       'records':records } ) + '\n' )
+        if self.verbose:
+            print( 'Finished: ' + filename )
+    
+    
+    # ===== Consolidated table of all files =====
+    def construct_table(self):
+        tables = []
+        for filename in self.filenames:
+            if self.keys[filename] in self.cache.keys():
+                table = pd.DataFrame( self.cache[self.keys[filename]] )
+                table.insert( 0, 'file', filename )
+                tables.append( table )
+        
+        if len(tables) > 0:
+            self.table = pd.concat( tables, ignore_index=True )
+        else:
+            self.table = pd.DataFrame()
+    
+    
+    # ===== Save the table in a CSV or NetCDF file =====
+    def save_table(self):
+        if self.output_file.endswith( '.csv' ):
+            self.table.to_csv( self.output_file, index=False )
+        elif self.output_file.endswith( '.nc' ):
+            ds = xr.Dataset.from_dataframe( self.table.rename( 
+                                            columns={'emissions [Gg]':'emissions'} ) )
+            ds['emissions'].attrs['units'] = 'Gg'
+            ds.to_netcdf( self.output_file )
+        else:
+            raise ValueError( 'Check output_file! Supported file types are .csv and .nc' )
+        
+        if self.verbose:
+            print( 'Results are saved in ' + self.output_file )
+        
+        
+    # ===== Defining __call__ method =====
+    def __call__(self):
+        print( '=== filenames ===')
+        print( self.filenames )
+
+
+# ========================================================================
+# ===================== Emission totals of a file ========================
+# ========================================================================
+def calc_emis_file(filename, kwargs):
+    '''
+    Emission totals of a file with Calc_Emis_T_Dataset, used in Calc_Emis_T_Files.
+    Returns a list of records (species, region, year, month, day, emissions [Gg])
+    '''
+    if type( kwargs.get( 'summed_area' ) ) == str:
+        # summed-area tables of each file in the directory
+        kwargs = dict( kwargs )
+        kwargs['summed_area'] = os.path.join( kwargs['summed_area'], 
+                                              os.path.splitext( os.path.basename( filename ) )[0] 
+                                              + '.npy' )
+    with xr.open_dataset( filename ) as ds:
+        emis = Calc_Emis_T_Dataset( ds, print_results=False, **kwargs )
+        # native python types for the JSON cache
+        return json.loads( emis.table.to_json( orient='records' ) )
+# =================== END Emission totals of a file ======================
+# ========================================================================
+
+
+# ========================================================================
+# ====================== Longitude range membership ======================
+# ========================================================================
+def lon_in_range(lon, lon_range):
+    '''
+    True for longitudes within lon_range (inclusive) regardless of 
+    the longitude convention (-180~180 or 0~360).
+    lon_range[0] > lon_range[1] means a range crossing the dateline, e.g. [170,-170]
+    '''
+    lon = np.asarray( lon )
+    if ( lon_range[1] - lon_range[0] ) >= 360.:
+        return np.ones( np.shape(lon), dtype=bool )
+    
+    return ( ( lon - lon_range[0] ) % 360. ) <= ( ( lon_range[1] - lon_range[0] ) % 360. )
+# ==================== END Longitude range membership ====================
+# ========================================================================
+
+
+# ========================================================================
+# ======================= Nearest coordinate index =======================
+# ========================================================================
+def nearest_index(coord, points, period=None):
+    '''
+    Index of the nearest coord value (1-D, any order) for each of points.
+    period: e.g. 360 for longitudes, to wrap around
+    '''
+    coord = np.asarray( coord, dtype='f8' )
+    order = np.argsort( coord )
+    coord_sorted = coord[order]
+    
+    if period != None:
+        points = coord_sorted[0] + ( np.asarray( points ) - coord_sorted[0] ) % period
+        coord_sorted = np.append( coord_sorted, coord_sorted[0] + period )
+        order = np.append( order, order[0] )
+    
+    right = np.clip( np.searchsorted( coord_sorted, points ), 1, len(coord_sorted)-1 )
+    left = right - 1
+    nearest = np.where( np.abs( points - coord_sorted[left] ) <= 
+                        np.abs( coord_sorted[right] - points ), left, right )
+    
+    return order[nearest]
+# ===================== END Nearest coordinate index =====================
+# ========================================================================
+
+
+# ========================================================================
+# ======================== Fingerprint for caching =======================
+# ========================================================================
+def grid_fingerprint(*items):
+    '''
+    sha1 hash of arrays, numbers, strings, lists, and dictionaries (e.g., grid coordinates
+    and region definitions), used as keys of the cached grid information
+    '''
+    key = hashlib.sha1()
+    for item in items:
+        if item is None:
+            key.update( b'None' )
+        elif type(item) == str:
+            key.update( item.encode() )
+        elif type(item) == dict:
+            for dict_key in sorted( item.keys() ):
+                key.update( grid_fingerprint( dict_key, item[dict_key] ).encode() )
+        elif type(item) == xr.core.dataarray.DataArray:
+            key.update( grid_fingerprint( item.values, 
+                                          *[ item[dim].values for dim in item.dims ] ).encode() )
+        elif type(item) in [list, tuple]:
+            key.update( grid_fingerprint( *item ).encode() )
+        else:
+            item = np.asarray( item )
+            key.update( ( str( np.shape(item) ) + item.dtype.str ).encode() )
+            key.update( np.ascontiguousarray( item ).tobytes() )
+    
+    return key.hexdigest()
+
+
+def file_state(filename):
+    '''
+    Path, size, and modification time of a file, as a key of cached results
+    '''
+    stat = os.stat( filename )
+    return ( os.path.abspath( filename ), stat.st_size, stat.st_mtime_ns )
+
+
+def values_key(values, coords=None):
+    '''
+    Key of an array (e.g., emission values) for cached results, without reading values
+    from files: file (path, size, modification time), variable name, shape, and 
+    coordinates (e.g., of a subset in time) for arrays read from files (xarray with 
+    a source in the encoding, netCDF4, and np.memmap arrays), the task name of dask 
+    arrays (includes file names and modification times), and values otherwise.
+    Values of an array changed in memory after reading from a file are not checked;
+    drop the encoding (e.g., values.encoding = {}) to key such an array by its values
+    coords: list of coordinate arrays of the dimensions (default: from a DataArray)
+    '''
+    if values is None:
+        return None
+    name = None
+    if type(values) == xr.core.dataarray.DataArray:
+        name = values.name
+        if coords == None:
+            coords = [ values[dim].values for dim in values.dims if dim in values.coords ]
+        values = values.variable
+    if coords != None:
+        # e.g., cftime objects as strings
+        coords = [ np.asarray( coord ).astype( str ) if np.asarray( coord ).dtype.kind == 'O' 
+                   else coord for coord in coords ]
+    
+    source = None
+    if isinstance( values, xr.Variable ):
+        if values.chunks is not None:
+            return [ 'dask', values.data.name ]
+        source = values.encoding.get( 'source' )
+    elif isinstance( values, np.memmap ):
+        source = values.filename
+        name = str( values.offset )
+    elif hasattr( values, 'group' ) & hasattr( values, 'name' ):
+        # netCDF4 variable
+        source = values.group().filepath()
+        name = values.name
+    
+    if ( source != None ) and os.path.exists( source ):
+        return [ *file_state( source ), name, list( np.shape(values) ), str( values.dtype ),
+                 grid_fingerprint( coords ) ]
+    return np.asarray( values )
+# ====================== END Fingerprint for caching =====================
+# ========================================================================
+
+
+# ========================================================================
+# ================== Grid edges and area of FV grids (cached) ============
+# ========================================================================
+# grid area arrays already calculated in this session, keyed by grid coordinates
+_grid_area_cache = {}
+# region membership matrices already calculated in this session
+_region_matrix_cache = {}
+# latitude bands of grid cells already assigned in this session
+_zonal_band_cache = {}
+
+def calc_grid_edges_FV(lat, lon, lat_bnds=None, lon_bnds=None):
+    '''
+    NAME:
+           calc_grid_edges_FV
+
+    PURPOSE:
+           Cell edges of a lat/lon grid, from lat_bnds/lon_bnds if provided,
+           Gauss-Legendre weights for Gaussian latitudes, 
+           or midpoints between (non-uniform) centers
+
+    OUTPUTS:
+           sin_s, sin_n: sine of southern and northern edges of each row
+           lon_w, dlon: western edge and width (degree) of each column
+    '''
+    
+    lat = np.asarray( lat, dtype='f8' )
+    lon = np.asarray( lon, dtype='f8' )
+    
+    # ===== Latitude edges: sine of southern and northern edges =====
+    if lat_bnds is not None:
+        lat_bnds = np.clip( np.asarray( lat_bnds, dtype='f8' ), -90., 90. )
+        sin_s = np.sin( np.min( lat_bnds, axis=1 ) * np.pi / 180. )
+        sin_n = np.sin( np.max( lat_bnds, axis=1 ) * np.pi / 180. )
+    else:
+        order = np.argsort( lat )
+        lat_sorted = lat[order]
+        
+        # Gaussian latitudes: edges from Gauss-Legendre weights
+        nodes, weights = np.polynomial.legendre.leggauss( len(lat) )
+        if np.allclose( np.sin( lat_sorted * np.pi / 180. ), nodes, rtol=0, atol=1e-6 ):
+            sin_edge = np.clip( np.concatenate( ( [-1.], -1. + np.cumsum( weights ) ) ), -1., 1. )
+            sin_edge[-1] = 1.
+        # Otherwise, midpoints between centers, bounded by the poles
+        else:
+            lat_edge = np.zeros( len(lat) + 1 )
+            lat_edge[1:-1] = ( lat_sorted[1:] + lat_sorted[:-1] ) / 2.
+            if len(lat) > 1:
+                lat_edge[0] = lat_sorted[0] - ( lat_sorted[1] - lat_sorted[0] ) / 2.
+                lat_edge[-1] = lat_sorted[-1] + ( lat_sorted[-1] - lat_sorted[-2] ) / 2.
+            else:
+                lat_edge[0], lat_edge[-1] = -90., 90.
+            sin_edge = np.sin( np.clip( lat_edge, -90., 90. ) * np.pi / 180. )
+        
+        sin_s = np.zeros( len(lat) )
+        sin_n = np.zeros( len(lat) )
+        sin_s[order] = sin_edge[:-1]
+        sin_n[order] = sin_edge[1:]
+    
+    # ===== Longitude western edges and widths in degree =====
+    if lon_bnds is not None:
+        lon_bnds = np.asarray( lon_bnds, dtype='f8' )
+        lon_w = lon_bnds[:,0]
+        dlon = ( lon_bnds[:,1] - lon_bnds[:,0] ) % 360.
+        dlon[ dlon == 0. ] = 360.
+    elif len(lon) > 1:
+        # spacing to the neighbors, also valid for longitudes shifted by 180 degree
+        dlon_next = np.diff( lon ) % 360.
+        dlon_prev = np.concatenate( ( dlon_next[:1], dlon_next ) )
+        dlon_next = np.concatenate( ( dlon_next, dlon_next[-1:] ) )
+        lon_w = lon - dlon_prev / 2.
+        dlon = ( dlon_prev + dlon_next ) / 2.
+    else:
+        lon_w = lon - 180.
+        dlon = np.array( [360.] )
+    
+    return sin_s, sin_n, lon_w, dlon
+
+
+def calc_grid_area_FV(lat, lon, lat_bnds=None, lon_bnds=None, Earth_rad=6.371e6):
+    '''
+    NAME:
+           calc_grid_area_FV
+
+    PURPOSE:
+           Calculate exact spherical area (m2) of each grid cell of a lat/lon grid,
+           vectorized over all rows and columns.
+           The result is cached (the last max_cache grids) and returned as a 
+           read-only array, so repeated calls for the same grid skip the calculation
+
+    INPUTS:
+           lat: latitude centers (1-D array), can be non-uniform or Gaussian
+           lon: longitude centers (1-D array)
+           lat_bnds: latitude bounds (nlat x 2), used for cell edges if provided
+           lon_bnds: longitude bounds (nlon x 2), used for cell edges if provided
+           Earth_rad: radius of the Earth in m
+    '''
+    # number of grid area arrays kept in memory
+    max_cache = 16
+    
+    key = grid_fingerprint( np.asarray( lat, dtype='f8' ), np.asarray( lon, dtype='f8' ),
+                            lat_bnds, lon_bnds, Earth_rad )
+    
+    if key in _grid_area_cache:
+        return _grid_area_cache[key]
+    
+    sin_s, sin_n, lon_w, dlon = calc_grid_edges_FV( lat, lon, lat_bnds=lat_bnds, 
+                                                    lon_bnds=lon_bnds )
+    
+    grid_area = Earth_rad**(2) * ( sin_n - sin_s )[:, np.newaxis] \
+                * ( dlon * np.pi / 180. )[np.newaxis, :]
+    grid_area.setflags( write=False )
+    
+    if len( _grid_area_cache ) >= max_cache:
+        _grid_area_cache.pop( next( iter( _grid_area_cache ) ) )
+    _grid_area_cache[key] = grid_area
+    
+    return grid_area
+# ================ END Grid edges and area of FV grids (cached) ==========
+# ========================================================================
+
+
+# ========================================================================
+# ================= Spatial index of SE grid cells (cached) ==============
+# ========================================================================
+# spatial indices already built in this session, keyed by cell centers and corners
+_SCRIP_index_cache = {}
+
+class SCRIP_Index(object):
+    '''
+    NAME:
+           SCRIP_Index
+
+    PURPOSE:
+           Spatial index of spectral element (+ regional refinement) grid cells
+           for box, nearest-cell, and radius queries without a search over all columns.
+           Cells are sorted by latitude band and longitude (0~360), so a box query is 
+           a binary search in each band of the box, followed by an exact check 
+           of the candidates. Corner bounding boxes are kept for overlap queries.
+           Nearest-cell and radius queries use a KD-tree of unit vectors,
+           built when first needed
+
+    INPUTS:
+           center_lon, center_lat: cell centers (ncol), e.g., grid_center_lon/lat of SCRIP
+           corner_lon, corner_lat: cell corners (ncol x ncorner), for overlap queries
+           band_width: width of latitude bands in degrees
+           cache_dir: directory to save/read the index, so that it is built
+                      only once per grid (use get_SCRIP_index for the cached index)
+           key: name of the index in cache_dir (default: fingerprint of the cells)
+           verbose: Display detailed information on what is being done
+    '''
+    
+    def __init__(self, center_lon, center_lat, corner_lon=None, corner_lat=None, 
+                 band_width=1., cache_dir=None, key=None, verbose=False):
+        
+        self.center_lon = np.asarray( center_lon, dtype='f8' )
+        self.center_lat = np.asarray( center_lat, dtype='f8' )
+        self.band_width = band_width
+        self.nband = int( np.ceil( 180. / band_width ) )
+        self.corners = ( corner_lon is not None ) & ( corner_lat is not None )
+        self.tree = None
+        
+        cache_file = None
+        if cache_dir != None:
+            if key == None:
+                key = SCRIP_index_key( center_lon, center_lat, corner_lon, corner_lat, 
+                                       band_width )
+            cache_file = os.path.join( cache_dir, 'scrip_index_' + key + '.npz' )
+            if os.path.exists( cache_file ):
+                if verbose:
+                    print( 'Read SCRIP index file:', cache_file )
+                with np.load( cache_file ) as index_file:
+                    for name in index_file.files:
+                        setattr( self, name, index_file[name] )
+                return
+        
+        # ===== Cells sorted by latitude band, then longitude =====
+        lon360 = self.center_lon % 360.
+        band = self.lat_band( self.center_lat )
+        self.order = np.lexsort( ( lon360, band ) )
+        self.band_start = np.searchsorted( band[self.order], np.arange( self.nband + 1 ) )
+        # monotonic sort key: band * 360 + longitude
+        self.sort_key = band[self.order] * 360. + lon360[self.order]
+        
+        # ===== Corner bounding boxes =====
+        if self.corners:
+            corner_lat = np.asarray( corner_lat, dtype='f8' )
+            # corners relative to the center, unwrapped across the dateline
+            corner_dlon = ( np.asarray( corner_lon, dtype='f8' ) \
+                            - self.center_lon[:,np.newaxis] + 180. ) % 360. - 180.
+            dlon_min = np.min( corner_dlon, axis=1 )
+            dlon_max = np.max( corner_dlon, axis=1 )
+            self.box_lon_west = ( self.center_lon + dlon_min ) % 360.
+            self.box_lon_width = dlon_max - dlon_min
+            self.box_lat_min = np.min( corner_lat, axis=1 )
+            self.box_lat_max = np.max( corner_lat, axis=1 )
+            
+            # cells around the poles cover all longitudes
+            polar = self.box_lon_width >= 180.
+            self.box_lon_west[polar] = 0.
+            self.box_lon_width[polar] = 360.
+            self.box_lat_max[polar & ( self.center_lat > 0 )] = 90.
+            self.box_lat_min[polar & ( self.center_lat <= 0 )] = -90.
+            self.polar_inds = np.where( polar )[0]
+            
+            # the largest distance between a center and its bounding box
+            if np.all( polar ):
+                self.box_half = np.array( [ 180., 180. ] )
+            else:
+                self.box_half = np.array( 
+                    [ np.max( np.maximum( -dlon_min, dlon_max )[~polar] ),
+                      np.max( np.maximum( self.box_lat_max - self.center_lat,
+                                          self.center_lat - self.box_lat_min )[~polar] ) ] )
+        
+        if cache_file != None:
+            os.makedirs( cache_dir, exist_ok=True )
+            index_vars = [ 'order', 'band_start', 'sort_key' ]
+            if self.corners:
+                index_vars += [ 'box_lon_west', 'box_lon_width', 'box_lat_min',
+                                'box_lat_max', 'polar_inds', 'box_half' ]
+            np.savez( cache_file, **{ name:getattr( self, name ) for name in index_vars } )
+            if verbose:
+                print( 'Save SCRIP index file:', cache_file )
+    
+    
+    # ===== Latitude band of latitudes =====
+    def lat_band(self, lat):
+        return np.clip( np.floor( ( np.asarray( lat ) + 90. ) / self.band_width ), 
+                        0, self.nband - 1 ).astype( 'i8' )
+    
+    
+    # ===== Cells with centers (or bounding boxes) in a lon/lat box =====
+    def query_box(self, lon_range, lat_range, overlap=False):
+        '''
+        Sorted indices of cells with centers in lon_range/lat_range (inclusive),
+        the same cells as 
+            lon_in_range( center_lon, lon_range ) & 
+            ( center_lat >= lat_range[0] ) & ( center_lat <= lat_range[-1] )
+        lon_range[0] > lon_range[1] means a range crossing the dateline, e.g. [170,-170]
+        overlap: if True, cells with corner bounding boxes overlapping the box
+        '''
+        if overlap:
+            if not self.corners:
+                raise ValueError( 'corner_lon and corner_lat are needed for overlap queries' )
+            lon_full = ( lon_range[1] - lon_range[0] ) >= 360.
+            box_width = ( lon_range[1] - lon_range[0] ) % 360.
+            cand_lon_range = [ lon_range[0] - self.box_half[0], 
+                               lon_range[0] + box_width + self.box_half[0] ]
+            if lon_full | ( box_width + 2 * self.box_half[0] >= 360. ):
+                cand_lon_range = [ -180., 180. ]
+            cand = self.search( cand_lon_range, 
+                                [ lat_range[0] - self.box_half[1], 
+                                  lat_range[-1] + self.box_half[1] ] )
+            cand = np.union1d( cand, self.polar_inds )
+            
+            in_box = ( self.box_lat_max[cand] >= lat_range[0] ) & \
+                     ( self.box_lat_min[cand] <= lat_range[-1] )
+            if not lon_full:
+                in_box = in_box & \
+                         ( ( ( self.box_lon_west[cand] - lon_range[0] ) % 360. <= box_width ) | \
+                           ( ( lon_range[0] - self.box_lon_west[cand] ) % 360. <= \
+                             self.box_lon_width[cand] ) )
+            return cand[in_box]
+        
+        cand = self.search( lon_range, lat_range )
+        in_box = lon_in_range( self.center_lon[cand], lon_range ) & \
+                 ( self.center_lat[cand] >= lat_range[0] ) & \
+                 ( self.center_lat[cand] <= lat_range[-1] )
+        
+        return cand[in_box]
+    
+    
+    # ===== Candidate cells from the sorted bands =====
+    def search(self, lon_range, lat_range, eps=1e-9):
+        '''
+        Sorted indices of cells in the latitude bands of lat_range and 
+        within lon_range (with a small tolerance), to be checked exactly
+        '''
+        if lat_range[0] > lat_range[-1]:
+            return np.zeros( 0, dtype='i8' )
+        
+        band0, band1 = self.lat_band( [ lat_range[0], lat_range[-1] ] )
+        if ( lon_range[1] - lon_range[0] ) >= 360.:
+            return np.sort( self.order[self.band_start[band0]:self.band_start[band1+1]] )
+        
+        # windows of each band, with the tolerance the same cell 
+        # can be found in two windows (or bands), hence np.unique
+        
+        lon_west = lon_range[0] % 360.
+        lon_east = lon_west + ( lon_range[1] - lon_range[0] ) % 360.
+        if lon_east < 360.:
+            windows = [ [ lon_west, lon_east ] ]
+        else: # across 0 degree
+            windows = [ [ lon_west, 360. ], [ 0., lon_east - 360. ] ]
+        
+        bands = np.arange( band0, band1+1 ) * 360.
+        pieces = []
+        for window in windows:
+            starts = np.searchsorted( self.sort_key, bands + window[0] - eps, side='left' )
+            ends = np.searchsorted( self.sort_key, bands + window[1] + eps, side='right' )
+            pieces += [ self.order[start:end] for start, end in zip( starts, ends ) ]
+        
+        return np.unique( np.concatenate( pieces ) )
+    
+    
+    # ===== Unit vectors of longitudes and latitudes =====
+    def unit_vector(self, lon, lat):
+        lon = np.asarray( lon, dtype='f8' ) * np.pi / 180.
+        lat = np.asarray( lat, dtype='f8' ) * np.pi / 180.
+        return np.stack( [ np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), 
+                           np.sin(lat) ], axis=-1 )
+    
+    
+    # ===== KD-tree of cell centers =====
+    def build_tree(self):
+        if self.tree is None:
+            self.tree = cKDTree( self.unit_vector( self.center_lon, self.center_lat ) )
+        return self.tree
+    
+    
+    # ===== Nearest cells =====
+    def nearest(self, lon, lat, k=1, Earth_rad=6371.):
+        '''
+        Indices of the k nearest cell centers of points (lon, lat) 
+        and great-circle distances (km)
+        '''
+        dist, inds = self.build_tree().query( self.unit_vector( lon, lat ), k=k )
+        return inds, 2. * Earth_rad * np.arcsin( np.minimum( dist / 2., 1. ) )
+    
+    
+    # ===== Cells within a radius =====
+    def query_radius(self, lon, lat, radius_km, Earth_rad=6371.):
+        '''
+        Sorted indices of cells with centers within radius_km (great-circle distance)
+        of a point (lon, lat)
+        '''
+        chord = 2. * np.sin( min( radius_km / Earth_rad, np.pi ) / 2. )
+        inds = self.build_tree().query_ball_point( self.unit_vector( lon, lat ), chord )
+        return np.sort( np.array( inds, dtype='i8' ) )
+
+
+def SCRIP_index_key(center_lon, center_lat, corner_lon=None, corner_lat=None, band_width=1.):
+    '''
+    Key of a spatial index, independent of the longitude convention (-180~180 or 0~360)
+    '''
+    if corner_lon is not None:
+        corner_lon = np.asarray( corner_lon, dtype='f8' ) % 360.
+    if corner_lat is not None:
+        corner_lat = np.asarray( corner_lat, dtype='f8' )
+    
+    return grid_fingerprint( 'SCRIP_Index', np.asarray( center_lon, dtype='f8' ) % 360., 
+                             np.asarray( center_lat, dtype='f8' ), corner_lon, corner_lat, 
+                             band_width )
+
+
+def get_SCRIP_index(scrip_file=None, center_lon=None, center_lat=None, corner_lon=None, 
+                    corner_lat=None, band_width=1., cache_dir=None, verbose=False):
+    '''
+    NAME:
+           get_SCRIP_index
+
+    PURPOSE:
+           Spatial index (SCRIP_Index) of SE grid cells, built once per grid 
+           and reused in this session (and from cache_dir if provided).
+           For a scrip filename, the index is found by the file path, size, 
+           and modification time without reading the file again
+
+    INPUTS:
+           scrip_file: a scrip filename (or xarray Dataset), 
+                       or cell centers and corners below
+           center_lon, center_lat, corner_lon, corner_lat, band_width, cache_dir, verbose: 
+                       same as SCRIP_Index
+    '''
+    # number of spatial indexes kept in memory
+    max_cache = 4
+    
+    if type(scrip_file) == str:
+        key = grid_fingerprint( 'SCRIP_Index', *file_state( scrip_file ), band_width )
+        if key in _SCRIP_index_cache:
+            return _SCRIP_index_cache[key]
+        if verbose:
+            print( "Read SCRIP file:", scrip_file )
+        scrip_file = xr.open_dataset( scrip_file )
+    else:
+        key = None
+    
+    if scrip_file is not None:
+        center_lon = scrip_file.grid_center_lon.values
+        center_lat = scrip_file.grid_center_lat.values
+        corner_lon = scrip_file.grid_corner_lon.values
+        corner_lat = scrip_file.grid_corner_lat.values
+    
+    if key == None:
+        key = SCRIP_index_key( center_lon, center_lat, corner_lon, corner_lat, band_width )
+        if key in _SCRIP_index_cache:
+            return _SCRIP_index_cache[key]
+    
+    index = SCRIP_Index( center_lon, center_lat, corner_lon=corner_lon, corner_lat=corner_lat,
+                         band_width=band_width, cache_dir=cache_dir, key=key, verbose=verbose )
+    if len( _SCRIP_index_cache ) >= max_cache:
+        _SCRIP_index_cache.pop( next( iter( _SCRIP_index_cache ) ) )
+    _SCRIP_index_cache[key] = index
+    
+    return index
+# =============== END Spatial index of SE grid cells (cached) ============
+# ========================================================================
+
+
+# ========================================================================
+# =============== Calendar-aware time information (cached) ===============
+# ========================================================================
+# time information already calculated in this session, keyed by time coordinates
+# (raw values, or identity of cftime arrays/indexes) before any conversion
+_time_info_cache = {}
+
+# calendar names in CF conventions and the names used here
+CF_calendars = { 'standard':'standard', 'gregorian':'standard', 
+                 'proleptic_gregorian':'proleptic_gregorian', 
+                 'noleap':'noleap', '365_day':'noleap', 
+                 'all_leap':'all_leap', '366_day':'all_leap', 
+                 '360_day':'360_day', 'julian':'julian' }
+
+# first day of the Gregorian calendar (1582-10-15) in Julian day number
+_JDN_Gregorian_start = 2299161
+
+
+def check_calendar(calendar):
+    '''
+    Return the calendar name used here for a CF calendar name
+    '''
+    if calendar == None:
+        return 'standard'
+    if calendar.lower() not in CF_calendars.keys():
+        raise ValueError( 'Currently calendar ' + calendar + ' is not supported! ' + 
+                          'Supported calendars are ' + ', '.join( CF_calendars.keys() ) )
+    return CF_calendars[calendar.lower()]
+
+
+def days_in_month(year, month, calendar='standard'):
+    '''
+    Number of days in each month (vectorized) for a CF calendar
+    '''
+    calendar = check_calendar( calendar )
+    year = np.asarray( year, dtype='i8' )
+    month = np.asarray( month, dtype='i8' )
+    
+    if calendar == '360_day':
+        return np.full( np.broadcast( year, month ).shape, 30, dtype='i8' )
+    
+    dom = np.array( [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31] )[month-1]
+    return dom + ( ( month == 2 ) & is_leap( year, calendar ) )
+
+
+def days_in_year(year, calendar='standard'):
+    '''
+    Number of days in each year (vectorized) for a CF calendar
+    '''
+    calendar = check_calendar( calendar )
+    year = np.asarray( year, dtype='i8' )
+    
+    if calendar == '360_day':
+        return np.full( np.shape(year), 360, dtype='i8' )
+    
+    return 365 + is_leap( year, calendar )
+
+
+def is_leap(year, calendar='standard'):
+    '''
+    Leap year flags (vectorized) for a CF calendar
+    '''
+    calendar = check_calendar( calendar )
+    year = np.asarray( year, dtype='i8' )
+    
+    julian = ( year % 4 == 0 )
+    gregorian = julian & ( ( year % 100 != 0 ) | ( year % 400 == 0 ) )
+    
+    if calendar in ['noleap', '360_day']:
+        return np.zeros( np.shape(year), dtype=bool )
+    elif calendar == 'all_leap':
+        return np.ones( np.shape(year), dtype=bool )
+    elif calendar == 'julian':
+        return julian
+    elif calendar == 'proleptic_gregorian':
+        return gregorian
+    else:
+        return np.where( year < 1583, julian, gregorian )
+
+
+def ymd_to_days(year, month, day, calendar='standard'):
+    '''
+    Days since 1950-01-01 (vectorized) for a CF calendar
+    '''
+    calendar = check_calendar( calendar )
+    year = np.asarray( year, dtype='i8' )
+    month = np.asarray( month, dtype='i8' )
+    day = np.asarray( day, dtype='i8' )
+    
+    if calendar == '360_day':
+        return ( year - 1950 ) * 360 + ( month - 1 ) * 30 + day - 1
+    
+    if calendar in ['noleap', 'all_leap']:
+        ndays_year = days_in_year( 1, calendar )
+        doy_start = np.cumsum( np.append( 0, days_in_month( 1, np.arange(1,12), calendar ) ) )
+        return ( year - 1950 ) * ndays_year + doy_start[month-1] + day - 1
+    
+    # Julian day number for the Julian and Gregorian calendars
+    a = ( 14 - month ) // 12
+    yy = year + 4800 - a
+    mm = month + 12 * a - 3
+    jdn_julian = day + ( 153 * mm + 2 ) // 5 + 365 * yy + yy // 4 - 32083
+    jdn_gregorian = jdn_julian + 38 - yy // 100 + yy // 400
+    
+    if calendar == 'julian':
+        jdn = jdn_julian
+    elif calendar == 'proleptic_gregorian':
+        jdn = jdn_gregorian
+    else:
+        jdn = np.where( jdn_gregorian >= _JDN_Gregorian_start, jdn_gregorian, jdn_julian )
+    
+    if calendar == 'julian':
+        return jdn - 2433296 # 1950-01-01 in the Julian calendar
+    else:
+        return jdn - 2433283 # 1950-01-01
+
+
+def days_to_ymd(days, calendar='standard'):
+    '''
+    Year, month, and day (vectorized) from days since 1950-01-01 for a CF calendar
+    '''
+    calendar = check_calendar( calendar )
+    days = np.floor( np.asarray( days, dtype='f8' ) ).astype('i8')
+    
+    if calendar == '360_day':
+        year = 1950 + days // 360
+        month = ( days % 360 ) // 30 + 1
+        day = days % 30 + 1
+        return year, month, day
+    
+    if calendar in ['noleap', 'all_leap']:
+        ndays_year = days_in_year( 1, calendar )
+        doy_start = np.cumsum( np.append( 0, days_in_month( 1, np.arange(1,12), calendar ) ) )
+        year = 1950 + days // ndays_year
+        doy = days % ndays_year
+        month = np.searchsorted( doy_start, doy, side='right' )
+        day = doy - doy_start[month-1] + 1
+        return year, month, day
+    
+    # Julian day number to the Julian and Gregorian calendars (Richards, 2013)
+    if calendar == 'julian':
+        jdn = days + 2433296
+    else:
+        jdn = days + 2433283
+    
+    f = jdn + 1401
+    if calendar == 'proleptic_gregorian':
+        f = f + ( ( ( 4 * jdn + 274277 ) // 146097 ) * 3 ) // 4 - 38
+    elif calendar == 'standard':
+        f = f + np.where( jdn >= _JDN_Gregorian_start, 
+                          ( ( ( 4 * jdn + 274277 ) // 146097 ) * 3 ) // 4 - 38, 0 )
+    e = 4 * f + 3
+    h = 5 * ( ( e % 1461 ) // 4 ) + 2
+    day = ( h % 153 ) // 5 + 1
+    month = ( h // 153 + 2 ) % 12 + 1
+    year = e // 1461 - 4716 + ( 14 - month ) // 12
+    
+    return year, month, day
+
+
+def time_to_days(time, calendar=None):
+    '''
+    Days since 1950-01-01 (float) and calendar name from time values
+    (datetime64, cftime objects, or 'YYYY-MM-DD' strings)
+    '''
+    time = np.asarray( time )
+    
+    if np.issubdtype( time.dtype, np.datetime64 ):
+        days = ( time - np.datetime64( '1950-01-01' ) ) / np.timedelta64( 1, 's' ) / 86400.
+        return days, 'proleptic_gregorian'
+    
+    first = time.flat[0]
+    if isinstance( first, cftime.datetime ):
+        if calendar == None:
+            calendar = first.calendar
+        calendar = check_calendar( calendar )
+        days = cftime.date2num( time, 'days since 1950-01-01 00:00:00', calendar=calendar )
+        return np.asarray( days, dtype='f8' ), calendar
+    
+    if ( type(first) in [str, np.str_] ) and ( len( str(first).split('-') ) == 3 ):
+        calendar = check_calendar( calendar )
+        ymd = np.array( [ str(tt).split('-') for tt in time.flat ] ).astype('i8')
+        days = ymd_to_days( ymd[:,0], ymd[:,1], ymd[:,2], calendar )
+        return np.reshape( days, np.shape(time) ).astype('f8'), calendar
+    
+    raise ValueError( 'Currently ' + str(type( first )) \
+                    + ' is not supported! Check type of the time dimension' )
+
+
+def time_values_key(values):
+    '''
+    Key of time values without converting them: raw bytes of numeric, datetime64,
+    and string arrays, and identity of object arrays (e.g., cftime objects) and 
+    pandas indexes (e.g., CFTimeIndex of xarray, the same object for the same dataset).
+    Returns the key and the object of an identity key (None for raw values)
+    '''
+    if values is None:
+        return None, None
+    if isinstance( values, pd.Index ) | ( isinstance( values, np.ndarray ) and 
+                                          ( values.dtype.kind == 'O' ) ):
+        return ( 'id', id(values) ), values
+    values = np.asarray( values )
+    if values.dtype.kind == 'O':
+        # e.g., a list of cftime objects: converted for the key
+        values = np.asarray( time_to_days( values )[0] )
+    return ( str(values.dtype), values.shape, 
+             hashlib.sha1( np.ascontiguousarray( values ).view('u1') ).hexdigest() ), None
+
+
+class Time_Info(dict):
+    '''
+    Time information of calc_time_info. Datetime objects ('date') are created 
+    only when requested, and kept afterwards
+    '''
+    def __missing__(self, key):
+        if key != 'date':
+            raise KeyError( key )
+        if self['calendar'] in ['standard', 'proleptic_gregorian']:
+            date = [ datetime.datetime( yy, mm, dd ) for yy, mm, dd in 
+                     zip( self['year'].tolist(), self['month'].tolist(), self['day'].tolist() ) ]
+        else:
+            date = [ cftime.datetime( yy, mm, dd, calendar=self['calendar'] ) for yy, mm, dd in
+                     zip( self['year'].tolist(), self['month'].tolist(), self['day'].tolist() ) ]
+        self['date'] = date
+        return date
+
+
+def calc_time_info(time, time_bnds=None, calendar=None, verbose=False):
+    '''
+    NAME:
+           calc_time_info
+
+    PURPOSE:
+           Year, month, day, days since 1950-01-01, and seconds of each time interval
+           for all CF calendars, without loops over time steps. 
+           Results are cached for each time coordinate, keyed by raw values or 
+           the identity of cftime arrays/indexes, so a cached result is found 
+           without converting time values again.
+
+    INPUTS:
+           time: time values (datetime64, cftime objects, or 'YYYY-MM-DD' strings),
+                 or a pandas index of them (e.g., var.indexes['time'] of xarray)
+           time_bnds: time bounds (ntime x 2) if available. 
+                      If provided, seconds of each time interval are calculated from them
+           calendar: calendar name, if not available from time values
+           verbose: Display detailed information on what is being done
+           
+    OUTPUTS:
+           dictionary with calendar, year, month, day, ndays (days since 1950-01-01),
+           nseconds (seconds of each time interval), interval ('yearly', 'monthly',
+           'daily', or 'time_bnds'), and date (datetime objects, created when requested)
+           nseconds and interval are None if the time interval can't be determined
+    '''
+    # number of time coordinates kept in memory
+    max_cache = 64
+    
+    time_key, time_obj = time_values_key( time )
+    bnds_key, bnds_obj = time_values_key( time_bnds )
+    key = ( time_key, bnds_key, calendar )
+    if key in _time_info_cache.keys():
+        refs, info = _time_info_cache[key]
+        # identity keys: the same objects (ids of deleted objects can be reused)
+        if all( [ ref() is obj for ref, obj in zip( refs, [time_obj, bnds_obj] ) 
+                  if ref is not None ] ):
+            if verbose:
+                print( 'Use cached time information' )
+            return info
+    
+    days, calendar = time_to_days( time, calendar=calendar )
+    if time_bnds is not None:
+        bnds_days = time_to_days( time_bnds, calendar=calendar )[0]
+    else:
+        bnds_days = None
+    
+    info = Time_Info( calendar=calendar )
+    info['year'], info['month'], info['day'] = days_to_ymd( days, calendar )
+    info['ndays'] = np.floor( days ).astype('i8')
+    
+    # ===== seconds of each time interval =====
+    if bnds_days is not None:
+        bnds_days = np.reshape( bnds_days, ( len(days), 2 ) )
+        info['nseconds'] = ( bnds_days[:,1] - bnds_days[:,0] ) * 86400.
+        info['interval'] = 'time_bnds'
+    elif len(days) < 2:
+        info['interval'] = None
+        info['nseconds'] = None
+    else:
+        interval = info['ndays'][1] - info['ndays'][0]
+        if ( interval > 359 ) & ( interval < 367 ): # yearly
+            info['interval'] = 'yearly'
+            info['nseconds'] = days_in_year( info['year'], calendar ) * 86400.
+        elif ( interval > 27 ) & ( interval < 32 ): # monthly
+            info['interval'] = 'monthly'
+            info['nseconds'] = days_in_month( info['year'], info['month'], calendar ) * 86400.
+        elif ( interval > 0.9 ) & ( interval < 1.1 ): # daily
+            info['interval'] = 'daily'
+            info['nseconds'] = np.full( len(days), 86400. )
+        else:
+            info['interval'] = None
+            info['nseconds'] = None
+    
+    for item in ['year', 'month', 'day', 'ndays', 'nseconds']:
+        if info[item] is not None:
+            info[item].setflags( write=False )
+    
+    if len( _time_info_cache ) >= max_cache:
+        _time_info_cache.pop( next( iter( _time_info_cache ) ) )
+    refs = [ weakref.ref( obj ) if obj is not None else None for obj in [time_obj, bnds_obj] ]
+    _time_info_cache[key] = ( refs, info )
+    
+    return info
+# ============= END Calendar-aware time information (cached) =============
+# ========================================================================
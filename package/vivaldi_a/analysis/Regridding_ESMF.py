@@ -3,6 +3,12 @@ Regridding_ESMF.py
 this code is designed for regridding between finite volume grid and spectral element mesh
 (1) Add_bound values of FV grids for mass conserving regridding (class Add_bounds)
 (2) Regrid FV grid values to SE-RR grid values
+(3) On-disk store of weight files addressed by grid pair and method (class Weight_Cache)
+(4) NetCDF4 output profiles with chunking and compression (output_profiles)
+(5) Zarr store output with concurrent, resumable block writes (class Zarr_File)
+(6) Batched transfer of slices into/out of ESMF fields (class ESMF_Transfer)
+(7) Regridding of many files with shared grids and weights (class Regridding_Session)
+(8) In-memory ESMF grids/meshes from coordinate arrays (create_grid_FV, create_mesh_SE)
 
 MODIFICATION HISTORY:
     Duseong Jo, 18, FEB, 2021: VERSION 1.00
@@ -48,17 +54,411 @@ MODIFICATION HISTORY:
     - In case the dimension of the xarray variable is not explicitly defined
     Duseong Jo, 24, SEP, 2021: VERSION 7.00
     - Adding a scale factor keyword 
+    vivaldi_a contributors, 17, OCT, 2026: VERSION 8.00
+    - Performance and feature update (details in the git history):
+      vectorized time arrays, sparse (CSR) weight engine, weight file cache 
+      (Weight_Cache), any number of non-spatial dimensions, pipelined blocks,
+      NetCDF4 output profiles, Zarr output (Zarr_File), batched ESMF transfer,
+      conservation diagnostics, multi-file sessions (Regridding_Session),
+      and in-memory grids
 '''
 
 ### Module import ###
 import numpy as np
 import xarray as xr
-import ESMF
-import datetime, time, os
+import datetime, time, os, json, weakref
+import threading, queue, shutil, glob, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import cftime
 from netCDF4 import Dataset
 import subprocess
-from Calc_Emis import Calc_Emis_T
+import pandas as pd
+from scipy.sparse import csr_matrix
+from Calc_Emis import Calc_Emis_T, calc_time_info, grid_fingerprint, calc_grid_area_FV, \
+                      lon_in_range, file_state
+try:
+    import zarr
+except ImportError:
+    zarr = None
+# file locks of the weight cache index (not available on Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+# ESMPy is needed only for generating weights and for the ESMF engine
+try:
+    import ESMF
+except ImportError:
+    try:
+        import esmpy as ESMF # ESMPy >= 8.4
+    except ImportError:
+        ESMF = None
+
+
+def check_ESMF(purpose):
+    '''
+    Raise an error if ESMPy is not available
+    '''
+    if ESMF == None:
+        raise ImportError( 'ESMPy (ESMF or esmpy module) is required ' + purpose + '\n' + \
+                           'Regridding with existing weight files (engine="sparse") ' + \
+                           'does not need ESMPy' )
+
+
+# ========================================================================
+# ================ NetCDF output profiles (NetCDF4/HDF5) =================
+# ========================================================================
+output_profiles = {
+    'netcdf3':{ 'format':'NETCDF3_64BIT_DATA', 'chunking':None, 'compression':None },
+    'time_slab':{ 'format':'NETCDF4', 'chunking':'time_slab', 'compression':'zlib', 
+                  'complevel':4, 'shuffle':True },
+    'time_series':{ 'format':'NETCDF4', 'chunking':'time_series', 'compression':'zlib', 
+                    'complevel':4, 'shuffle':True },
+}
+
+def get_output_profile(output_profile=None, nc_file_format='NETCDF3_64BIT_DATA'):
+    '''
+    NAME:
+           get_output_profile
+
+    PURPOSE:
+           Output profile (dictionary) of NetCDF files from a profile name in 
+           output_profiles, or from a dictionary overriding a profile, e.g.,
+           {'profile':'time_series', 'compression':'zstd', 'complevel':3}
+
+    INPUTS:
+           output_profile: None (uncompressed file of nc_file_format), profile name, 
+                           or dictionary with the keys below
+                  format: NetCDF file format ('NETCDF4' or 'NETCDF4_CLASSIC' for compression)
+                  chunking: 'time_slab' - one chunk per time step (and per index of other 
+                                          non-spatial dimensions) over the whole spatial domain,
+                                          for reading maps
+                            'time_series' - time_chunk time steps of spatial tiles 
+                                            of chunk_kb, for reading time series
+                            dictionary of chunk sizes for dimension names 
+                            (other dimensions follow 'time_slab'), or None (library default)
+                  compression: None, 'zlib', or 'zstd'
+                  complevel: compression level (zlib: 1-9, zstd: 1-22)
+                  shuffle: if True, byte shuffle filter before compression 
+                           (applied with zlib by the NetCDF4 library)
+                  chunk_kb: size of a spatial tile for 'time_series' chunking [KB]
+                  time_chunk: time steps of a chunk for 'time_series' (None: all)
+                  cache_mb: maximum HDF5 chunk cache of all fields of a file [MB], 
+                            shared equally by the fields. Chunks of a time step are 
+                            compressed once if the cache of a field holds a row of 
+                            chunks along time (e.g., all tiles for 'time_series'); 
+                            a smaller cache saves memory, but partially written chunks 
+                            are evicted, read back, and compressed again (slower writes)
+           nc_file_format: file format for output_profile=None
+    '''
+    profile = { 'format':nc_file_format, 'chunking':None, 'compression':None, 
+                'complevel':4, 'shuffle':True, 'chunk_kb':1024, 'time_chunk':None,
+                'cache_mb':1024 }
+    if output_profile == None:
+        return profile
+    if type(output_profile) == str:
+        output_profile = { 'profile':output_profile }
+    base = output_profile.get( 'profile', 'time_slab' )
+    if base not in output_profiles:
+        raise ValueError( 'Check output_profile! - ' + str(base) + ' is not available\n' + \
+                          'Currently those are supported: ' + str( list( output_profiles.keys() ) ) )
+    profile.update( output_profiles[base] )
+    profile.update( { key:value for key, value in output_profile.items() if key != 'profile' } )
+
+    if profile['compression'] not in [None, 'zlib', 'zstd']:
+        raise ValueError( 'Check compression! - ' + str(profile['compression']) + \
+                          ' is not available\nCurrently those are supported: None, "zlib", "zstd"' )
+    if ( profile['format'][:7] == 'NETCDF3' ) & \
+       ( (profile['compression'] != None) | (profile['chunking'] != None) ):
+        raise ValueError( 'Chunking and compression need NETCDF4 or NETCDF4_CLASSIC format' )
+    return profile
+
+
+def output_chunks(profile, dims, shape, datatype):
+    '''
+    Chunk shape of a field for the chunking of an output profile
+    (spatial dimensions lat, lon, or ncol are the last dimensions)
+    '''
+    nspace = 2 if 'lat' in dims[-2:] else 1
+    nlead = len(dims) - nspace
+    # 'time_slab': one chunk per time step (and other non-spatial indices)
+    chunks = [1] * nlead + list( shape[nlead:] )
+    if type( profile['chunking'] ) == dict:
+        for di, dim in enumerate(dims):
+            if dim in profile['chunking']:
+                chunks[di] = max( 1, min( profile['chunking'][dim], shape[di] ) )
+    elif profile['chunking'] == 'time_series':
+        # time steps of spatial tiles (the first non-spatial dimension if time is missing)
+        if nlead > 0:
+            ti = list(dims).index('time') if 'time' in dims else 0
+            chunks[ti] = shape[ti] if profile['time_chunk'] == None else \
+                         max( 1, min( profile['time_chunk'], shape[ti] ) )
+            ntile = profile['chunk_kb'] * 1024 // ( chunks[ti] * np.dtype(datatype).itemsize )
+        else:
+            ntile = profile['chunk_kb'] * 1024 // np.dtype(datatype).itemsize
+        ntile = max( 1, int(ntile) )
+        if nspace == 1:
+            chunks[-1] = min( shape[-1], ntile )
+        else:
+            chunks[-2] = min( shape[-2], max( 1, int( np.sqrt(ntile) ) ) )
+            chunks[-1] = min( shape[-1], max( 1, ntile // chunks[-2] ) )
+    # chunk size along the unlimited dimension is not limited by its current length
+    return [ max( 1, int(chunk) ) for chunk in chunks ]
+
+
+def create_output_variable(fid, name, datatype, dims, shape=None, profile=None, block_length=None,
+                           nfields=1):
+    '''
+    Create a NetCDF variable with compression (and chunking if shape is provided) 
+    of an output profile. The HDF5 chunk cache of chunked fields is set to hold 
+    all chunks touched by a block of time steps, so that chunks are compressed 
+    once when complete rather than at every block write, up to cache_mb / nfields
+    (caches of all variables are kept until the file is closed)
+    For a Zarr store (Zarr_File), the array is chunked by block_length instead
+    nfields: number of fields of the file sharing cache_mb of the profile
+    '''
+    if isinstance( fid, Zarr_File ):
+        return fid.createVariable( name, datatype, dims, block_length=block_length )
+    if (profile == None) or ( (profile['compression'] == None) & (profile['chunking'] == None) ):
+        return fid.createVariable( name, datatype, dims )
+
+    kwds = {}
+    if profile['compression'] != None:
+        kwds['compression'] = profile['compression']
+        kwds['complevel'] = profile['complevel']
+        kwds['shuffle'] = profile['shuffle']
+    if (shape != None) & (profile['chunking'] != None):
+        kwds['chunksizes'] = output_chunks( profile, dims, shape, datatype )
+    var = fid.createVariable( name, datatype, dims, **kwds )
+
+    if 'chunksizes' in kwds:
+        nlead = len(dims) - ( 2 if 'lat' in dims[-2:] else 1 )
+        chunks = kwds['chunksizes']
+        cache_size = np.dtype(datatype).itemsize * chunks[0] * int( np.prod( shape[1:] ) ) \
+                     if nlead > 0 else np.dtype(datatype).itemsize * int( np.prod(shape) )
+        nchunk = int( np.prod( [ -(-size // chunk) for size, chunk in 
+                                 zip( shape[1:] if nlead > 0 else shape, 
+                                      chunks[1:] if nlead > 0 else chunks ) ] ) )
+        cache_max = profile['cache_mb'] * 1024**2 / max( nfields, 1 )
+        var.set_var_chunk_cache( size=int( min( cache_size, cache_max ) ),
+                                 nelems=max( 1009, 2 * nchunk + 1 ), preemption=0.75 )
+    return var
+# ============== END NetCDF output profiles (NetCDF4/HDF5) ===============
+# ========================================================================
+
+
+# ========================================================================
+# ========================== Zarr output store ===========================
+# ========================================================================
+def zarr_attr(value):
+    '''
+    Attribute value of a Zarr array/group (JSON serializable)
+    '''
+    if isinstance( value, np.ndarray ):
+        return value.item() if value.ndim == 0 else value.tolist()
+    elif isinstance( value, np.generic ):
+        return value.item()
+    elif isinstance( value, bytes ):
+        return value.decode()
+    return value
+
+
+class Zarr_File(object):
+    '''
+    NAME:
+           Zarr_File
+
+    PURPOSE:
+           Zarr store (directory) with the part of the netCDF4.Dataset interface used
+           for writing regridded fields (createDimension, createVariable, setncattr,
+           global attributes, close), so that the store has the same dimensions, 
+           coordinates, and attributes as the NetCDF output. Dimension names follow 
+           the xarray convention, so that xr.open_zarr reads fields as dask arrays
+
+           Blocks of fields along the first dimension (e.g., time) are the chunks of 
+           the store. They are written concurrently by a thread pool (compression 
+           releases the GIL), and each written block is recorded in a marker file
+           (in '.<store name>.blocks' next to the store).
+           If the store was created by the same job (job_key), arrays and written 
+           blocks are kept, so that an interrupted run is resumed by skipping 
+           the blocks already present (is_written)
+
+    INPUTS:
+           path: directory of the Zarr store
+           dim_sizes: dictionary of dimension sizes (including the unlimited dimension)
+           job_key: key of the inputs of the run (see Regridding.output_job_key),
+                    None starts a new store
+           nworkers: number of threads writing blocks
+           verbose: Display detailed information on what is being done
+    '''
+
+    def __init__(self, path, dim_sizes={}, job_key=None, nworkers=4, verbose=False):
+        if zarr == None:
+            raise ImportError( 'zarr is needed for output_backend="zarr"\n' + \
+                               'Please install zarr (and dask to read the store lazily)' )
+        # global attributes are set by attribute assignment (fid.name = value), 
+        # as for netCDF4.Dataset
+        path = os.path.normpath( path )
+        object.__setattr__( self, 'path', path )
+        object.__setattr__( self, 'dim_sizes', dict( dim_sizes ) )
+        # written blocks are recorded next to the store (not a part of the Zarr hierarchy)
+        object.__setattr__( self, 'marker_dir', os.path.join( os.path.dirname( path ), 
+                                                              '.' + os.path.basename( path ) + '.blocks' ) )
+        object.__setattr__( self, 'verbose', verbose )
+
+        resume = False
+        if (job_key != None) & os.path.isdir( path ):
+            try:
+                resume = zarr.open_group( path, mode='r' ).attrs.get( 'regridding_job' ) == job_key
+            except Exception:
+                resume = False
+        if resume:
+            group = zarr.open_group( path, mode='a' )
+            if verbose:
+                print( 'Resuming Zarr store: ' + path )
+        else:
+            for old_dir in [ path, self.marker_dir ]:
+                if os.path.isdir( old_dir ):
+                    shutil.rmtree( old_dir )
+            group = zarr.open_group( path, mode='w' )
+            if job_key != None:
+                group.attrs['regridding_job'] = job_key
+        os.makedirs( self.marker_dir, exist_ok=True )
+
+        object.__setattr__( self, 'group', group )
+        object.__setattr__( self, 'dims', {} )
+        object.__setattr__( self, 'executor', ThreadPoolExecutor( max_workers=nworkers ) )
+        # pending block writes are bounded, so that only a few blocks are in memory
+        object.__setattr__( self, 'slots', threading.BoundedSemaphore( 2 * nworkers ) )
+        object.__setattr__( self, 'futures', [] )
+
+    def __setattr__(self, name, value):
+        self.setncattr( name, value )
+
+    def setncattr(self, name, value):
+        self.group.attrs[name] = zarr_attr( value )
+
+    def createDimension(self, name, size=None):
+        # size of the unlimited dimension from dim_sizes
+        self.dims[name] = self.dim_sizes[name] if size == None else size
+
+    def createVariable(self, name, datatype, dims, block_length=None, **kwds):
+        '''
+        block_length: length of blocks (chunks) along the first dimension written
+                      concurrently and recorded for resuming (0: the whole array), 
+                      None for arrays written at once (e.g., coordinates)
+        '''
+        dims = list( dims )
+        shape = tuple( [ self.dims[dim] for dim in dims ] )
+        dtype = np.dtype( datatype )
+        if (block_length == None) | (block_length == 0) | (len(shape) == 0):
+            chunks = shape
+        else:
+            chunks = ( min( block_length, shape[0] ), ) + shape[1:]
+
+        if (block_length != None) & (name in self.group):
+            # resume: keep the array (and its written blocks) of the same layout
+            array = self.group[name]
+            if ( tuple( array.shape ) == shape ) & ( tuple( array.chunks ) == chunks ) & \
+               ( array.dtype == dtype ):
+                return Zarr_Variable( self, name, array, blocked=True )
+        self.remove_markers( name )
+
+        fill_value = np.nan if dtype.kind == 'f' else None
+        if hasattr( self.group, 'create_array' ):
+            # Zarr format 3: dimension names in the array metadata
+            array = self.group.create_array( name=name, shape=shape, chunks=chunks, dtype=dtype,
+                                             fill_value=fill_value, dimension_names=dims,
+                                             overwrite=True )
+        else:
+            # Zarr format 2: dimension names in an attribute (xarray convention)
+            array = self.group.create_dataset( name, shape=shape, chunks=chunks, dtype=dtype,
+                                               fill_value=fill_value, overwrite=True )
+            array.attrs['_ARRAY_DIMENSIONS'] = dims
+        return Zarr_Variable( self, name, array, blocked=block_length != None )
+
+    def marker(self, name, block):
+        if block is Ellipsis:
+            return os.path.join( self.marker_dir, name + '.all' )
+        return os.path.join( self.marker_dir, name + '.' + str(block.start) + '-' + str(block.stop) )
+
+    def remove_markers(self, name):
+        for marker in os.listdir( self.marker_dir ):
+            if marker.rsplit( '.', 1 )[0] == name:
+                os.remove( os.path.join( self.marker_dir, marker ) )
+
+    def submit(self, write, *args):
+        self.check_errors()
+        self.slots.acquire()
+        def run():
+            try:
+                write( *args )
+            finally:
+                self.slots.release()
+        self.futures.append( self.executor.submit( run ) )
+
+    def check_errors(self, wait=False):
+        futures = []
+        for future in self.futures:
+            if wait | future.done():
+                future.result()
+            else:
+                futures.append( future )
+        self.futures[:] = futures
+
+    def close(self):
+        try:
+            self.check_errors( wait=True )
+        finally:
+            self.executor.shutdown( wait=True )
+        # consolidated metadata for fast opening (e.g., xr.open_zarr)
+        zarr.consolidate_metadata( self.path )
+
+
+class Zarr_Variable(object):
+    '''
+    Array of a Zarr_File. Blocks of blocked arrays (chunk-aligned slices along 
+    the first dimension, or the whole array) are written by the thread pool
+    of the store and recorded as written once complete
+    '''
+
+    def __init__(self, fid, name, array, blocked=False):
+        self.fid = fid
+        self.name = name
+        self.array = array
+        self.blocked = blocked
+
+    def setncattr(self, name, value):
+        self.array.attrs[name] = zarr_attr( value )
+
+    def is_block(self, index):
+        if not self.blocked:
+            return False
+        if index is Ellipsis:
+            return len( self.array.chunks ) == 0 or \
+                   tuple( self.array.chunks ) == tuple( self.array.shape )
+        if type(index) != slice:
+            return False
+        if (index.start == None) | (index.stop == None) | (index.step not in [None, 1]):
+            return False
+        chunk = self.array.chunks[0]
+        return ( index.start % chunk == 0 ) & \
+               ( (index.stop % chunk == 0) | (index.stop == self.array.shape[0]) )
+
+    def is_written(self, index):
+        return self.is_block( index ) and os.path.exists( self.fid.marker( self.name, index ) )
+
+    def write_block(self, index, value):
+        self.array[index] = value
+        open( self.fid.marker( self.name, index ), 'w' ).close()
+
+    def __setitem__(self, index, value):
+        if self.is_block( index ):
+            self.fid.submit( self.write_block, index, np.asarray( value ) )
+        else:
+            self.array[index] = value
+# ======================== END Zarr output store =========================
+# ========================================================================
 
 
 class Add_bounds(object):
@@ -75,11 +475,13 @@ class Add_bounds(object):
            newfilename: If provided, this variable will be used for new filename
            creation_date: If True, creation date will be added in the filename
            nc_file_format: NetCDF file format to be used in NetCDF4 library
+           output_profile: NetCDF4 compression of the grid info file (see get_output_profile)
+                           its format overrides nc_file_format
            verbose: Display detailed information on what is being done  
     '''
     
     def __init__(self, filename, newfilename=None, creation_date=True,
-                 nc_file_format='NETCDF3_64BIT_DATA', verbose=False):
+                 nc_file_format='NETCDF3_64BIT_DATA', output_profile=None, verbose=False):
         
         # ========================================================================
         # ============= Pass input values to class-accessible values =============
@@ -123,7 +525,8 @@ class Add_bounds(object):
         ds_in = xr.open_dataset( self.filename, decode_times=False )
         
         # === Open file for grid description === 
-        fid = Dataset( self.gridfilename, 'w', format=nc_file_format )
+        profile = get_output_profile( output_profile, nc_file_format )
+        fid = Dataset( self.gridfilename, 'w', format=profile['format'] )
         
         # === create dimension variables ===
         fid.createDimension( 'lat', len(ds_in['lat'].values) )
@@ -131,8 +534,8 @@ class Add_bounds(object):
         fid.createDimension( 'bound', 2 )
         
         # === write dimension variables ===
-        latvar = fid.createVariable( 'lat', 'f4', ('lat',) )
-        lonvar = fid.createVariable( 'lon', 'f4', ('lon',) )
+        latvar = create_output_variable( fid, 'lat', 'f4', ('lat',), profile=profile )
+        lonvar = create_output_variable( fid, 'lon', 'f4', ('lon',), profile=profile )
         
         # === copy values ===
         latvar[:] = ds_in['lat'].values
@@ -149,22 +552,12 @@ class Add_bounds(object):
         
         
         # === create Variables - lon_bnds and lat_bnds ===
-        latbndvar = fid.createVariable( 'lat_bnds', 'f8', ('lat','bound') )
-        lonbndvar = fid.createVariable( 'lon_bnds', 'f8', ('lon','bound') )
+        latbndvar = create_output_variable( fid, 'lat_bnds', 'f8', ('lat','bound'), profile=profile )
+        lonbndvar = create_output_variable( fid, 'lon_bnds', 'f8', ('lon','bound'), profile=profile )
         
        
         # === calculate bounds for longitudes and latitudes ===
-        lat_bounds = np.zeros( (len(latvar), 2 ) )
-        lon_bounds = np.zeros( (len(lonvar), 2 ) )
-        
-        lat_interval = ds_in['lat'].values[1] - ds_in['lat'].values[0]
-        lon_interval = ds_in['lon'].values[1] - ds_in['lon'].values[0]
-        
-        lat_bounds[:,0] = ds_in['lat'].values - lat_interval / 2.
-        lat_bounds[:,1] = ds_in['lat'].values + lat_interval / 2.
-        
-        lon_bounds[:,0] = ds_in['lon'].values - lon_interval / 2.
-        lon_bounds[:,1] = ds_in['lon'].values + lon_interval / 2.
+        lat_bounds, lon_bounds = bounds_FV( ds_in['lat'].values, ds_in['lon'].values )
             
         # === copy values ===
         latbndvar[:] = lat_bounds
@@ -190,6 +583,626 @@ class Add_bounds(object):
         
         
         
+def bounds_FV(lat, lon):
+    '''
+    Bounds of a regular lat/lon grid (nlat x 2, nlon x 2): centers -/+ half of 
+    the first interval, in the order of centers (as written by Add_bounds)
+    '''
+    lat = np.asarray( lat, dtype='f8' )
+    lon = np.asarray( lon, dtype='f8' )
+    lat_bounds = np.zeros( (len(lat), 2 ) )
+    lon_bounds = np.zeros( (len(lon), 2 ) )
+
+    lat_interval = lat[1] - lat[0]
+    lon_interval = lon[1] - lon[0]
+
+    lat_bounds[:,0] = lat - lat_interval / 2.
+    lat_bounds[:,1] = lat + lat_interval / 2.
+
+    lon_bounds[:,0] = lon - lon_interval / 2.
+    lon_bounds[:,1] = lon + lon_interval / 2.
+    return lat_bounds, lon_bounds
+
+
+# ===== ESMF weight file as a sparse matrix (cached) =====
+_weight_matrix_cache = {}
+
+# NetCDF/HDF5 calls from pipeline threads
+_netcdf_lock = threading.Lock()
+
+def read_weight_file(wgt_file, verbose=False):
+    '''
+    NAME:
+           read_weight_file
+
+    PURPOSE:
+           Read an ESMF weight file into a CSR sparse matrix W (n_b x n_a),
+           so that regridding is a matrix product, dst = W @ src
+           Rows/columns follow the ESMF sequence index of the destination/source,
+           i.e., C-order (lat, lon) for FV grids and ncol for SE(-RR) meshes
+           The matrix is kept for the same file (path, size, modification time)
+           so that repeated regridding with the same weights reads the file once
+
+    INPUTS:
+           wgt_file: ESMF weight filename ("S", "row", "col" with 1-based indices)
+           verbose: display detailed information on what is being done
+    '''
+    # number of weight matrices kept in memory
+    max_cache = 4
+
+    key = file_state( wgt_file )
+    if key in _weight_matrix_cache:
+        if verbose:
+            print( 'Use cached weight matrix: ' + wgt_file )
+        return _weight_matrix_cache[key]
+
+    fid = Dataset( wgt_file, 'r' )
+    fid.set_auto_mask( False )
+    n_a = len( fid.dimensions['n_a'] )
+    n_b = len( fid.dimensions['n_b'] )
+    S = np.asarray( fid.variables['S'][:], dtype=np.float64 )
+    row = np.asarray( fid.variables['row'][:], dtype=np.int64 ) - 1
+    col = np.asarray( fid.variables['col'][:], dtype=np.int64 ) - 1
+    fid.close()
+
+    weight_matrix = csr_matrix( (S, (row, col)), shape=(n_b, n_a) )
+    if verbose:
+        print( 'Read weight file: ' + wgt_file )
+        print( 'n_a (source): ' + str(n_a) + ', n_b (destination): ' + str(n_b) + \
+               ', n_s (weights): ' + str(len(S)) )
+
+    if len( _weight_matrix_cache ) >= max_cache:
+        _weight_matrix_cache.pop( next( iter( _weight_matrix_cache ) ) )
+    _weight_matrix_cache[key] = weight_matrix
+    return weight_matrix
+
+
+# ===== Content-addressed store of weight files =====
+_grid_key_cache = {}
+
+def grid_file_key(grid_file):
+    '''
+    Content hash of a grid description file (GRIDSPEC or SCRIP): centers, bounds/corners,
+    and masks. The hash is kept for the same file (path, size, modification time)
+    An in-memory grid (xarray Dataset) has the same hash as a file of the same contents,
+    and the hash is kept for the same Dataset object (values changed in place 
+    afterwards are not checked)
+    '''
+    # number of grid hashes kept in memory
+    max_cache = 64
+
+    if isinstance( grid_file, xr.Dataset ):
+        grid_info = grid_file
+        file_key = ( 'id', id(grid_file) )
+        grid_ref = weakref.ref( grid_file )
+    else:
+        grid_info = None
+        file_key = file_state( grid_file )
+        grid_ref = None
+    if file_key in _grid_key_cache:
+        # the id of a Dataset may be reused by another object after it is freed
+        ref, grid_key = _grid_key_cache[file_key]
+        if (ref is None) or (ref() is grid_file):
+            return grid_key
+    if grid_info is None:
+        grid_info = xr.open_dataset( grid_file, decode_times=False )
+    grid_vars = ['grid_dims', 'grid_center_lat', 'grid_center_lon', 'grid_corner_lat',
+                 'grid_corner_lon', 'grid_imask', 'lat', 'lon', 'mask']
+    for dim in ['lat', 'lon']:
+        if (dim in grid_info.variables):
+            if 'bounds' in grid_info[dim].attrs.keys():
+                grid_vars.append( grid_info[dim].attrs['bounds'] )
+    items = []
+    for name in grid_vars:
+        if name in grid_info.variables:
+            items += [ name, grid_info[name].values ]
+    if grid_ref is None:
+        grid_info.close()
+
+    if len( _grid_key_cache ) >= max_cache:
+        _grid_key_cache.pop( next( iter( _grid_key_cache ) ) )
+    _grid_key_cache[file_key] = ( grid_ref, grid_fingerprint( *items ) )
+    return _grid_key_cache[file_key][1]
+
+
+class Weight_Cache(object):
+    '''
+    NAME:
+           Weight_Cache
+
+    PURPOSE:
+           On-disk store of ESMF weight files addressed by a hash of the source grid,
+           destination grid, regridding method, unmapped action, and ESMF version.
+           Weights of a grid pair are generated once and found again by later jobs,
+           regardless of grid filenames. The least recently used weight files are 
+           removed when the total size of the store exceeds max_size_gb, except for
+           weight files used within grace_period, which other jobs may be reading.
+           Updates of the index are serialized between jobs with a lock file 
+           (wgt_cache_index.lock)
+
+    INPUTS:
+           cache_dir: directory of the weight files and the index (wgt_cache_index.json)
+           max_size_gb: maximum total size of the weight files [GB]
+           grace_period: weight files used within this period [s] are not removed
+           verbose: display detailed information on what is being done
+    '''
+    
+    def __init__(self, cache_dir, max_size_gb=10., grace_period=600., verbose=False):
+        self.cache_dir = cache_dir
+        self.max_size_gb = max_size_gb
+        self.grace_period = grace_period
+        self.verbose = verbose
+        self.index_file = os.path.join( cache_dir, 'wgt_cache_index.json' )
+        self.lock_file = os.path.join( cache_dir, 'wgt_cache_index.lock' )
+        os.makedirs( cache_dir, exist_ok=True )
+
+    # ===== Key and filename of a weight file =====
+    def pair_key(self, src_grid_file, dst_grid_file, method, unmapped_action):
+        '''
+        Key of a grid pair, method, and unmapped action (any ESMF version)
+        '''
+        return grid_fingerprint( 'ESMF weights', grid_file_key( src_grid_file ),
+                                 grid_file_key( dst_grid_file ), method.lower(), 
+                                 unmapped_action.lower() )
+
+    def key(self, src_grid_file, dst_grid_file, method, unmapped_action):
+        return grid_fingerprint( self.pair_key( src_grid_file, dst_grid_file, 
+                                                method, unmapped_action ),
+                                 str( getattr( ESMF, '__version__', '' ) ) )
+
+    def path(self, key):
+        return os.path.join( self.cache_dir, 'wgt_' + key + '.nc' )
+
+    def temp_path(self, key):
+        '''
+        Filename for generating weights, moved into the store when complete
+        so that other jobs never read a partially written file
+        '''
+        return os.path.join( self.cache_dir, 'wgt_' + key + '.' + str( os.getpid() ) + '.tmp' )
+
+    # ===== Lock of the index between jobs =====
+    def lock(self):
+        fid = open( self.lock_file, 'a' )
+        if fcntl != None:
+            fcntl.flock( fid, fcntl.LOCK_EX )
+        return fid
+
+    def unlock(self, fid):
+        if fcntl != None:
+            fcntl.flock( fid, fcntl.LOCK_UN )
+        fid.close()
+
+    # ===== Index of weight files (information and last use) =====
+    def read_index(self):
+        try:
+            with open( self.index_file ) as fid:
+                return json.load( fid )
+        except (OSError, ValueError):
+            return {}
+
+    def write_index(self, index):
+        temp_file = self.index_file + '.' + str( os.getpid() ) + '.tmp'
+        with open( temp_file, 'w' ) as fid:
+            json.dump( index, fid, indent=1 )
+        os.replace( temp_file, self.index_file )
+
+    # ===== Look up, store, and evict weight files =====
+    def lookup(self, key, pair_key=None):
+        '''
+        Filename of the weight file for the key, or None if not in the store.
+        Without ESMPy, the latest weight file of pair_key (any ESMF version) is used.
+        The last use in the index is updated once per minute at most
+        '''
+        # minimum interval of index updates for the last use [s]
+        touch_interval = 60.
+
+        wgt_file = self.path( key )
+        index = self.read_index()
+        if ( not os.path.exists( wgt_file ) ) & ( ESMF == None ) & ( pair_key != None ):
+            entries = [ ( index[entry].get( 'created', '' ), entry ) for entry in index.keys()
+                        if ( index[entry].get( 'pair_key' ) == pair_key ) and
+                           os.path.exists( self.path( entry ) ) ]
+            if len(entries) > 0:
+                key = sorted( entries )[-1][1]
+                wgt_file = self.path( key )
+        if not os.path.exists( wgt_file ):
+            if self.verbose:
+                print( 'Weight cache miss: ' + key )
+            return None
+
+        if time.time() - index.get( key, {} ).get( 'last_used', 0. ) > touch_interval:
+            fid = self.lock()
+            try:
+                index = self.read_index()
+                index.setdefault( key, {} )['last_used'] = time.time()
+                self.write_index( index )
+            finally:
+                self.unlock( fid )
+        if self.verbose:
+            print( 'Weight cache hit: ' + wgt_file )
+        return wgt_file
+
+    def store(self, key, temp_file, info={}):
+        '''
+        Move a generated weight file into the store, and evict old weight files
+        '''
+        wgt_file = self.path( key )
+        fid = self.lock()
+        try:
+            os.replace( temp_file, wgt_file )
+            index = self.read_index()
+            index[key] = dict( info )
+            index[key]['created'] = str( datetime.datetime.now() )
+            index[key]['last_used'] = time.time()
+            self.write_index( index )
+        finally:
+            self.unlock( fid )
+        if self.verbose:
+            print( 'Weight cache store: ' + wgt_file )
+
+        self.evict( keep=key )
+        return wgt_file
+
+    def evict(self, keep=None):
+        '''
+        Remove the least recently used weight files until the total size 
+        is less than max_size_gb (the weight file of "keep" and weight files used 
+        within grace_period are never removed).
+        Weight files without index entries are ordered by modification time
+        '''
+        fid = self.lock()
+        try:
+            self.evict_locked( keep=keep )
+        finally:
+            self.unlock( fid )
+
+    def evict_locked(self, keep=None):
+        index = self.read_index()
+        entries = []
+        for filename in os.listdir( self.cache_dir ):
+            if (filename[:4] != 'wgt_') | (filename[-3:] != '.nc'):
+                continue
+            key = filename[4:-3]
+            file_stat = os.stat( os.path.join( self.cache_dir, filename ) )
+            last_used = index.get( key, {} ).get( 'last_used', file_stat.st_mtime )
+            entries.append( ( last_used, file_stat.st_size, key ) )
+
+        total_size = np.sum( [ entry[1] for entry in entries ] )
+        for last_used, size, key in sorted( entries ):
+            if total_size <= self.max_size_gb * 1024.**3:
+                break
+            if ( key == keep ) | ( time.time() - last_used < self.grace_period ):
+                continue
+            try:
+                os.remove( self.path( key ) )
+            except OSError:
+                continue
+            total_size -= size
+            index.pop( key, None )
+            if self.verbose:
+                print( 'Weight cache evict: ' + self.path( key ) )
+
+        # remove index entries of weight files removed by other jobs
+        for key in list( index.keys() ):
+            if not os.path.exists( self.path( key ) ):
+                index.pop( key )
+        self.write_index( index )
+
+
+# ===== Grid information and ESMF objects kept per process =====
+_grid_info_cache = {}
+_esmf_grid_cache = {}
+_esmf_transfer_cache = {}
+
+def grid_state(grid):
+    '''
+    Key of a grid file (path, size, modification time) 
+    or an in-memory grid (content hash, see grid_file_key) for per-process caches
+    '''
+    if isinstance( grid, xr.Dataset ):
+        return ( 'in-memory', grid_file_key( grid ) )
+    return file_state( grid )
+
+
+def grid_name(grid, abspath=False):
+    '''
+    Name of a grid for attributes and information: filename, or 'in-memory grid <hash>'
+    '''
+    if isinstance( grid, xr.Dataset ):
+        return 'in-memory grid ' + grid_file_key( grid )
+    return os.path.abspath( grid ) if abspath else grid
+
+
+def read_grid_info(grid_file):
+    '''
+    Grid description file (GRIDSPEC or SCRIP) loaded into memory. It is kept for 
+    the same file, so that Regridding instances in a process (e.g., files of 
+    a Regridding_Session) read it once. The dataset is shared: do not modify it
+    An in-memory grid (xarray Dataset) is returned as it is
+    '''
+    # number of grid files kept in memory
+    max_cache = 8
+
+    if isinstance( grid_file, xr.Dataset ):
+        return grid_file
+    key = file_state( grid_file )
+    if key not in _grid_info_cache:
+        if len( _grid_info_cache ) >= max_cache:
+            _grid_info_cache.pop( next( iter( _grid_info_cache ) ) )
+        with _netcdf_lock:
+            with xr.open_dataset( grid_file ) as grid_info:
+                _grid_info_cache[key] = grid_info.load()
+    return _grid_info_cache[key]
+
+
+def esmf_grid(grid_file, grid_type):
+    '''
+    ESMF Grid (FV, GRIDSPEC with corners) or Mesh (SE, SCRIP) of a grid file,
+    or of an in-memory grid (xarray Dataset with GRIDSPEC or SCRIP variables)
+    built from its coordinate arrays (create_grid_FV, create_mesh_SE).
+    Built once per process for the same file or grid fingerprint
+    '''
+    check_ESMF( 'for ESMF grids and meshes' )
+    # number of ESMF grids and meshes kept in memory
+    max_cache = 8
+
+    key = grid_state( grid_file ) + ( grid_type, )
+    if key not in _esmf_grid_cache:
+        if len( _esmf_grid_cache ) >= max_cache:
+            _esmf_grid_cache.pop( next( iter( _esmf_grid_cache ) ) )
+        if isinstance( grid_file, xr.Dataset ):
+            grid_info = grid_file
+            if grid_type == 'FV':
+                bnds = {}
+                for dim in ['lat', 'lon']:
+                    bnds_name = grid_info[dim].attrs.get( 'bounds', dim + '_bnds' )
+                    bnds[dim] = grid_info[bnds_name].values if bnds_name in grid_info else None
+                _esmf_grid_cache[key] = create_grid_FV( grid_info['lat'].values, grid_info['lon'].values,
+                                                        lat_bnds=bnds['lat'], lon_bnds=bnds['lon'] )
+            elif grid_type == 'SE':
+                coords = {}
+                for name in ['grid_center_lon', 'grid_center_lat', 'grid_corner_lon', 'grid_corner_lat']:
+                    coords[name] = grid_info[name].values.astype('f8')
+                    if 'rad' in grid_info[name].attrs.get( 'units', 'degrees' ).lower():
+                        coords[name] = np.degrees( coords[name] )
+                _esmf_grid_cache[key] = create_mesh_SE( coords['grid_center_lon'], coords['grid_center_lat'],
+                                                        coords['grid_corner_lon'], coords['grid_corner_lat'] )
+        elif grid_type == 'FV':
+            _esmf_grid_cache[key] = ESMF.Grid( filename=grid_file, 
+                                               filetype=ESMF.FileFormat.GRIDSPEC,
+                                               add_corner_stagger=True )
+        elif grid_type == 'SE':
+            _esmf_grid_cache[key] = ESMF.Mesh( filename=grid_file, 
+                                               filetype=ESMF.FileFormat.SCRIP )
+    return _esmf_grid_cache[key]
+
+
+def esmf_transfer(src_grid_file, dst_grid_file, src_grid, dst_grid, wgt_file, nbatch):
+    '''
+    ESMF_Transfer of grids and weights, built once per process 
+    for the same files and batch size
+    '''
+    # number of batched field pairs kept in memory
+    max_cache = 4
+
+    key = ( grid_state( src_grid_file ), grid_state( dst_grid_file ), 
+            file_state( wgt_file ), nbatch )
+    if key not in _esmf_transfer_cache:
+        if len( _esmf_transfer_cache ) >= max_cache:
+            _esmf_transfer_cache.pop( next( iter( _esmf_transfer_cache ) ) )
+        _esmf_transfer_cache[key] = ESMF_Transfer( src_grid, dst_grid, wgt_file, nbatch )
+    return _esmf_transfer_cache[key]
+
+
+# ===== In-memory grids and ESMF grids/meshes from coordinate arrays =====
+def grid_dataset_FV(lat, lon, lat_bnds=None, lon_bnds=None):
+    '''
+    NAME:
+           grid_dataset_FV
+
+    PURPOSE:
+           In-memory grid description (xarray Dataset with lat, lon, lat_bnds, lon_bnds)
+           of a lat/lon grid, i.e., Add_bounds without a file: the same variables, types,
+           and bounds (bounds_FV, if not provided), so that it gives the same weights 
+           and weight cache entries as the Add_bounds file. As in Add_bounds, bounds are 
+           not limited at the poles. Can be used as src_grid_file/dst_grid_file of Regridding
+
+    INPUTS:
+           lat: latitude centers (1-D array)
+           lon: longitude centers (1-D array)
+           lat_bnds: latitude bounds (nlat x 2), if available
+           lon_bnds: longitude bounds (nlon x 2), if available
+    '''
+    lat_bounds, lon_bounds = bounds_FV( lat, lon )
+    if lat_bnds is None:
+        lat_bnds = lat_bounds
+    if lon_bnds is None:
+        lon_bnds = lon_bounds
+    # centers in 'f4' and bounds in 'f8' (Add_bounds)
+    return xr.Dataset( { 'lat_bnds':( ('lat','bound'), np.asarray( lat_bnds, dtype='f8' ) ), 
+                         'lon_bnds':( ('lon','bound'), np.asarray( lon_bnds, dtype='f8' ) ) },
+                       coords={ 'lat':( 'lat', np.asarray( lat, dtype='f4' ), 
+                                        { 'units':'degrees_north', 'bounds':'lat_bnds' } ),
+                                'lon':( 'lon', np.asarray( lon, dtype='f4' ), 
+                                        { 'units':'degrees_east', 'bounds':'lon_bnds' } ) } )
+
+
+def create_grid_FV(lat, lon, lat_bnds=None, lon_bnds=None):
+    '''
+    NAME:
+           create_grid_FV
+
+    PURPOSE:
+           ESMF Grid of a lat/lon grid from coordinate arrays, with center and corner
+           coordinates (lon x lat, as a GRIDSPEC file with add_corner_stagger=True).
+           Corners are the bounds, or bounds_FV if bounds are not provided (as Add_bounds),
+           without limits at the poles. Grids covering 360 degrees of longitude are 
+           periodic in longitude
+
+    INPUTS:
+           lat: latitude centers (1-D array), ascending or descending
+           lon: longitude centers (1-D array)
+           lat_bnds: latitude bounds (nlat x 2), if available
+           lon_bnds: longitude bounds (nlon x 2), if available
+    '''
+    check_ESMF( 'for ESMF grids' )
+    lat = np.asarray( lat, dtype='f8' )
+    lon = np.asarray( lon, dtype='f8' )
+    lat_bounds, lon_bounds = bounds_FV( lat, lon )
+    if lat_bnds is None:
+        lat_bnds = lat_bounds
+    if lon_bnds is None:
+        lon_bnds = lon_bounds
+    # edges between neighboring centers, in the order of centers
+    edges = {}
+    for dim, values, bnds in [ ( 'lat', lat, lat_bnds ), ( 'lon', lon, lon_bnds ) ]:
+        bnds = np.asarray( bnds, dtype='f8' )
+        if (len(values) > 1) and ( (bnds[0,1] - bnds[0,0]) * (values[-1] - values[0]) < 0 ):
+            bnds = bnds[:,::-1]
+        edges[dim] = np.concatenate( ( bnds[:,0], bnds[-1:,1] ) )
+    lat_edge = edges['lat']
+    lon_edge = edges['lon']
+    periodic = abs( abs( lon_edge[-1] - lon_edge[0] ) - 360. ) < 1e-6
+
+    grid = ESMF.Grid( np.array( [ len(lon), len(lat) ] ), 
+                      num_peri_dims=1 if periodic else 0,
+                      staggerloc=[ ESMF.StaggerLoc.CENTER, ESMF.StaggerLoc.CORNER ],
+                      coord_sys=ESMF.CoordSys.SPH_DEG )
+    # local bounds of this PET (a periodic dimension has as many corners as centers)
+    for staggerloc, lon_values, lat_values in [ ( ESMF.StaggerLoc.CENTER, lon, lat ),
+                                                ( ESMF.StaggerLoc.CORNER, lon_edge, lat_edge ) ]:
+        lower = grid.lower_bounds[staggerloc]
+        upper = grid.upper_bounds[staggerloc]
+        grid.get_coords( 0, staggerloc=staggerloc )[...] = lon_values[lower[0]:upper[0], np.newaxis]
+        grid.get_coords( 1, staggerloc=staggerloc )[...] = lat_values[np.newaxis, lower[1]:upper[1]]
+    return grid
+
+
+def create_mesh_SE(center_lon, center_lat, corner_lon, corner_lat):
+    '''
+    NAME:
+           create_mesh_SE
+
+    PURPOSE:
+           ESMF Mesh of an SE(-RR) grid from SCRIP-like coordinate arrays (degrees),
+           elements in the order of ncol (as a SCRIP file). Nodes are the unique corners,
+           and corners repeated to pad cells with fewer corners are removed
+
+    INPUTS:
+           center_lon, center_lat: cell centers (ncol)
+           corner_lon, corner_lat: cell corners (ncol x ncorner), counterclockwise
+    '''
+    check_ESMF( 'for ESMF meshes' )
+    # all nodes and elements are added on one PET (owner 0)
+    if ESMF.Manager().pet_count > 1:
+        raise ValueError( 'In-memory SE meshes are only supported with a single PET (process)\n' + \
+                          'Use a SCRIP grid file (dst_grid_file/src_grid_file) with multiple PETs' )
+    corner_lon = np.asarray( corner_lon, dtype='f8' )
+    corner_lat = np.asarray( corner_lat, dtype='f8' )
+    ncell, ncorner = np.shape( corner_lon )
+    # unique nodes (the same longitude convention, poles as single nodes)
+    node_lon = np.round( corner_lon % 360., 10 )
+    node_lat = np.round( corner_lat, 10 )
+    node_lon[ np.abs(node_lat) == 90. ] = 0.
+    nodes, conn = np.unique( np.stack( [ np.ravel(node_lon), np.ravel(node_lat) ], axis=1 ), 
+                             axis=0, return_inverse=True )
+    conn = np.reshape( conn, (ncell, ncorner) )
+    # corners repeated to pad cells
+    keep = np.ones( (ncell, ncorner), dtype=bool )
+    keep[:,1:] = conn[:,1:] != conn[:,:-1]
+    keep[:,1:] &= conn[:,1:] != conn[:,:1]
+    nvert = np.sum( keep, axis=1 )
+    elem_types = np.copy( nvert )
+    elem_types[ nvert == 3 ] = ESMF.MeshElemType.TRI
+    elem_types[ nvert == 4 ] = ESMF.MeshElemType.QUAD
+
+    mesh = ESMF.Mesh( parametric_dim=2, spatial_dim=2, coord_sys=ESMF.CoordSys.SPH_DEG )
+    mesh.add_nodes( len(nodes), np.arange( 1, len(nodes) + 1 ), np.ravel( nodes ),
+                    np.zeros( len(nodes), dtype=np.int32 ) )
+    mesh.add_elements( ncell, np.arange( 1, ncell + 1 ), elem_types, conn[keep],
+                       element_coords=np.ravel( np.stack( [ np.asarray( center_lon, dtype='f8' ), 
+                                                            np.asarray( center_lat, dtype='f8' ) ], axis=1 ) ) )
+    return mesh
+
+
+# ===== Batched transfer of slices between numpy arrays and ESMF fields =====
+class ESMF_Transfer(object):
+    '''
+    NAME:
+           ESMF_Transfer
+
+    PURPOSE:
+           Regrid batches of slices with ESMF (engine='ESMF') through fields with 
+           an extra (ungridded) dimension of nbatch slices (ndbounds).
+           ESMF field data are Fortran-ordered with the ungridded dimension last, 
+           i.e., (lon, lat, batch) for FV grids and (ncol, batch) for SE meshes, 
+           which is the same memory as C-ordered (batch, lat, lon) / (batch, ncol) 
+           arrays. The reversed-axes views of the field data are used as staging 
+           buffers, so that a batch is copied in and out contiguously once 
+           and regridded by one ESMF call (no strided swapaxes copies per slice)
+
+    INPUTS:
+           src_grid: ESMF Grid (FV) or Mesh (SE) of the source
+           dst_grid: ESMF Grid (FV) or Mesh (SE) of the destination
+           wgt_file: ESMF weight file of the grids
+           nbatch: number of slices regridded by one ESMF call
+    '''
+
+    def __init__(self, src_grid, dst_grid, wgt_file, nbatch):
+        check_ESMF( 'for engine="ESMF"' )
+        self.nbatch = nbatch
+        self.src_field = self.batch_field( src_grid, 'srcbatch', nbatch )
+        self.dst_field = self.batch_field( dst_grid, 'dstbatch', nbatch )
+        self.regrid = ESMF.RegridFromFile( self.src_field, self.dst_field, wgt_file )
+        # C-ordered (batch, lat, lon) or (batch, ncol) views of the field data
+        self.src_data = np.transpose( self.src_field.data )
+        self.dst_data = np.transpose( self.dst_field.data )
+        for grid, data in [ (src_grid, self.src_data), (dst_grid, self.dst_data) ]:
+            self.check_layout( grid, data, nbatch )
+
+    @staticmethod
+    def check_layout(grid, data, nbatch):
+        '''
+        The staging views must be (batch, lat, lon) or (batch, ncol) C-ordered arrays
+        of the whole grid (field data of a single PET in Fortran order)
+        '''
+        if isinstance( grid, ESMF.Mesh ):
+            space_shape = ( int( grid.size[ESMF.MeshLoc.ELEMENT] ), )
+        else:
+            space_shape = tuple( np.asarray( grid.size[ESMF.StaggerLoc.CENTER] )[::-1] )
+        if ( np.shape(data) != (nbatch,) + space_shape ) | ( not data.flags['C_CONTIGUOUS'] ):
+            raise ValueError( 'Unexpected layout of ESMF field data - shape ' + \
+                              str( np.shape(data)[::-1] ) + ', expected ' + \
+                              str( space_shape[::-1] + (nbatch,) ) + ' in Fortran order' )
+
+    @staticmethod
+    def batch_field(grid, name, nbatch):
+        if isinstance( grid, ESMF.Mesh ):
+            return ESMF.Field( grid, name=name, meshloc=ESMF.MeshLoc.ELEMENT, ndbounds=[nbatch] )
+        else:
+            return ESMF.Field( grid, name=name, staggerloc=ESMF.StaggerLoc.CENTER, ndbounds=[nbatch] )
+
+    def __call__(self, var_src, var_dst):
+        '''
+        var_src: (slices, source spatial dimensions) array
+        var_dst: (slices, destination spatial dimensions) array to be filled
+        '''
+        if ( np.shape(var_src)[1:] != np.shape(self.src_data)[1:] ) | \
+           ( np.shape(var_dst)[1:] != np.shape(self.dst_data)[1:] ):
+            raise ValueError( 'Check slices! - source ' + str( np.shape(var_src)[1:] ) + \
+                              ' and destination ' + str( np.shape(var_dst)[1:] ) + \
+                              ' do not match the grids ' + str( np.shape(self.src_data)[1:] ) + \
+                              ' and ' + str( np.shape(self.dst_data)[1:] ) )
+        nslice = len(var_src)
+        for i0 in np.arange( 0, nslice, self.nbatch ):
+            nfill = min( self.nbatch, nslice - i0 )
+            self.src_data[:nfill] = var_src[i0:i0+nfill]
+            if nfill < self.nbatch:
+                self.src_data[nfill:] = 0.
+            self.regrid( self.src_field, self.dst_field )
+            var_dst[i0:i0+nfill] = self.dst_data[:nfill]
+
+
 class Regridding(object):
     '''
     NAME:
@@ -209,6 +1222,9 @@ class Regridding(object):
                        but if a user wants to save additional fields in addition to regridded fields. 
                        Must be xarray variable as it also includes attributes
            dimension: list. if var is not an xarray, dimension must be specified
+                      any number of non-spatial dimensions can lead spatial dimensions
+                      (fields of an xarray Dataset may have different dimensions,
+                       and fields with identical dimensions are regridded together)
                       e.g., dimension = ['time','lat','lon'] for FV
                             dimension = ['any','any2','lat','lon'] for FV
                             dimension = ['any','ncol'] for SE(-RR)
@@ -221,10 +1237,15 @@ class Regridding(object):
                                        'ncol':[0,1,...,97417] }
                             dim_var = {'any':['aa','bb','cc',...'zz'],
                                        'ncol':[0,1,...,97417] }
-           src_grid_file: grid filename for source field
-           dst_grid_file: grid filename for destination field
+           src_grid_file: grid filename for source field, or an in-memory grid
+                          (xarray Dataset with GRIDSPEC or SCRIP variables, e.g., grid_dataset_FV)
+                          if not provided for FV source fields, it is derived from lat/lon
+                          (and lat_bnds/lon_bnds if available) in memory by grid_dataset_FV,
+                          with the same bounds as Add_bounds
+           dst_grid_file: grid filename (or an in-memory grid) for destination field
            wgt_file: weight filename. use the existing weight file (save_weight_file=False)
                                       or create new weight file (save_weight_file=True)
+                     not needed if wgt_cache_dir is provided
            save_wgt_file: if true, create new weight file
            save_wgt_file_only: if true, save weight file only (not regridding)
            no_wgt_file: if true, doesn't create weight file (useful for one-time regridding)
@@ -239,6 +1260,20 @@ class Regridding(object):
            datatype: 'f8' (double) or 'f4' (float)
                      dimension and basic information variables are fixed to f8
            nc_file_format: NetCDF file format to be used in NetCDF4 library
+           output_profile: NetCDF4 chunking/compression of output (see get_output_profile),
+                           e.g., 'time_slab', 'time_series', or 
+                           {'profile':'time_slab', 'compression':'zstd', 'complevel':3}
+                           its format overrides nc_file_format. 
+                           None writes uncompressed nc_file_format files
+           output_backend: 'netcdf' - NetCDF file of nc_file_format/output_profile
+                           'zarr' - Zarr store (directory, e.g., dst_file='results.zarr')
+                                    with the same dimensions, coordinates, and attributes,
+                                    chunked along the first non-spatial dimension 
+                                    (blocks of chunk_mb) and readable by xr.open_zarr (dask).
+                                    Blocks are written concurrently by zarr_workers threads,
+                                    and a rerun of the same inputs skips blocks already 
+                                    written (resumes an interrupted run)
+           zarr_workers: number of threads writing blocks of the Zarr store
            speed_up: if True, speed up regridding, but doesn't return the results to python shell
                      Good for very large dataset and saving NetCDF file in terms of speed and memory
            dst_file: NetCDF filename for results
@@ -247,7 +1282,39 @@ class Regridding(object):
            mw: in case check_results=True. To calculate global emission total
            unit: in case check_results=True. To calculate global emission total
            scale_factor: custom scale factor for output
+           conservation_check: if true, source and destination totals (field x cell area [m2])
+                               and their relative error are calculated for every slice 
+                               of every field while regridding, from cell area vectors 
+                               set up once (area_a/area_b of the weight file or grid files),
+                               and saved in conservation_table (pandas DataFrame)
+           conservation_regions: dictionary of regions for conservation_check in addition
+                                 to the globe, assigned by cell centers
+                                 e.g., {'EUS':[[-95,-75],[25,50]], 'EAS':[[100,150],[20,50]]}
+                                 ([[lon_min, lon_max], [lat_min, lat_max]])
+           conservation_file: CSV filename to save conservation_table
            check_timings: if true, measure time spent for regridding
+           engine: how the weights are applied to the fields
+                   'sparse' - weight file is read into a sparse (CSR) matrix and
+                              all non-spatial slices (e.g., time, level) of a field
+                              are regridded by a sparse x dense matrix product.
+                              ESMF grids/meshes are only built to generate weights
+                   'ESMF' - slices are regridded by ESMF (RegridFromFile) in batches
+                            of fields with an extra dimension (see ESMF_Transfer)
+           unmapped_action: action for destination cells not covered by the source grid
+                            in generating weights - 'error', 'ignore', or
+                            'auto' (try 'error' first, then 'ignore' if failed)
+           wgt_cache_dir: directory of the weight file cache (see Weight_Cache).
+                          if provided, weights are looked up by the source/destination
+                          grids, method, and unmapped_action, and only generated if missing
+                          (save_wgt_file=True regenerates them). wgt_file is not used
+           wgt_cache_size: maximum total size of weight files in wgt_cache_dir [GB],
+                           least recently used weight files are removed beyond it
+           chunk_mb: maximum size of a block of slices [MB] (along the first non-spatial
+                     dimension, e.g., time slabs) regridded at once
+           pipeline: if True (speed_up only), reading block N+1, regridding block N, and 
+                     writing block N-1 run concurrently on threads, so that memory is 
+                     bounded to a few blocks and reading/writing overlap regridding
+                     (compression of output_profile is done in the writer thread)
            ignore_warning: if true, ignore warning messages
            verbose: display detailed information on what is being done
     '''
@@ -257,7 +1324,11 @@ class Regridding(object):
                  save_wgt_file_only=False, method="Conserve", save_results=True, speed_up=True,
                  datatype='f4',nc_file_format='NETCDF3_64BIT_DATA', dst_file=None, 
                  creation_date=True, check_results=False, mw=None, unit=None, scale_factor=1,
-                 check_timings=True, ignore_warning=False, verbose=False):
+                 conservation_check=False, conservation_regions={}, conservation_file=None,
+                 check_timings=True, engine='sparse', unmapped_action='auto', 
+                 wgt_cache_dir=None, wgt_cache_size=10., chunk_mb=256, pipeline=True,
+                 output_profile=None, output_backend='netcdf', zarr_workers=4, 
+                 ignore_warning=False, verbose=False):
         # =========================================================================
         # ===== Check errors and Pass input values to class-accessible values =====
         # =========================================================================
@@ -279,12 +1350,11 @@ class Regridding(object):
             self.xarray_flag = True
             self.time_decoded = True
             if 'time' in list( var_array.dims ):
-                if type( var_array['time'].values[0] ) not in [cftime._cftime.DatetimeGregorian]:
-                    if ('calendar' in dir( var_array['time'] ) ) | \
-                       ( ('time' in list(var_array.dims) ) & \
-                         ('time' not in list(var_array.coords) ) ) | \
-                       ( ( np.dtype( var_array['time'].values[0] ).name ) in ['float32', 'float64'] ):
-                        self.time_decoded = False
+                # decoded time for all CF calendars (datetime64 or cftime objects)
+                if ( 'time' not in list(var_array.coords) ) | \
+                   ( not isinstance( var_array['time'].values[0], 
+                                     (np.datetime64, cftime.datetime) ) ):
+                    self.time_decoded = False
             else:
                 self.time_decoded = False
             
@@ -340,11 +1410,18 @@ class Regridding(object):
                     else:
                         self.var[fld] = self.var_array[fld].values
 
-                # Doesn't consider the case that each variable has each different dimension
-                if dimension != []:
-                    self.dimension = dimension
-                else:
-                    self.dimension = self.var_array[fld].dims
+                # dimensions of each field (fields may have different dimensions)
+                self.field_dim = {}
+                for fld in self.fields:
+                    if dimension != []:
+                        self.field_dim[fld] = list( dimension )
+                    else:
+                        self.field_dim[fld] = list( self.var_array[fld].dims )
+                self.dimension = []
+                for fld in self.fields:
+                    for dim in self.field_dim[fld]:
+                        if dim not in self.dimension:
+                            self.dimension.append( dim )
 
                 # dimension values of var array
                 if dim_var != {}:
@@ -400,6 +1477,7 @@ class Regridding(object):
                 raise ValueError( '"dimension" must be provided for non-xarray values!' )
             else:
                 self.dimension = dimension
+                self.field_dim = { 'regridded_field':list( dimension ) }
             
             if (dim_var == {}) & (save_results):
                 raise ValueError( '"dim_var" must be provided if you want to save results' + \
@@ -437,17 +1515,34 @@ class Regridding(object):
             self.fields = []
         
         # grid file names check
-        if src_grid_file == None:
+        if (src_grid_file is None) & (self.src_type == 'FV'):
+            # in-memory grid from lat/lon (and bounds) of the source, without Add_bounds
+            bnds = {}
+            for dim in ['lat', 'lon']:
+                if self.xarray_flag:
+                    bnds_name = self.var_array[dim].attrs.get( 'bounds', dim + '_bnds' )
+                    bnds[dim] = self.var_array[bnds_name].values if bnds_name in self.var_array else None
+                else:
+                    bnds[dim] = self.dim_var.get( dim + '_bnds' )
+            self.src_grid_file = grid_dataset_FV( self.lat, self.lon, 
+                                                  lat_bnds=bnds['lat'], lon_bnds=bnds['lon'] )
+        elif src_grid_file is None:
             raise ValueError( 'Source grid file ("src_grid_file") must be provided' )
         else:
             self.src_grid_file = src_grid_file
-        if dst_grid_file == None:
+        if dst_grid_file is None:
             raise ValueError( 'Destination grid file ("dst_grid_file") must be provided' )
         else:
             self.dst_grid_file = dst_grid_file
-        if wgt_file == None:
-            raise ValueError( 'Grid Weight filename ("wgt_file") must be provided' )
+        if wgt_cache_dir != None:
+            self.wgt_cache = Weight_Cache( wgt_cache_dir, max_size_gb=wgt_cache_size, 
+                                           verbose=verbose )
+            self.wgt_file = None
+        elif wgt_file == None:
+            raise ValueError( 'Grid Weight filename ("wgt_file") or ' + \
+                              'weight cache directory ("wgt_cache_dir") must be provided' )
         else:
+            self.wgt_cache = None
             self.wgt_file = wgt_file
         if save_results:
             if dst_file == None:
@@ -456,27 +1551,51 @@ class Regridding(object):
                 self.dst_file = dst_file
          
         # regridding_method
-        if method.lower() == "bilinear":
-            self.method = ESMF.RegridMethod.BILINEAR
-        elif method.lower() == "patch":
-            self.method = ESMF.RegridMethod.PATCH
-        elif method.lower() == "nearest_stod":
-            self.method = ESMF.RegridMethod.NEAREST_STOD
-        elif method.lower() == "nearest_dtos":
-            self.method = ESMF.RegridMethod.NEAREST_DTOS
-        elif method.lower() == "conserve":
-            self.method = ESMF.RegridMethod.CONSERVE
-        elif method.lower() == "conserve_2nd":
-            self.method = ESMF.RegridMethod.CONSERVE_2ND
-        else:
+        # (ESMF.RegridMethod is set in setup_ESMF, ESMPy is not needed for existing weights)
+        self.method_name = method
+        if method.lower() not in ['bilinear', 'patch', 'nearest_stod', 'nearest_dtos',
+                                  'conserve', 'conserve_2nd']:
             raise ValueError( 'Check method! - ', method + ' is not available' )
         if verbose:
             print( 'Regridding method used: ' + method )
+
+        # engine for applying weights
+        if engine.lower() == 'sparse':
+            self.engine = 'sparse'
+        elif engine.lower() == 'esmf':
+            self.engine = 'ESMF'
+        else:
+            raise ValueError( 'Check engine! - ' + engine + ' is not available\n' + \
+                              'Currently those are supported: "sparse", "ESMF"' )
+
+        # unmapped action in generating weights
+        if unmapped_action.lower() not in ['auto', 'error', 'ignore']:
+            raise ValueError( 'Check unmapped_action! - ' + unmapped_action + ' is not available\n' + \
+                              'Currently those are supported: "auto", "error", "ignore"' )
+        self.unmapped_action = unmapped_action.lower()
+
+        # output backend of regridded fields
+        if output_backend.lower() not in ['netcdf', 'zarr']:
+            raise ValueError( 'Check output_backend! - ' + output_backend + ' is not available\n' + \
+                              'Currently those are supported: "netcdf", "zarr"' )
+        self.output_backend = output_backend.lower()
+        if (self.output_backend == 'zarr') & save_results & (zarr == None):
+            raise ImportError( 'zarr is needed for output_backend="zarr"\n' + \
+                               'Please install zarr (and dask to read the store lazily)' )
+        
+        # conservation diagnostics
+        if conservation_regions == None:
+            conservation_regions = {}
+        if type(conservation_regions) != dict:
+            raise ValueError( '"conservation_regions" must be a dictionary, ' + \
+                              'e.g., {"EUS":[[-95,-75],[25,50]]}' )
+        if (conservation_file != None) and (not conservation_file.endswith( '.csv' )):
+            raise ValueError( 'Check conservation_file! Supported file type is .csv' )
         
         # add creation date if creation_date=True
         self.creation_date = creation_date
         if creation_date:
-            if save_wgt_file:
+            if save_wgt_file & (self.wgt_cache == None):
                 extension_loc = self.wgt_file.find('.nc')
                 date_now = datetime.datetime.now()
                 self.YMD = str(date_now.year).zfill(4) + str(date_now.month).zfill(2) + \
@@ -486,7 +1605,9 @@ class Regridding(object):
                                 self.wgt_file[extension_loc:]
             
             if save_results:
-                extension_loc = self.dst_file.find('.nc')
+                extension_loc = self.dst_file.find( '.zarr' if self.output_backend == 'zarr' else '.nc' )
+                if extension_loc == -1:
+                    extension_loc = len(self.dst_file)
                 date_now = datetime.datetime.now()
                 self.YMD = str(date_now.year).zfill(4) + str(date_now.month).zfill(2) + \
                            str(date_now.day).zfill(2)
@@ -499,11 +1620,20 @@ class Regridding(object):
         self.save_wgt_file_only  = save_wgt_file_only
         self.save_results        = save_results
         self.datatype            = datatype
-        self.nc_file_format      = nc_file_format
+        self.output_profile      = get_output_profile( output_profile, nc_file_format )
+        self.nc_file_format      = self.output_profile['format']
         self.creation_date       = creation_date
         self.check_results       = check_results
         self.check_timings       = check_timings
         self.scale_factor        = scale_factor
+        self.conservation_check  = conservation_check | (conservation_file != None)
+        self.conservation_regions = conservation_regions
+        self.conservation_file   = conservation_file
+        self.conservation_records = []
+        self.chunk_mb            = chunk_mb
+        self.pipeline            = pipeline & self.speed_up
+        self.zarr_workers        = zarr_workers
+        self.esmf_transfer       = None
         self.ignore_warning      = ignore_warning
         self.verbose             = verbose
         # === END Check errors and Pass input values to class-accessible values ===
@@ -513,7 +1643,7 @@ class Regridding(object):
         # ============================ Initial setup ============================
         # =======================================================================
         # Check whether destination grid is FV or SE(-RR)
-        dst_grid_info = xr.open_dataset( self.dst_grid_file )
+        dst_grid_info = read_grid_info( self.dst_grid_file )
         if ('lat' in list( dst_grid_info.dims )) & \
            ('lon' in list( dst_grid_info.dims )):
             self.dst_type = 'FV'
@@ -529,43 +1659,64 @@ class Regridding(object):
             raise ValueError( 'Check destination grid file!' + '\n' + \
                               'Something wrong with lat/lon/ncol information' )
         
-        # Setup dimension & shape of destination array
-        xdst_grid = xr.open_dataset( self.dst_grid_file )
-        
-        self.dst_dim = []
-        self.dst_shape = []
+        # Setup dimension & shape of destination array for each field
+        # non-spatial dimensions (any number, e.g., time x sector x lev) lead spatial dimensions
+        xdst_grid = read_grid_info( self.dst_grid_file )
+        if self.src_type == 'FV':
+            src_space_dim = ['lat','lon']
+        elif self.src_type == 'SE':
+            src_space_dim = ['ncol']
+        if self.dst_type == 'FV':
+            dst_space_dim = ['lat','lon']
+            dst_space_shape = [ len(xdst_grid['lat'].values), len(xdst_grid['lon'].values) ]
+        elif self.dst_type == 'SE':
+            dst_space_dim = ['ncol']
+            dst_space_shape = [ len( xdst_grid.grid_size ) ]
+
+        self.field_dst_dim = {}
+        self.field_dst_shape = {}
         self.dst_dim_loop = []
         self.dst_shape_loop = []
-        for di, dim in enumerate(self.dimension):
-            if dim in ['lat','lon','ncol']:
-                continue
+        for fld in list( self.field_dim.keys() ):
+            if self.fields != []:
+                var_shape = np.shape( self.var[fld] )
             else:
-                self.dst_dim.append( dim )
-                self.dst_dim_loop.append( dim )
-                if self.fields != []:
-                    self.dst_shape.append( np.shape(self.var[self.fields[0]])[di] )
-                    self.dst_shape_loop.append( np.shape(self.var[self.fields[0]])[di] )
-                else:
-                    self.dst_shape.append( np.shape(self.var)[di] )
-                    self.dst_shape_loop.append( np.shape(self.var)[di] )
-                
-        if self.dst_type == 'FV':
-            self.dst_dim.append('lat')
-            self.dst_shape.append( len(xdst_grid['lat'].values) )
-            self.dst_dim.append('lon')
-            self.dst_shape.append( len(xdst_grid['lon'].values) )
-        elif self.dst_type == 'SE':
-            self.dst_dim.append('ncol')
-            self.dst_shape.append( len( xdst_grid.grid_size ) )
+                var_shape = np.shape( self.var )
+            dims = self.field_dim[fld]
+            nloop = len(dims) - len(src_space_dim)
+            if (len(dims) != len(var_shape)) | (list(dims[nloop:]) != src_space_dim):
+                raise ValueError( 'Check dimensions of ' + fld + ': ' + str(list(dims)) + '\n' + \
+                                  'Spatial dimensions ' + str(src_space_dim) + \
+                                  ' must be the last dimensions' )
+            self.field_dst_dim[fld] = list(dims[:nloop]) + dst_space_dim
+            self.field_dst_shape[fld] = list(var_shape[:nloop]) + dst_space_shape
+            for di in np.arange( nloop ):
+                if dims[di] not in self.dst_dim_loop:
+                    self.dst_dim_loop.append( dims[di] )
+                    self.dst_shape_loop.append( var_shape[di] )
+                elif self.dst_shape_loop[self.dst_dim_loop.index(dims[di])] != var_shape[di]:
+                    raise ValueError( 'Check dimension "' + dims[di] + '" of ' + fld + '!\n' + \
+                                      'The size is different from other fields' )
+
+        # all dimensions in the destination file
+        self.dst_dim = self.dst_dim_loop + dst_space_dim
+        self.dst_shape = self.dst_shape_loop + dst_space_shape
+
+        # fields with identical dimensions are regridded together
+        self.field_groups = {}
+        for fld in self.fields:
+            signature = ( tuple( self.field_dim[fld] ), tuple( self.field_dst_shape[fld] ) )
+            self.field_groups.setdefault( signature, [] ).append( fld )
+        self.field_groups = list( self.field_groups.values() )
 
         # Setup destination array
         if not self.speed_up:
             if self.xarray_flag:
                 self.var_dst = {}
                 for fld in self.fields:
-                    self.var_dst[fld] = np.zeros( self.dst_shape )
+                    self.var_dst[fld] = np.zeros( self.field_dst_shape[fld] )
             else:
-                self.var_dst = np.zeros( self.dst_shape )
+                self.var_dst = np.zeros( self.field_dst_shape['regridded_field'] )
             
         if self.check_timings:
             self.Edate = datetime.datetime.now()
@@ -578,10 +1729,12 @@ class Regridding(object):
         # Call regridding function using ESMF
         self.call_ESMF()
         
-    def call_ESMF(self):
+    def setup_ESMF(self):
         # =======================================================================
         # ==================== Generate regridding operator =====================
         # =======================================================================
+        check_ESMF( 'to generate weights or to regrid with engine="ESMF"' )
+        self.method = getattr( ESMF.RegridMethod, self.method_name.upper() )
         if self.check_timings:
             self.Sdate = datetime.datetime.now()
             print( 'Grid/Field setup start: ', self.Sdate )
@@ -595,14 +1748,11 @@ class Regridding(object):
             #    self.src_grid = ESMF.Grid( filename=self.src_grid_file, 
             #                               filetype=ESMF.FileFormat.GRIDSPEC )
             #else:
-            self.src_grid = ESMF.Grid( filename=self.src_grid_file, 
-                                       filetype=ESMF.FileFormat.GRIDSPEC,
-                                       add_corner_stagger=True )
+            self.src_grid = esmf_grid( self.src_grid_file, 'FV' )
             self.src_field = ESMF.Field( self.src_grid, name='srcfield', 
                                          staggerloc=ESMF.StaggerLoc.CENTER )
         elif self.src_type == 'SE':
-            self.src_grid = ESMF.Mesh( filename=self.src_grid_file, 
-                                       filetype=ESMF.FileFormat.SCRIP )
+            self.src_grid = esmf_grid( self.src_grid_file, 'SE' )
             #if self.method in [ESMF.RegridMethod.BILINEAR,
             #                   ESMF.RegridMethod.PATCH,
             #                   ESMF.RegridMethod.NEAREST_STOD]:
@@ -613,14 +1763,11 @@ class Regridding(object):
                                          meshloc=ESMF.MeshLoc.ELEMENT )
         # Destination grid
         if self.dst_type == 'FV':
-            self.dst_grid = ESMF.Grid( filename=self.dst_grid_file, 
-                                       filetype=ESMF.FileFormat.GRIDSPEC,
-                                       add_corner_stagger=True )
+            self.dst_grid = esmf_grid( self.dst_grid_file, 'FV' )
             self.dst_field = ESMF.Field( self.dst_grid, name='dstfield', 
                                          staggerloc=ESMF.StaggerLoc.CENTER )
         elif self.dst_type == 'SE':
-            self.dst_grid = ESMF.Mesh( filename=self.dst_grid_file, 
-                                       filetype=ESMF.FileFormat.SCRIP )
+            self.dst_grid = esmf_grid( self.dst_grid_file, 'SE' )
 
             #if self.method in [ESMF.RegridMethod.BILINEAR,
             #                   ESMF.RegridMethod.PATCH,
@@ -643,14 +1790,24 @@ class Regridding(object):
                 self.Sdate = datetime.datetime.now()
                 print( 'Generating weight start: ', self.Sdate )
 
-            try:
-                self.regrid = ESMF.Regrid( self.src_field, self.dst_field, 
-                                          filename=self.wgt_file, regrid_method=self.method )
-            except:
-                print( "Regridding failed: adding unmappaed_action")
+            if self.unmapped_action == 'ignore':
                 self.regrid = ESMF.Regrid( self.src_field, self.dst_field, 
                                           filename=self.wgt_file, regrid_method=self.method,
-                                          unmapped_action=ESMF.UnmappedAction.IGNORE)               
+                                          unmapped_action=ESMF.UnmappedAction.IGNORE)
+                self.unmapped_action_used = 'ignore'
+            else:
+                try:
+                    self.regrid = ESMF.Regrid( self.src_field, self.dst_field, 
+                                              filename=self.wgt_file, regrid_method=self.method )
+                    self.unmapped_action_used = 'error'
+                except:
+                    if self.unmapped_action == 'error':
+                        raise
+                    print( "Regridding failed: adding unmappaed_action")
+                    self.regrid = ESMF.Regrid( self.src_field, self.dst_field, 
+                                              filename=self.wgt_file, regrid_method=self.method,
+                                              unmapped_action=ESMF.UnmappedAction.IGNORE)
+                    self.unmapped_action_used = 'ignore'
             # Some possible options
             # unmapped_action=ESMF.UnmappedAction.IGNORE
             # ignore_degenerate=True
@@ -663,20 +1820,514 @@ class Regridding(object):
                 print( '========================================================================')
             if self.save_wgt_file_only:
                 return
-        else:
+        # existing weights are read with batched fields in regrid_fields (ESMF_Transfer)
+        
+        # ================== END Generate regridding operator ===================
+        # =======================================================================
+
+
+    # ===== Read ESMF weight file into a sparse matrix =====
+    def read_weights(self):
+        if self.check_timings:
+            self.Sdate = datetime.datetime.now()
+            print( 'Read regridding weight start: ', self.Sdate )
+        self.weight_matrix = read_weight_file( self.wgt_file, verbose=self.verbose )
+        if self.check_timings:
+            self.Edate = datetime.datetime.now()
+            print( 'Read regridding weight end: ', self.Edate )
+            print( time.strftime( "Time spent: %M minutes and %S seconds" , 
+                           time.gmtime( (self.Edate - self.Sdate).seconds ) ) )
+            print( '========================================================================')
+
+
+    # ===== Regrid all non-spatial slices of fields =====
+    def regrid_fields(self, var_list, out_list=None, scale_factor=1, names=None):
+        '''
+        Regrid fields with identical shapes in one batched call. The last dimensions
+        are the spatial dimensions of the source grid (lat, lon for FV; ncol for SE),
+        and all leading dimensions of all fields (e.g., field x time x sector x lev) 
+        are collapsed into one batch axis, processed in blocks (up to chunk_mb) 
+        along the first leading dimension
+        engine='sparse': slices in a block are stacked as columns 
+                         and regridded by one sparse x dense product
+        engine='ESMF': slices in a block are regridded in batches by ESMF (see ESMF_Transfer)
+        out_list: arrays or NetCDF variables (leading dimensions + destination spatial 
+                  dimensions) to be filled, created if not provided
+        scale_factor: multiplied to the regridded values written to out_list
+        names: field names of var_list. If provided with conservation_check=True,
+               totals of all slices are recorded (see record_conservation)
+        '''
+        nspace_src = 2 if self.src_type == 'FV' else 1
+        nspace_dst = 2 if self.dst_type == 'FV' else 1
+        lead_shape = tuple( np.shape(var_list[0])[:np.ndim(var_list[0])-nspace_src] )
+        dst_space_shape = tuple( self.dst_shape[len(self.dst_shape)-nspace_dst:] )
+        nsrc = int( np.prod( np.shape(var_list[0])[len(lead_shape):] ) )
+        ndst = int( np.prod( dst_space_shape ) )
+        for var in var_list:
+            if tuple( np.shape(var)[:len(lead_shape)] ) != lead_shape:
+                raise ValueError( 'Fields regridded together must have the same shape' )
+        if out_list is None:
+            out_list = [ np.zeros( lead_shape + dst_space_shape ) for var in var_list ]
+        if (self.engine == 'ESMF') & (self.esmf_transfer == None):
             if self.check_timings:
                 self.Sdate = datetime.datetime.now()
                 print( 'Read regridding weight start: ', self.Sdate )
-            self.regrid = ESMF.RegridFromFile( self.src_field, self.dst_field, self.wgt_file )
+            # slices of a block (up to chunk_mb) regridded by one ESMF call
+            nslice = len(var_list) * int( np.prod( lead_shape ) )
+            nbatch = max( 1, int( self.chunk_mb * 1024**2 // ( max( nsrc, ndst ) * 8 ) ) )
+            self.esmf_transfer = esmf_transfer( self.src_grid_file, self.dst_grid_file, 
+                                                self.src_grid, self.dst_grid, self.wgt_file,
+                                                min( nslice, nbatch ) )
             if self.check_timings:
                 self.Edate = datetime.datetime.now()
                 print( 'Read regridding weight end: ', self.Edate )
                 print( time.strftime( "Time spent: %M minutes and %S seconds" , 
                                time.gmtime( (self.Edate - self.Sdate).seconds ) ) )
                 print( '========================================================================')
-        
-        # ================== END Generate regridding operator ===================
-        # =======================================================================
+        if self.engine == 'sparse':
+            if ( self.weight_matrix.shape[1] != nsrc ) | ( self.weight_matrix.shape[0] != ndst ):
+                raise ValueError( 'Check weight file! - ' + self.wgt_file + '\n' + \
+                                  'weight matrix (n_b x n_a): ' + str(self.weight_matrix.shape) + \
+                                  ', source size: ' + str(nsrc) + \
+                                  ', destination size: ' + str(ndst) )
+
+        # blocks along the first leading dimension (a whole field without leading dimension)
+        if lead_shape == ():
+            blocks = [ Ellipsis ]
+        else:
+            nblock = self.block_length( var_list )
+            blocks = [ slice( int(i0), int( min( i0 + nblock, lead_shape[0] ) ) ) 
+                       for i0 in np.arange( 0, lead_shape[0], nblock ) ]
+        # blocks already in a resumed Zarr store are skipped
+        if all( [ isinstance( out, Zarr_Variable ) for out in out_list ] ):
+            blocks = [ block for block in blocks 
+                       if not all( [ out.is_written( block ) for out in out_list ] ) ]
+            if self.verbose:
+                print( 'Blocks to be regridded: ' + str( len(blocks) ) )
+
+        def read_block(block):
+            return np.stack( [ np.asarray( var[block] ) for var in var_list ] )
+
+        def regrid_block(block, var_block):
+            # (fields x block x source) -> (fields x block x destination)
+            block_shape = np.shape(var_block)[:np.ndim(var_block)-nspace_src]
+            var_src = var_block
+            if self.engine == 'sparse':
+                var_block = self.weight_matrix @ np.reshape( var_block, (-1, nsrc) ).T
+                var_block = np.reshape( var_block.T, block_shape + dst_space_shape )
+            else:
+                var_dst = np.empty( block_shape + dst_space_shape )
+                self.esmf_transfer( np.reshape( var_block, (-1,) + np.shape(var_block)[len(block_shape):] ),
+                                    np.reshape( var_dst, (-1,) + dst_space_shape ) )
+                var_block = var_dst
+            if self.conservation_check & (names != None):
+                self.record_conservation( names, block, var_src, var_block )
+            if scale_factor != 1:
+                var_block = var_block * scale_factor
+            return var_block
+
+        def write_block(block, var_block):
+            for vi, out in enumerate(out_list):
+                # fields of the block already in a resumed Zarr store are kept
+                if isinstance( out, Zarr_Variable ) and out.is_written( block ):
+                    continue
+                out[block] = var_block[vi]
+
+        if self.pipeline & (len(blocks) > 1):
+            self.run_pipeline( blocks, read_block, regrid_block, write_block )
+        else:
+            for block in blocks:
+                write_block( block, regrid_block( block, read_block( block ) ) )
+
+        return out_list
+
+
+    # ===== Length of blocks along the first non-spatial dimension =====
+    def block_length(self, var_list):
+        '''
+        Number of slices along the first non-spatial dimension regridded at once 
+        (up to chunk_mb for all fields in var_list), 0 for fields without 
+        non-spatial dimensions. Also the chunk length of Zarr output
+        '''
+        nspace_src = 2 if self.src_type == 'FV' else 1
+        nspace_dst = 2 if self.dst_type == 'FV' else 1
+        lead_shape = np.shape(var_list[0])[:np.ndim(var_list[0])-nspace_src]
+        if len(lead_shape) == 0:
+            return 0
+        nsrc = int( np.prod( np.shape(var_list[0])[len(lead_shape):] ) )
+        ndst = int( np.prod( self.dst_shape[len(self.dst_shape)-nspace_dst:] ) )
+        slice_size = len(var_list) * int( np.prod( lead_shape[1:] ) ) * max( nsrc, ndst ) * 8
+        return max( 1, int( self.chunk_mb * 1024**2 // slice_size ) )
+
+
+    # ===== Read -> regrid -> write pipeline on threads =====
+    def run_pipeline(self, blocks, read_block, regrid_block, write_block):
+        '''
+        Read block N+1 (reader thread), regrid block N (this thread), and write block N-1
+        (writer thread) concurrently. Queues hold one block each, so that at most a few
+        blocks are in memory. Reading and writing are serialized by a lock, 
+        as the NetCDF/HDF5 libraries are not thread-safe
+        '''
+        # interval to check whether the other stages stopped [s]
+        wait_time = 0.1
+
+        stop = threading.Event()
+        read_queue = queue.Queue( maxsize=1 )
+        write_queue = queue.Queue( maxsize=1 )
+        errors = []
+
+        def put(work_queue, entry):
+            while not stop.is_set():
+                try:
+                    work_queue.put( entry, timeout=wait_time )
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(work_queue):
+            while not stop.is_set():
+                try:
+                    return work_queue.get( timeout=wait_time )
+                except queue.Empty:
+                    continue
+            return None
+
+        def reader():
+            try:
+                for block in blocks:
+                    with _netcdf_lock:
+                        var_block = read_block( block )
+                    if not put( read_queue, (block, var_block) ):
+                        return
+                put( read_queue, None )
+            except BaseException as err:
+                errors.append( err )
+                stop.set()
+
+        def writer():
+            try:
+                while True:
+                    entry = get( write_queue )
+                    if entry == None:
+                        return
+                    with _netcdf_lock:
+                        write_block( *entry )
+            except BaseException as err:
+                errors.append( err )
+                stop.set()
+
+        threads = [ threading.Thread( target=reader, daemon=True ),
+                    threading.Thread( target=writer, daemon=True ) ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                entry = get( read_queue )
+                if entry == None:
+                    break
+                block, var_block = entry
+                if not put( write_queue, (block, regrid_block( block, var_block )) ):
+                    break
+            put( write_queue, None )
+        except BaseException as err:
+            errors.append( err )
+            stop.set()
+        for thread in threads:
+            thread.join()
+
+        if errors != []:
+            raise errors[0]
+
+
+    def regrid_slices(self, var, out=None, scale_factor=1, name=None):
+        '''
+        Regrid all non-spatial slices of a field (see regrid_fields)
+        '''
+        return self.regrid_fields( [var], None if out is None else [out], 
+                                   scale_factor=scale_factor, 
+                                   names=None if name == None else [name] )[0]
+
+
+    # ===== Conservation diagnostics for all slices =====
+    def grid_cell_info(self, grid_file):
+        '''
+        Cell center longitudes/latitudes [degree] and areas [m2] of a grid file 
+        (SCRIP or lat/lon with bounds), in the order of the weight matrix 
+        (lat x lon raveled for FV, ncol for SE)
+        '''
+        # radius of the Earth [m]
+        Earth_rad = 6.371e6
+        xgrid = read_grid_info( grid_file )
+        if 'grid_center_lat' in xgrid.data_vars:
+            center_lon = xgrid['grid_center_lon'].values.astype('f8')
+            center_lat = xgrid['grid_center_lat'].values.astype('f8')
+            if 'rad' in xgrid['grid_center_lat'].attrs.get( 'units', 'degrees' ).lower():
+                center_lon = np.degrees( center_lon )
+                center_lat = np.degrees( center_lat )
+            if 'grid_area' in xgrid.data_vars:
+                area = xgrid['grid_area'].values.astype('f8') * Earth_rad**2
+            else:
+                area = None
+        else:
+            lat = xgrid['lat'].values
+            lon = xgrid['lon'].values
+            area = np.ravel( calc_grid_area_FV( lat, lon, 
+                                     lat_bnds=xgrid['lat_bnds'].values if 'lat_bnds' in xgrid else None,
+                                     lon_bnds=xgrid['lon_bnds'].values if 'lon_bnds' in xgrid else None,
+                                     Earth_rad=Earth_rad ) )
+            center_lon = np.tile( lon, len(lat) ).astype('f8')
+            center_lat = np.repeat( lat, len(lon) ).astype('f8')
+        return center_lon, center_lat, area
+
+
+    def setup_conservation(self):
+        '''
+        Sparse (global + regions x cells) matrices of cell areas [m2] for the source 
+        and destination grids, so that totals of all slices in a block are one 
+        sparse x dense product. Cell areas are area_a/area_b of the weight file 
+        (conservative methods), otherwise calculated from the grid files
+        '''
+        # radius of the Earth [m]
+        Earth_rad = 6.371e6
+        wgt_area = {}
+        if (self.wgt_file != None) and os.path.exists( self.wgt_file ):
+            with _netcdf_lock:
+                fid = Dataset( self.wgt_file, 'r' )
+                for area_name in ['area_a', 'area_b']:
+                    if area_name in fid.variables:
+                        wgt_area[area_name] = np.asarray( fid[area_name][:], dtype='f8' )
+                fid.close()
+
+        self.conservation_names = ['global'] + list( self.conservation_regions.keys() )
+        for grid_file, area_name, grid_key in [ ( self.src_grid_file, 'area_a', 'src' ), 
+                                                ( self.dst_grid_file, 'area_b', 'dst' ) ]:
+            center_lon, center_lat, area = self.grid_cell_info( grid_file )
+            if area_name in wgt_area:
+                if ( len( wgt_area[area_name] ) == len(center_lon) ) and \
+                   np.all( wgt_area[area_name] > 0 ):
+                    area = wgt_area[area_name] * Earth_rad**2
+            if area is None:
+                raise ValueError( 'Check ' + grid_name( grid_file ) + '!\n' + \
+                                  'Cell areas are needed for conservation_check ' + \
+                                  '("grid_area" or area_a/area_b of the weight file)' )
+            rows = [ np.zeros( len(area), dtype='i8' ) ]
+            cols = [ np.arange( len(area) ) ]
+            for ri, name in enumerate( self.conservation_regions.keys() ):
+                lon_range, lat_range = self.conservation_regions[name]
+                inside = np.where( lon_in_range( center_lon, lon_range ) & 
+                                   ( center_lat >= lat_range[0] ) & ( center_lat <= lat_range[1] ) )[0]
+                rows.append( np.full( len(inside), ri + 1 ) )
+                cols.append( inside )
+            cols = np.concatenate( cols )
+            area_matrix = csr_matrix( ( area[cols], ( np.concatenate( rows ), cols ) ),
+                                      shape=( len(self.conservation_names), len(area) ) )
+            setattr( self, grid_key + '_area_matrix', area_matrix )
+
+
+    def record_conservation(self, names, block, var_src, var_dst):
+        '''
+        Record source and destination totals (global and regions) of all slices 
+        of a block, fields x block shape (leading dimensions) x spatial dimensions
+        '''
+        nlead = np.ndim(var_src) - ( 2 if self.src_type == 'FV' else 1 )
+        block_shape = np.shape(var_src)[:nlead]
+        src_totals = self.src_area_matrix @ np.reshape( var_src, ( int( np.prod(block_shape) ), -1 ) ).T
+        dst_totals = self.dst_area_matrix @ np.reshape( var_dst, ( int( np.prod(block_shape) ), -1 ) ).T
+        start = 0 if block is Ellipsis else block.start
+        self.conservation_records.append( ( list(names), start, block_shape, src_totals, dst_totals ) )
+
+
+    def report_conservation(self):
+        '''
+        Table of source/destination totals and relative errors of all slices 
+        (conservation_table), printed as the maximum relative error of each field 
+        and region, and saved to conservation_file if provided
+        '''
+        tables = []
+        for names, start, block_shape, src_totals, dst_totals in self.conservation_records:
+            dims = self.field_dim[names[0]][:len(block_shape)-1]
+            index = np.reshape( np.indices( block_shape ), ( len(block_shape), -1 ) )
+            columns = { 'field':np.array( names )[index[0]] }
+            for di, dim in enumerate(dims):
+                ind = index[di+1] + ( start if di == 0 else 0 )
+                coord = self.dim_var.get( dim )
+                if (coord is None) or ( len(coord) != self.dst_shape_loop[self.dst_dim_loop.index(dim)] ):
+                    coord = np.arange( self.dst_shape_loop[self.dst_dim_loop.index(dim)] )
+                columns[dim] = np.asarray( coord )[ind]
+            with np.errstate( divide='ignore', invalid='ignore' ):
+                rel_error = np.where( src_totals != 0, ( dst_totals - src_totals ) / src_totals, np.nan )
+            for ri, region in enumerate( self.conservation_names ):
+                table = pd.DataFrame( columns )
+                table['region'] = region
+                table['source_total'] = src_totals[ri]
+                table['destination_total'] = dst_totals[ri]
+                table['relative_error'] = rel_error[ri]
+                tables.append( table )
+        if len(tables) > 0:
+            self.conservation_table = pd.concat( tables, ignore_index=True )
+            columns = [ 'field' ] + [ dim for dim in self.dst_dim_loop 
+                                      if dim in self.conservation_table.columns ] + \
+                      [ 'region', 'source_total', 'destination_total', 'relative_error' ]
+            self.conservation_table = self.conservation_table[columns]
+        else:
+            self.conservation_table = pd.DataFrame()
+            return
+
+        print( '========================================================================')
+        print( 'Conservation: maximum |relative error| of all slices (field x area)' )
+        print( '------------------------------------------------------------------------')
+        max_error = self.conservation_table.assign( abs_error=self.conservation_table['relative_error'].abs() ) \
+                        .groupby( ['field', 'region'], sort=False )['abs_error'].max()
+        for (fld, region), error in max_error.items():
+            print( fld + ', ' + region + ': ' + "{:.2e}".format( error ) )
+        if self.conservation_file != None:
+            self.conservation_table.to_csv( self.conservation_file, index=False )
+            if self.verbose:
+                print( 'Conservation table is saved in ' + self.conservation_file )
+
+
+    # ===== Check results - total emission for the first and last slices =====
+    def check_block_totals(self, var):
+        '''
+        Print source and destination totals [g] of the first and last slices of a field
+        (the whole field if it has no non-spatial dimension). The destination slices 
+        are regridded here, so that regridded fields need not be kept in memory
+        '''
+        if not hasattr( self, 'src_check_kwds' ):
+            for grid_type, grid in [ ( self.src_type, self.src_grid_file ), ( self.dst_type, self.dst_grid_file ) ]:
+                if (grid_type == 'SE') & isinstance( grid, xr.Dataset ):
+                    raise ValueError( 'check_results needs SCRIP files for SE grids\n' + \
+                                      'Use conservation_check for in-memory grids' )
+            xsrc_grid = read_grid_info( self.src_grid_file )
+            xdst_grid = read_grid_info( self.dst_grid_file )
+            check_kwds = { 'unit':self.unit, 'mw':self.mw, 
+                           'print_results':False, 'ignore_warning':True }
+            if self.src_type == 'FV':
+                self.src_check_kwds = { 'dimension':['lat','lon'],
+                                        'dim_var':{ 'lat':xsrc_grid['lat'].values,
+                                                    'lon':xsrc_grid['lon'].values }, **check_kwds }
+            elif self.src_type == 'SE':
+                self.src_check_kwds = { 'scrip_file':self.src_grid_file, 'dimension':['ncol'],
+                                        'dim_var':{ 'ncol':xsrc_grid.grid_size.values }, **check_kwds }
+            if self.dst_type == 'FV':
+                self.dst_check_kwds = { 'dimension':['lat','lon'],
+                                        'dim_var':{ 'lat':xdst_grid['lat'].values,
+                                                    'lon':xdst_grid['lon'].values }, **check_kwds }
+            elif self.dst_type == 'SE':
+                self.dst_check_kwds = { 'scrip_file':self.dst_grid_file, 'dimension':['ncol'],
+                                        'dim_var':{ 'ncol':xdst_grid.grid_size.values }, **check_kwds }
+
+        nlead = np.ndim(var) - ( 2 if self.src_type == 'FV' else 1 )
+        if nlead == 0:
+            blocks = [ ('the block', Ellipsis) ]
+        else:
+            blocks = [ ('the first block', (0,)*nlead), ('the last block', (-1,)*nlead) ]
+        for block_name, index in blocks:
+            # Calc_Emis_T may shift longitudes of dim_var in place
+            src_kwds = dict( self.src_check_kwds, dim_var={ key:np.copy(value) for key, value 
+                                                            in self.src_check_kwds['dim_var'].items() } )
+            dst_kwds = dict( self.dst_check_kwds, dim_var={ key:np.copy(value) for key, value 
+                                                            in self.dst_check_kwds['dim_var'].items() } )
+            var_slice = np.asarray( var[index] )
+            SRC_EMIS = Calc_Emis_T( var_slice, **src_kwds )
+            DST_EMIS = Calc_Emis_T( self.regrid_slices( var_slice ), **dst_kwds )
+            print( 'Source total for ' + block_name + ' [g]: ' + \
+                    "{:.2e}".format( np.around(SRC_EMIS.emissions_total) ) )
+            print( 'Destination total for ' + block_name + ' [g]: ' + \
+                    "{:.2e}".format( np.around(DST_EMIS.emissions_total) ) )
+
+
+    # ===== Open the output file (NetCDF or Zarr store) =====
+    def open_output_file(self):
+        if self.output_backend == 'zarr':
+            return Zarr_File( self.dst_file, dim_sizes=dict( zip( self.dst_dim, self.dst_shape ) ),
+                              job_key=self.output_job_key(), nworkers=self.zarr_workers,
+                              verbose=self.verbose )
+        return Dataset( self.dst_file, 'w', format=self.nc_file_format )
+
+
+    def output_job_key(self):
+        '''
+        Key of the inputs of this run for resuming a Zarr store: source files 
+        (path, size, modification time), fields and shapes, weights, and output 
+        options. None (no resume) if fields are not read from files
+        '''
+        if (not self.xarray_flag) | (self.fields == []) | (not self.speed_up):
+            return None
+        sources = []
+        for fld in self.fields:
+            source = self.var_array[fld].encoding.get( 'source' )
+            if (source == None) or (not os.path.exists( source )):
+                return None
+            sources.append( file_state( source ) )
+        weights = file_state( self.wgt_file ) if self.engine == 'sparse' else \
+                  [ grid_name( self.src_grid_file ), grid_name( self.dst_grid_file ), self.method_name ]
+        return grid_fingerprint( sources, self.fields, self.field_dst_dim, self.field_dst_shape,
+                                 weights, self.engine, self.datatype, 
+                                 str(self.scale_factor), self.chunk_mb )
+
+
+    # ===== Find or generate weights in the weight file cache =====
+    def lookup_wgt_cache(self):
+        '''
+        Look up the weight file of this grid pair, method, and unmapped action.
+        'auto' uses weights of 'error' (all destination cells mapped) if available,
+        otherwise those of 'ignore'. If missing (or save_wgt_file=True), weights are 
+        generated by ESMF into a temporary file and moved into the cache
+        '''
+        if self.unmapped_action == 'auto':
+            actions = ['error', 'ignore']
+        else:
+            actions = [self.unmapped_action]
+        keys = { action:self.wgt_cache.key( self.src_grid_file, self.dst_grid_file, 
+                                            self.method_name, action ) 
+                 for action in actions }
+        pair_keys = { action:self.wgt_cache.pair_key( self.src_grid_file, self.dst_grid_file, 
+                                                      self.method_name, action ) 
+                      for action in actions }
+
+        if not self.save_wgt_file:
+            for action in actions:
+                self.wgt_file = self.wgt_cache.lookup( keys[action], pair_key=pair_keys[action] )
+                if self.wgt_file != None:
+                    return
+
+        # generate weights (key of the unmapped action actually used)
+        self.save_wgt_file = True
+        self.wgt_file = self.wgt_cache.temp_path( keys[actions[0]] )
+        try:
+            self.setup_ESMF()
+        except:
+            if os.path.exists( self.wgt_file ):
+                os.remove( self.wgt_file )
+            raise
+        info = { 'src_grid_file':grid_name( self.src_grid_file, abspath=True ),
+                 'dst_grid_file':grid_name( self.dst_grid_file, abspath=True ),
+                 'method':self.method_name, 'unmapped_action':self.unmapped_action_used,
+                 'pair_key':pair_keys[self.unmapped_action_used],
+                 'esmf_version':str( getattr( ESMF, '__version__', '' ) ) }
+        self.wgt_file = self.wgt_cache.store( keys[self.unmapped_action_used], 
+                                              self.wgt_file, info=info )
+        self.ESMF_ready = True
+
+
+    def call_ESMF(self):
+        # ESMF grids/meshes/fields are only needed for generating weights
+        # or for regridding with the ESMF engine
+        self.ESMF_ready = False
+        if self.wgt_cache != None:
+            self.lookup_wgt_cache()
+            if self.save_wgt_file_only:
+                return
+        if ( (self.engine == 'ESMF') | (self.save_wgt_file) ) & (not self.ESMF_ready):
+            self.setup_ESMF()
+            if self.save_wgt_file_only:
+                return
+        if self.engine == 'sparse':
+            self.read_weights()
+        if self.conservation_check:
+            self.setup_conservation()
                
         if not self.speed_up:   
             # =======================================================================
@@ -686,232 +2337,28 @@ class Regridding(object):
                 self.Sdate = datetime.datetime.now()
                 print( 'Regridding start: ', self.Sdate )
 
-            self.N_loops = len( self.dst_dim_loop )
             if self.fields == []:
-                if self.N_loops == 0:
-                    if self.src_type == 'FV':
-                        self.src_field.data[...] = np.swapaxes( self.var, 0, 1 )
-                        self.var_dst[:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                    elif self.src_type == 'SE':
-                        self.src_field.data[...] = self.var
-                        self.var_dst[:] = self.regrid( self.src_field, self.dst_field ).data
-                elif self.N_loops == 1:
-                    for ii in np.arange( self.dst_shape_loop[0] ):
-                        if self.src_type == 'FV':
-                            self.src_field.data[...] = np.swapaxes( self.var[ii,:,:], 0, 1)
-                            self.var_dst[ii,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                        elif self.src_type == 'SE':
-                            self.src_field.data[...] = self.var[ii,:]
-                            self.var_dst[ii,:] = self.regrid( self.src_field, self.dst_field ).data
-                elif self.N_loops == 2:
-                    for ii in np.arange( self.dst_shape_loop[0] ):
-                        for jj in np.arange( self.dst_shape_loop[1] ):
-                            if self.src_type == 'FV':
-                                self.src_field.data[...] = np.swapaxes( self.var[ii,jj,:,:], 0, 1)
-                                self.var_dst[ii,jj,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                            elif self.src_type == 'SE':
-                                self.src_field.data[...] = self.var[ii,jj,:]
-                                self.var_dst[ii,jj,:] = self.regrid( self.src_field, self.dst_field ).data
-                else:
-                    raise ValueError( 'Check number of dimensions in the destination field' )
+                self.regrid_slices( self.var, out=self.var_dst, name='regridded_field' )
             else:
-                for fld in self.fields:
-                    if self.N_loops == 0:
-                        if self.src_type == 'FV':
-                            self.src_field.data[...] = np.swapaxes( self.var[fld], 0, 1 )
-                            self.var_dst[fld][:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                        elif self.src_type == 'SE':
-                            self.src_field.data[...] = self.var[fld]
-                            self.var_dst[fld][:] = self.regrid( self.src_field, self.dst_field ).data
-                    elif self.N_loops == 1:
-                        for ii in np.arange( self.dst_shape_loop[0] ):
-                            if self.src_type == 'FV':
-                                self.src_field.data[...] = np.swapaxes( self.var[fld][ii,:,:], 0, 1)
-                                self.var_dst[fld][ii,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                            elif self.src_type == 'SE':
-                                self.src_field.data[...] = self.var[fld][ii,:]
-                                self.var_dst[fld][ii,:] = self.regrid( self.src_field, self.dst_field ).data
-                    elif self.N_loops == 2:
-                        for ii in np.arange( self.dst_shape_loop[0] ):
-                            for jj in np.arange( self.dst_shape_loop[1] ):
-                                if self.src_type == 'FV':
-                                    self.src_field.data[...] = np.swapaxes( self.var[fld][ii,jj,:,:], 0, 1)
-                                    self.var_dst[fld][ii,jj,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                                elif self.src_type == 'SE':
-                                    self.src_field.data[...] = self.var[fld][ii,jj,:]
-                                    self.var_dst[fld][ii,jj,:] = self.regrid( self.src_field, self.dst_field ).data
-                    else:
-                        raise ValueError( 'Check number of dimensions in the destination field' )
-
-            if self.check_timings:
-                self.Edate = datetime.datetime.now()
-                print( 'Regridding end: ', self.Edate )
-                print( time.strftime( "Time spent: %M minutes and %S seconds" , 
-                               time.gmtime( (self.Edate - self.Sdate).seconds ) ) )
-                print( '========================================================================')
-
-            # =========================== END Regridding ============================
-            # =======================================================================
+                # fields with identical dimensions in one batched call
+                for group in self.field_groups:
+                    self.regrid_fields( [ self.var[fld] for fld in group ],
+                                        [ self.var_dst[fld] for fld in group ], names=group )
+            if self.conservation_check:
+                self.report_conservation()
 
             # =======================================================================
             # ==== Check results - total emission for the first and last indices ====
             # =======================================================================
             if self.check_results:
-                xsrc_grid = xr.open_dataset( self.src_grid_file )
-                xdst_grid = xr.open_dataset( self.dst_grid_file )
-                if self.src_type == 'FV':
-                    src_dim_var = { 'lat':xsrc_grid['lat'].values,
-                                    'lon':xsrc_grid['lon'].values }
-                    src_FV_kwds = {'dimension':['lat','lon'],
-                                   'dim_var':src_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }
-                elif self.src_type == 'SE':
-                    src_dim_var = { 'ncol':xsrc_grid.grid_size.values }
-                    src_SE_kwds = {'scrip_file':self.src_grid_file,
-                                   'dimension':['ncol'],
-                                   'dim_var':src_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }                
-                if self.dst_type == 'FV':
-                    dst_dim_var = { 'lat':xdst_grid['lat'].values,
-                                    'lon':xdst_grid['lon'].values }
-                    dst_FV_kwds = {'dimension':['lat','lon'],
-                                   'dim_var':dst_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }
-                elif self.dst_type == 'SE':
-                    dst_dim_var = { 'ncol':xdst_grid.grid_size.values }
-                    dst_SE_kwds = {'scrip_file':self.dst_grid_file,
-                                   'dimension':['ncol'],
-                                   'dim_var':dst_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }
-
                 if self.fields == []:
-                    if self.N_loops == 0:
-                        if self.src_type == 'FV':
-                            SRC_EMIS = Calc_Emis_T( self.var, **src_FV_kwds )
-                        elif self.src_type == 'SE':
-                            SRC_EMIS = Calc_Emis_T( self.var, **src_SE_kwds )
-                        if self.dst_type == 'FV':
-                            DST_EMIS = Calc_Emis_T( self.var_dst, **dst_FV_kwds )
-                        elif self.dst_type == 'SE':
-                            DST_EMIS = Calc_Emis_T( self.var_dst, **dst_SE_kwds )
-                        print( 'Source total for the block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS.emissions_total) ) )
-                        print( 'Destination total for the block [g]: ' + \
-                                "{:.2e}".format(np.around(DST_EMIS.emissions_total) ) )
-                    elif self.N_loops == 1:
-                        if self.src_type == 'FV':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,:,:], **src_FV_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,:,:], **src_FV_kwds )
-                        elif self.src_type == 'SE':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,:], **src_SE_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,:], **src_SE_kwds )
-                        if self.dst_type == 'FV':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,:,:], **dst_FV_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,:,:], **dst_FV_kwds )
-                        elif self.dst_type == 'SE':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,:], **dst_SE_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,:], **dst_SE_kwds )
-                        print( 'Source total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                        print( 'Destination total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                        print( 'Source total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                        print( 'Destination total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )
-                    elif self.N_loops == 2:
-                        if self.src_type == 'FV':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,0,:,:], **src_FV_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,-1,:,:], **src_FV_kwds )
-                        elif self.src_type == 'SE':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,0,:], **src_SE_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,-1,:], **src_SE_kwds )
-                        if self.dst_type == 'FV':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,0,:,:], **dst_FV_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,-1,:,:], **dst_FV_kwds )
-                        elif self.dst_type == 'SE':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,0,:], **dst_SE_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,-1,:], **dst_SE_kwds )
-                        print( 'Source total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                        print( 'Destination total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                        print( 'Source total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                        print( 'Destination total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )
+                    self.check_block_totals( self.var )
                 else:
                     for fld in self.fields:
                         print( '========================================================================')
                         print( 'Fields: ', fld )
                         print( '------------------------------------------------------------------------')
-                        if self.N_loops == 0:
-                            if self.src_type == 'FV':
-                                SRC_EMIS = Calc_Emis_T( self.var[fld], **src_FV_kwds )
-                            elif self.src_type == 'SE':
-                                SRC_EMIS = Calc_Emis_T( self.var[fld], **src_SE_kwds )
-                            if self.dst_type == 'FV':
-                                DST_EMIS = Calc_Emis_T( self.var_dst[fld], **dst_FV_kwds )
-                            elif self.dst_type == 'SE':
-                                DST_EMIS = Calc_Emis_T( self.var_dst[fld], **dst_SE_kwds )
-                            print( 'Source total for the block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS.emissions_total) ) )
-                            print( 'Destination total for the block [g]: ' + \
-                                    "{:.2e}".format(np.around(DST_EMIS.emissions_total) ) )
-                        elif self.N_loops == 1:
-                            if self.src_type == 'FV':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,:,:], **src_FV_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,:,:], **src_FV_kwds )
-                            elif self.src_type == 'SE':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,:], **src_SE_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,:], **src_SE_kwds )
-                            if self.dst_type == 'FV':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[fld][0,:,:], **dst_FV_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[fld][-1,:,:], **dst_FV_kwds )
-                            elif self.dst_type == 'SE':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[fld][0,:], **dst_SE_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[fld][-1,:], **dst_SE_kwds )
-                            print( 'Source total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                            print( 'Destination total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                            print( 'Source total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                            print( 'Destination total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )  
-                        elif self.N_loops == 2:
-                            if self.src_type == 'FV':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,0,:,:], **src_FV_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,-1,:,:], **src_FV_kwds )
-                            elif self.src_type == 'SE':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,0,:], **src_SE_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,-1,:], **src_SE_kwds )
-                            if self.dst_type == 'FV':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[fld][0,0,:,:], **dst_FV_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[fld][-1,-1,:,:], **dst_FV_kwds )
-                            elif self.dst_type == 'SE':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[fld][0,0,:], **dst_SE_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[fld][-1,-1,:], **dst_SE_kwds )
-                            print( 'Source total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                            print( 'Destination total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                            print( 'Source total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                            print( 'Destination total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )
+                        self.check_block_totals( self.var[fld] )
 
             # == END Check results - total emission for the first and last indices ==
             # =======================================================================                        
@@ -925,10 +2372,10 @@ class Regridding(object):
                     print( 'Saving NetCDF file start: ', self.Sdate )
 
                 # load grid decsription files
-                xdst_grid = xr.open_dataset( self.dst_grid_file )
+                xdst_grid = read_grid_info( self.dst_grid_file )
 
                 # Open NetCDF file for writing
-                fid = Dataset( self.dst_file, 'w', format=self.nc_file_format )
+                fid = self.open_output_file()
 
                 # ===== Create dimensions =====
                 for di, dimname in enumerate(self.dst_dim):
@@ -940,7 +2387,7 @@ class Regridding(object):
                         fid.createDimension( dimname, self.dst_shape[di] )
 
                     # write dimension variables
-                    dimvar = fid.createVariable( dimname, 'f8', (dimname,) )
+                    dimvar = create_output_variable( fid, dimname, 'f8', (dimname,), profile=self.output_profile )
                     if dimname in ['lon','lat']:
                         dimvar[:] = np.copy( xdst_grid[dimname].values )
                     elif dimname in ['ncol']:
@@ -962,7 +2409,7 @@ class Regridding(object):
                                 dimvar.setncattr( key, self.var_array[dimname].attrs[key] )
                         else:
                             dimvar.setncattr( 'units', self.tunits )
-                            dimvar.setncattr( 'calendar', 'standard' )
+                            dimvar.setncattr( 'calendar', self.tcalendar )
                     else:
                         for key in list( self.var_array[dimname].attrs.keys() ):
                             dimvar.setncattr( key, self.var_array[dimname].attrs[key] )
@@ -978,31 +2425,33 @@ class Regridding(object):
                 # ===== Create Variables (fields) =====
                 # Add additional fields for SE(-RR) model output
                 if self.dst_type == 'SE':
-                    var_tmp = fid.createVariable( 'lon', 'f8', ('ncol',) )
+                    var_tmp = create_output_variable( fid, 'lon', 'f8', ('ncol',), profile=self.output_profile )
                     var_tmp[:] = xdst_grid.grid_center_lon.values
                     var_tmp.setncattr( 'long_name', 'longitude' )
                     var_tmp.setncattr( 'units', 'degrees_east' )
 
-                    var_tmp = fid.createVariable( 'lat', 'f8', ('ncol',) )
+                    var_tmp = create_output_variable( fid, 'lat', 'f8', ('ncol',), profile=self.output_profile )
                     var_tmp[:] = xdst_grid.grid_center_lat.values
                     var_tmp.setncattr( 'long_name', 'latitude' )
                     var_tmp.setncattr( 'units', 'degrees_north' )
 
                     if 'grid_area' in xdst_grid.data_vars:
-                        var_tmp = fid.createVariable( 'area', 'f8', ('ncol',) )
+                        var_tmp = create_output_variable( fid, 'area', 'f8', ('ncol',), profile=self.output_profile )
                         var_tmp[:] = xdst_grid.grid_area.values
                         var_tmp.setncattr( 'long_name', 'area weights' )
                         var_tmp.setncattr( 'units', 'radians^2' )
 
                     if 'rrfac' in xdst_grid.data_vars:
-                        var_tmp = fid.createVariable( 'rrfac', 'f8', ('ncol',) )
+                        var_tmp = create_output_variable( fid, 'rrfac', 'f8', ('ncol',), profile=self.output_profile )
                         var_tmp[:] = xdst_grid.rrfac.values
                         var_tmp.setncattr( 'units', 'neXX/ne30' )
                     
 
                 # Add regridded fields to NetCDF file
                 if self.fields == []:
-                    var_tmp = fid.createVariable( 'regridded_field', self.datatype, self.dst_dim )
+                    var_tmp = create_output_variable( fid, 'regridded_field', self.datatype, self.dst_dim,
+                                                      self.dst_shape, self.output_profile,
+                                                      block_length=self.block_length( [self.var] ) )
                     var_tmp[:] = self.var_dst * self.scale_factor
                     if self.xarray_flag:
                         for key in list( self.var_array.attrs.keys() ):
@@ -1020,7 +2469,10 @@ class Regridding(object):
                                 var_tmp.setncattr( key, self.var_array.attrs[key] )
                 else:
                     for fld in self.fields:
-                        var_tmp = fid.createVariable( fld, self.datatype, self.dst_dim )
+                        var_tmp = create_output_variable( fid, fld, self.datatype, self.field_dst_dim[fld],
+                                                          self.field_dst_shape[fld], self.output_profile,
+                                                          block_length=self.block_length( [self.var[fld]] ),
+                                                          nfields=len(self.fields) )
                         var_tmp[:] = self.var_dst[fld] * self.scale_factor
                         if self.xarray_flag:
                             for key in list( self.var_array[fld].attrs.keys() ):
@@ -1046,8 +2498,8 @@ class Regridding(object):
                 fid.comment_regridding = '===== Below are created from regridding script ====='
                 fid.regridded_by = 'Regridding_ESMF.py tool using ESMPy (ESMF)'
                 fid.regridding_time = str( datetime.datetime.now() )
-                fid.source_grid = self.src_grid_file
-                fid.destination_grid = self.dst_grid_file
+                fid.source_grid = grid_name( self.src_grid_file )
+                fid.destination_grid = grid_name( self.dst_grid_file )
                 user_name = subprocess.getoutput( 'echo "$USER"')
                 host_name = subprocess.getoutput( 'hostname -f' )
                 fid.regridding_username = user_name + ' on ' + host_name
@@ -1077,10 +2529,10 @@ class Regridding(object):
                 print( 'Saving NetCDF file / regridding start: ', self.SdateA )
 
             # load grid decsription files
-            xdst_grid = xr.open_dataset( self.dst_grid_file )
+            xdst_grid = read_grid_info( self.dst_grid_file )
             
             # Open NetCDF file for writing
-            fid = Dataset( self.dst_file, 'w', format=self.nc_file_format )
+            fid = self.open_output_file()
             
             # ===== Create dimensions =====
             for di, dimname in enumerate(self.dst_dim):
@@ -1092,7 +2544,7 @@ class Regridding(object):
                     fid.createDimension( dimname, self.dst_shape[di] )
 
                 # write dimension variables
-                dimvar = fid.createVariable( dimname, 'f8', (dimname,) )
+                dimvar = create_output_variable( fid, dimname, 'f8', (dimname,), profile=self.output_profile )
                 if dimname in ['lon','lat']:
                     dimvar[:] = np.copy( xdst_grid[dimname].values )
                 elif dimname in ['ncol']:
@@ -1114,7 +2566,7 @@ class Regridding(object):
                             dimvar.setncattr( key, self.var_array[dimname].attrs[key] )
                     else:
                         dimvar.setncattr( 'units', self.tunits )
-                        dimvar.setncattr( 'calendar', 'standard' )
+                        dimvar.setncattr( 'calendar', self.tcalendar )
                 else:
                     for key in list( self.var_array[dimname].attrs.keys() ):
                         dimvar.setncattr( key, self.var_array[dimname].attrs[key] )
@@ -1130,32 +2582,32 @@ class Regridding(object):
             # ===== Create Variables (fields) =====
             # Add additional fields for SE(-RR) model output
             if self.dst_type == 'SE':
-                var_tmp = fid.createVariable( 'lon', 'f8', ('ncol',) )
+                var_tmp = create_output_variable( fid, 'lon', 'f8', ('ncol',), profile=self.output_profile )
                 var_tmp[:] = xdst_grid.grid_center_lon.values
                 var_tmp.setncattr( 'long_name', 'longitude' )
                 var_tmp.setncattr( 'units', 'degrees_east' )
 
-                var_tmp = fid.createVariable( 'lat', 'f8', ('ncol',) )
+                var_tmp = create_output_variable( fid, 'lat', 'f8', ('ncol',), profile=self.output_profile )
                 var_tmp[:] = xdst_grid.grid_center_lat.values
                 var_tmp.setncattr( 'long_name', 'latitude' )
                 var_tmp.setncattr( 'units', 'degrees_north' )
 
                 if 'grid_area' in xdst_grid.data_vars:
-                    var_tmp = fid.createVariable( 'area', 'f8', ('ncol',) )
+                    var_tmp = create_output_variable( fid, 'area', 'f8', ('ncol',), profile=self.output_profile )
                     var_tmp[:] = xdst_grid.grid_area.values
                     var_tmp.setncattr( 'long_name', 'area weights' )
                     var_tmp.setncattr( 'units', 'radians^2' )
 
                 if 'rrfac' in xdst_grid.data_vars:
-                    var_tmp = fid.createVariable( 'rrfac', 'f8', ('ncol',) )
+                    var_tmp = create_output_variable( fid, 'rrfac', 'f8', ('ncol',), profile=self.output_profile )
                     var_tmp[:] = xdst_grid.rrfac.values
                     var_tmp.setncattr( 'units', 'neXX/ne30' )                  
 
             # Additional fields to be saved along with regridded fields
             if self.add_fields != []:
                 for afld in self.add_fields:
-                    var_tmp = fid.createVariable( afld.name, np.dtype( afld.values.flat[0] ).name,
-                                                  afld.dims )
+                    var_tmp = create_output_variable( fid, afld.name, np.dtype( afld.values.flat[0] ).name,
+                                                      afld.dims, profile=self.output_profile )
                     var_tmp[:] = afld.values[:]
                     for key in list( afld.attrs.keys() ):
                         var_tmp.setncattr( key, afld.attrs[key] )
@@ -1168,146 +2620,11 @@ class Regridding(object):
                 self.Sdate = datetime.datetime.now()
                 print( 'Regridding start: ', self.Sdate )
 
-            if self.check_results:
-                xsrc_grid = xr.open_dataset( self.src_grid_file )
-                xdst_grid = xr.open_dataset( self.dst_grid_file )
-                if self.src_type == 'FV':
-                    src_dim_var = { 'lat':xsrc_grid['lat'].values,
-                                    'lon':xsrc_grid['lon'].values }
-                    src_FV_kwds = {'dimension':['lat','lon'],
-                                   'dim_var':src_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }
-                elif self.src_type == 'SE':
-                    src_dim_var = { 'ncol':xsrc_grid.grid_size.values }
-                    src_SE_kwds = {'scrip_file':self.src_grid_file,
-                                   'dimension':['ncol'],
-                                   'dim_var':src_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }                
-                if self.dst_type == 'FV':
-                    dst_dim_var = { 'lat':xdst_grid['lat'].values,
-                                    'lon':xdst_grid['lon'].values }
-                    dst_FV_kwds = {'dimension':['lat','lon'],
-                                   'dim_var':dst_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }
-                elif self.dst_type == 'SE':
-                    dst_dim_var = { 'ncol':xdst_grid.grid_size.values }
-                    dst_SE_kwds = {'scrip_file':self.dst_grid_file,
-                                   'dimension':['ncol'],
-                                   'dim_var':dst_dim_var,
-                                   'unit':self.unit,
-                                   'mw':self.mw,
-                                   'print_results':False,
-                                   'ignore_warning':True }
-
-            self.N_loops = len( self.dst_dim_loop )
             if self.fields == []:
-                # Regridding
-                self.var_dst = np.zeros( self.dst_shape )
-                if self.N_loops == 0:
-                    if self.src_type == 'FV':
-                        self.src_field.data[...] = np.swapaxes( self.var, 0, 1 )
-                    elif self.src_type == 'SE':
-                        self.src_field.data[...] = self.var
-                    if self.dst_type == 'FV':
-                        self.var_dst[:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                    elif self.dst_type == 'SE':
-                        self.var_dst[:] = self.regrid( self.src_field, self.dst_field ).data
-                    
-                    if self.check_results:
-                        if self.src_type == 'FV':
-                            SRC_EMIS = Calc_Emis_T( self.var, **src_FV_kwds )
-                        elif self.src_type == 'SE':
-                            SRC_EMIS = Calc_Emis_T( self.var, **src_SE_kwds )
-                        if self.dst_type == 'FV':
-                            DST_EMIS = Calc_Emis_T( self.var_dst, **dst_FV_kwds )
-                        elif self.dst_type == 'SE':
-                            DST_EMIS = Calc_Emis_T( self.var_dst, **dst_SE_kwds )
-                        print( 'Source total for the block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS.emissions_total) ) )
-                        print( 'Destination total for the block [g]: ' + \
-                                "{:.2e}".format(np.around(DST_EMIS.emissions_total) ) )
-                        
-                elif self.N_loops == 1:
-                    for ii in np.arange( self.dst_shape_loop[0] ):
-                        if self.src_type == 'FV':
-                            self.src_field.data[...] = np.swapaxes( self.var[ii,:,:], 0, 1)
-                        elif self.src_type == 'SE':
-                            self.src_field.data[...] = self.var[ii,:]
-                        if self.dst_type == 'FV':
-                            self.var_dst[ii,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                        elif self.dst_type == 'SE':
-                            self.var_dst[ii,:] = self.regrid( self.src_field, self.dst_field ).data
-                        
-                    if self.check_results:
-                        if self.src_type == 'FV':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,:,:], **src_FV_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,:,:], **src_FV_kwds )
-                        elif self.src_type == 'SE':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,:], **src_SE_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,:], **src_SE_kwds )
-                        if self.dst_type == 'FV':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,:,:], **dst_FV_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,:,:], **dst_FV_kwds )
-                        elif self.dst_type == 'SE':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,:], **dst_SE_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,:], **dst_SE_kwds )
-                        print( 'Source total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                        print( 'Destination total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                        print( 'Source total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                        print( 'Destination total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )
-                        
-                elif self.N_loops == 2:
-                    for ii in np.arange( self.dst_shape_loop[0] ):
-                        for jj in np.arange( self.dst_shape_loop[1] ):
-                            if self.src_type == 'FV':
-                                self.src_field.data[...] = np.swapaxes( self.var[ii,jj,:,:], 0, 1)
-                            elif self.src_type == 'SE':
-                                self.src_field.data[...] = self.var[ii,jj,:]
-                            if self.dst_type == 'FV':
-                                self.var_dst[ii,jj,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                            elif self.dst_type == 'SE':
-                                self.var_dst[ii,jj,:] = self.regrid( self.src_field, self.dst_field ).data
-                    
-                    if self.check_results:
-                        if self.src_type == 'FV':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,0,:,:], **src_FV_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,-1,:,:], **src_FV_kwds )
-                        elif self.src_type == 'SE':
-                            SRC_EMIS_S = Calc_Emis_T( self.var[0,0,:], **src_SE_kwds )
-                            SRC_EMIS_E = Calc_Emis_T( self.var[-1,-1,:], **src_SE_kwds )
-                        if self.dst_type == 'FV':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,0,:,:], **dst_FV_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,-1,:,:], **dst_FV_kwds )
-                        elif self.dst_type == 'SE':
-                            DST_EMIS_S = Calc_Emis_T( self.var_dst[0,0,:], **dst_SE_kwds )
-                            DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,-1,:], **dst_SE_kwds )
-                        print( 'Source total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                        print( 'Destination total for the first block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                        print( 'Source total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                        print( 'Destination total for the last block [g]: ' + \
-                                "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )   
-                else:
-                    raise ValueError( 'Check number of dimensions in the destination field' )               
-                
                 # NetCDF
-                var_tmp = fid.createVariable( 'regridded_field', self.datatype, self.dst_dim )
-                var_tmp[:] = self.var_dst * self.scale_factor
+                var_tmp = create_output_variable( fid, 'regridded_field', self.datatype, self.dst_dim,
+                                                  self.dst_shape, self.output_profile,
+                                                  block_length=self.block_length( [self.var] ) )
                 if self.xarray_flag:
                     for key in list( self.var_array.attrs.keys() ):
                         if key in ['molecular_weight', 'molecular_weights']:
@@ -1322,130 +2639,51 @@ class Regridding(object):
                                 var_tmp.setncattr( key, self.unit )
                         else:
                             var_tmp.setncattr( key, self.var_array.attrs[key] )
-                del self.var_dst
-            else:
-                for fld in self.fields:
-                    if self.check_results:
-                        print( '========================================================================')
-                        print( 'Fields: ', fld )
-                        print( '------------------------------------------------------------------------')
-                        
-                    # Regridding
-                    self.var_dst = np.zeros( self.dst_shape, dtype=self.datatype )
-                    if self.N_loops == 0:
-                        if self.src_type == 'FV':
-                            self.src_field.data[...] = np.swapaxes( self.var[fld], 0, 1 )
-                        elif self.src_type == 'SE':
-                            self.src_field.data[...] = self.var[fld]
-                        if self.dst_type == 'FV':
-                            self.var_dst[:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                        elif self.dst_type == 'SE':
-                            self.var_dst[:] = self.regrid( self.src_field, self.dst_field ).data
-                        
-                        if self.check_results:
-                            if self.src_type == 'FV':
-                                SRC_EMIS = Calc_Emis_T( self.var[fld], **src_FV_kwds )
-                            elif self.src_type == 'SE':
-                                SRC_EMIS = Calc_Emis_T( self.var[fld], **src_SE_kwds )
-                            if self.dst_type == 'FV':
-                                DST_EMIS = Calc_Emis_T( self.var_dst, **dst_FV_kwds )
-                            elif self.dst_type == 'SE':
-                                DST_EMIS = Calc_Emis_T( self.var_dst, **dst_SE_kwds )
-                            print( 'Source total for the block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS.emissions_total) ) )
-                            print( 'Destination total for the block [g]: ' + \
-                                    "{:.2e}".format(np.around(DST_EMIS.emissions_total) ) )
-
-                            
-                    elif self.N_loops == 1:
-                        for ii in np.arange( self.dst_shape_loop[0] ):
-                            if self.src_type == 'FV':
-                                self.src_field.data[...] = np.swapaxes( self.var[fld][ii,:,:], 0, 1)
-                            elif self.src_type == 'SE':
-                                self.src_field.data[...] = self.var[fld][ii,:]
-                            if self.dst_type == 'FV':
-                                self.var_dst[ii,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1 )
-                            elif self.dst_type == 'SE':
-                                self.var_dst[ii,:] = self.regrid( self.src_field, self.dst_field ).data
-                            
-                        if self.check_results:
-                            if self.src_type == 'FV':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,:,:], **src_FV_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,:,:], **src_FV_kwds )
-                            elif self.src_type == 'SE':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,:], **src_SE_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,:], **src_SE_kwds )
-                            if self.dst_type == 'FV':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[0,:,:], **dst_FV_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,:,:], **dst_FV_kwds )
-                            elif self.dst_type == 'SE':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[0,:], **dst_SE_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,:], **dst_SE_kwds )
-                            print( 'Source total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                            print( 'Destination total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                            print( 'Source total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                            print( 'Destination total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )  
-                            
-                    elif self.N_loops == 2:
-                        for ii in np.arange( self.dst_shape_loop[0] ):
-                            for jj in np.arange( self.dst_shape_loop[1] ):
-                                if self.src_type == 'FV':
-                                    self.src_field.data[...] = np.swapaxes( self.var[fld][ii,jj,:,:], 0, 1)
-                                elif self.src_type == 'SE':
-                                    self.src_field.data[...] = self.var[fld][ii,jj,:]
-                                if self.dst_type == 'FV':
-                                    self.var_dst[ii,jj,:] = np.swapaxes( self.regrid( self.src_field, self.dst_field ).data, 0, 1)
-                                elif self.dst_type == 'SE':
-                                    self.var_dst[ii,jj,:] = self.regrid( self.src_field, self.dst_field ).data
-                                
-                        if self.check_results:
-                            if self.src_type == 'FV':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,0,:,:], **src_FV_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,-1,:,:], **src_FV_kwds )
-                            elif self.src_type == 'SE':
-                                SRC_EMIS_S = Calc_Emis_T( self.var[fld][0,0,:], **src_SE_kwds )
-                                SRC_EMIS_E = Calc_Emis_T( self.var[fld][-1,-1,:], **src_SE_kwds )
-                            if self.dst_type == 'FV':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[0,0,:,:], **dst_FV_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,-1,:,:], **dst_FV_kwds )
-                            elif self.dst_type == 'SE':
-                                DST_EMIS_S = Calc_Emis_T( self.var_dst[0,0,:], **dst_SE_kwds )
-                                DST_EMIS_E = Calc_Emis_T( self.var_dst[-1,-1,:], **dst_SE_kwds )
-                            print( 'Source total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_S.emissions_total) ) )
-                            print( 'Destination total for the first block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_S.emissions_total) ) )
-                            print( 'Source total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(SRC_EMIS_E.emissions_total) ) )
-                            print( 'Destination total for the last block [g]: ' + \
-                                    "{:.2e}".format( np.around(DST_EMIS_E.emissions_total) ) )
 
-                    else:
-                        raise ValueError( 'Check number of dimensions in the destination field' )                
+                # Regridding (written to NetCDF block by block)
+                self.regrid_slices( self.var, out=var_tmp, scale_factor=self.scale_factor,
+                                    name='regridded_field' )
+                if self.check_results:
+                    self.check_block_totals( self.var )
+            else:
+                # fields with identical dimensions are regridded together
+                for group in self.field_groups:
                     # NetCDF
-                    var_tmp = fid.createVariable( fld, self.datatype, self.dst_dim )
-                    var_tmp[:] = self.var_dst * self.scale_factor
-                    if self.xarray_flag:
-                        for key in list( self.var_array[fld].attrs.keys() ):
-                            if key in ['molecular_weight', 'molecular_weights']:
-                                if self.mw == None:
-                                    var_tmp.setncattr( key, self.var_array[fld].attrs[key] )
+                    var_tmp_list = []
+                    nblock = self.block_length( [ self.var[fld] for fld in group ] )
+                    for fld in group:
+                        var_tmp = create_output_variable( fid, fld, self.datatype, self.field_dst_dim[fld],
+                                                          self.field_dst_shape[fld], self.output_profile,
+                                                          block_length=nblock, nfields=len(self.fields) )
+                        if self.xarray_flag:
+                            for key in list( self.var_array[fld].attrs.keys() ):
+                                if key in ['molecular_weight', 'molecular_weights']:
+                                    if self.mw == None:
+                                        var_tmp.setncattr( key, self.var_array[fld].attrs[key] )
+                                    else:
+                                        var_tmp.setncattr( key, self.mw )
+                                elif key in ['unit', 'units']:
+                                    if self.unit == None:
+                                        var_tmp.setncattr( key, self.var_array[fld].attrs[key] )
+                                    else:
+                                        var_tmp.setncattr( key, self.unit )
                                 else:
-                                    var_tmp.setncattr( key, self.mw )
-                            elif key in ['unit', 'units']:
-                                if self.unit == None:
                                     var_tmp.setncattr( key, self.var_array[fld].attrs[key] )
-                                else:
-                                    var_tmp.setncattr( key, self.unit )
-                            else:
-                                var_tmp.setncattr( key, self.var_array[fld].attrs[key] )
-                                
-                    del self.var_dst
+                        var_tmp_list.append( var_tmp )
+
+                    # Regridding (written to NetCDF block by block)
+                    self.regrid_fields( [ self.var[fld] for fld in group ], var_tmp_list,
+                                        scale_factor=self.scale_factor, names=group )
+
+                if self.check_results:
+                    for fld in self.fields:
+                        print( '========================================================================')
+                        print( 'Fields: ', fld )
+                        print( '------------------------------------------------------------------------')
+                        self.check_block_totals( self.var[fld] )
                     
+            if self.conservation_check:
+                self.report_conservation()
             # ===== END Create Variables (fields) =====
 
             if self.check_timings:
@@ -1469,8 +2707,8 @@ class Regridding(object):
             fid.regridding_time = str( datetime.datetime.now() )     
             if type(self.var_array) in [ xr.core.dataset.Dataset, dict ]:
                 fid.source_file = source_file_info
-            fid.source_grid = self.src_grid_file
-            fid.destination_grid = self.dst_grid_file
+            fid.source_grid = grid_name( self.src_grid_file )
+            fid.destination_grid = grid_name( self.dst_grid_file )
             user_name = subprocess.getoutput( 'echo "$USER"')
             host_name = subprocess.getoutput( 'hostname -f' )
             fid.regridding_username = user_name + ' on ' + host_name
@@ -1497,76 +2735,36 @@ class Regridding(object):
 
         self.tunits = 'days since 1950-01-01 00:00:00'
         
-        # ===== Retrieve time info =====
+        # ===== Retrieve time info (vectorized for all CF calendars, cached) =====
         if self.xarray_flag:
             if not self.time_decoded:
                 self.time_array = self.var_array['time'].values
                 return
             else:
-                if type( self.var_array['time'].values[0] ) == np.datetime64:
-                    self.time_year = self.var_array['time'].values.astype('datetime64[Y]').astype('int') + 1970
-                    self.time_month = self.var_array['time'].values.astype('datetime64[M]').astype('int') % 12 + 1
-                    self.time_day = ( self.var_array['time'].values.astype('datetime64[D]') - \
-                                      self.var_array['time'].values.astype('datetime64[M]') + 1 ).astype('int')
-
-                elif type( self.var_array['time'].values[0] ) in [cftime._cftime.DatetimeGregorian, 
-                                                               cftime._cftime.DatetimeNoLeap]:
-                    self.time_year = np.zeros( len(self.var_array['time']) ).astype('int')
-                    self.time_month = np.zeros( len(self.var_array['time']) ).astype('int')
-                    self.time_day = np.zeros( len(self.var_array['time']) ).astype('int')
-
-                    for ti, timeraw in enumerate( self.var_array['time'].values ):
-                        self.time_year[ti] = timeraw.year
-                        self.time_month[ti] = timeraw.month
-                        self.time_day[ti] = timeraw.day
-
-                else:
-                    raise ValueError( 'Currently ' + str(type( self.var_array['time'].values[0] )) \
-                                    + ' is not supported! Check type of the time dimension' )
+                # the index object of the dataset is the key of cached time info
+                time_coord = self.var_array['time']
+                time_values = time_coord.indexes['time'] if 'time' in time_coord.indexes \
+                              else time_coord.values
+                time_info = calc_time_info( time_values, 
+                                            calendar=time_coord.encoding.get('calendar') )
+        else:
+            time_info = calc_time_info( self.var_array['time'] )
         
+        self.time_year = time_info['year']
+        self.time_month = time_info['month']
+        self.time_day = time_info['day']
+        
+        # numpy datetime64 is proleptic Gregorian, written as standard for compatibility
+        if time_info['calendar'] == 'proleptic_gregorian':
+            self.tcalendar = 'standard'
         else:
-            if type( self.var_array['time'][0] ) == np.datetime64:
-                self.time_year = self.var_array['time'].astype('datetime64[Y]').astype('int') + 1970
-                self.time_month = self.var_array['time'].astype('datetime64[M]').astype('int') % 12 + 1
-                self.time_day = ( self.var_array['time'].astype('datetime64[D]') - \
-                                  self.var_array['time'].astype('datetime64[M]') + 1 ).astype('int')
-
-            elif type( self.var_array['time'][0] ) in [cftime._cftime.DatetimeGregorian, 
-                                                           cftime._cftime.DatetimeNoLeap]:
-                self.time_year = np.zeros( len(self.var_array['time']) ).astype('int')
-                self.time_month = np.zeros( len(self.var_array['time']) ).astype('int')
-                self.time_day = np.zeros( len(self.var_array['time']) ).astype('int')
-
-                for ti, timeraw in enumerate( self.var_array['time'] ):
-                    self.time_year[ti] = timeraw.year
-                    self.time_month[ti] = timeraw.month
-                    self.time_day[ti] = timeraw.day
-
-            else:
-                raise ValueError( 'Currently ' + str(type( self.var_array['time'].values[0] )) \
-                                + ' is not supported! Check type of the time dimension' )
+            self.tcalendar = time_info['calendar']
         # ===== END Retrieve time info =====
         
         
         # ===== Calculate time array for NetCDF file save =====
-        # Reference day
-        Syear, Smonth, Sday = self.tunits.split(' ')[2].split('-')
-        Sdate = datetime.date( int(Syear), int(Smonth), int(Sday) )
-        
-        # Number of days in this case
-        if self.xarray_flag:
-            self.time_array = np.zeros( len(self.var_array['time'].values) ).astype('f8')
-        else:
-            self.time_array = np.zeros( len(self.var_array['time']) ).astype('f8')
-        
-        if self.xarray_flag:
-            for ti, timeraw in enumerate( self.var_array['time'].values ):
-                self.time_array[ti] = ( datetime.date( self.time_year[ti], self.time_month[ti], 
-                                                       self.time_day[ti] ) - Sdate ).days
-        else:
-            for ti, timeraw in enumerate( self.var_array['time'] ):
-                self.time_array[ti] = ( datetime.date( self.time_year[ti], self.time_month[ti], 
-                                                       self.time_day[ti] ) - Sdate ).days
+        # Number of days since 1950-01-01 in this case
+        self.time_array = time_info['ndays'].astype('f8')
         
         
         if self.verbose:
@@ -1577,3 +2775,263 @@ class Regridding(object):
                                   self.time_day[-1], self.time_array[-1] )
             
         # ===== END Calculate time array for NetCDF file save =====
+
+
+# ========================================================================
+# ==================== Regridding of many files (session) ================
+# ========================================================================
+def regrid_file(filename, dst_file, kwargs):
+    '''
+    Regrid a file with Regridding, used in Regridding_Session. Grid information,
+    weight matrices, and ESMF objects are reused from the caches of the process.
+    Returns the regridded filename (the Regridding object is not returned from 
+    worker processes, as ESMF objects cannot be pickled)
+    '''
+    with xr.open_dataset( filename ) as ds:
+        regrid = Regridding( ds, dst_file=dst_file, **kwargs )
+    return regrid.dst_file
+
+
+def concat_files(filenames, concat_file, dim='time', chunk_mb=256):
+    '''
+    NAME:
+           concat_files
+
+    PURPOSE:
+           Concatenate NetCDF files (e.g., regridded daily files) along a dimension,
+           which is unlimited in the concatenated file. Variables without the dimension
+           and global attributes are copied from the first file, and compression 
+           and chunking of variables are kept. Values are copied in blocks of 
+           chunk_mb, so that memory does not depend on the size of files
+
+    INPUTS:
+           filenames: list of NetCDF files, in the order of concatenation
+           concat_file: concatenated NetCDF filename
+           dim: dimension name to concatenate along
+           chunk_mb: maximum size of a block copied at once [MB]
+    '''
+    first = Dataset( filenames[0], 'r' )
+    first.set_auto_mask( False )
+    if dim not in first.dimensions:
+        first.close()
+        raise ValueError( 'Check ' + filenames[0] + '! "' + dim + '" dimension is not found' )
+    fid = Dataset( concat_file, 'w', format=first.file_format )
+
+    for name, dimension in first.dimensions.items():
+        fid.createDimension( name, None if name == dim else len(dimension) )
+    for name, var in first.variables.items():
+        kwds = {}
+        filters = var.filters() if first.file_format[:7] == 'NETCDF4' else None
+        if filters != None:
+            for compression in ['zlib', 'zstd']:
+                if filters.get( compression, False ):
+                    kwds['compression'] = compression
+                    kwds['complevel'] = filters['complevel']
+                    kwds['shuffle'] = filters['shuffle']
+            if var.chunking() not in [None, 'contiguous']:
+                kwds['chunksizes'] = var.chunking()
+        if '_FillValue' in var.ncattrs():
+            kwds['fill_value'] = var.getncattr( '_FillValue' )
+        new_var = fid.createVariable( name, var.datatype, var.dimensions, **kwds )
+        new_var.setncatts( { key:var.getncattr(key) for key in var.ncattrs() if key != '_FillValue' } )
+        if dim not in var.dimensions:
+            new_var[:] = var[:]
+    fid.setncatts( { key:first.getncattr(key) for key in first.ncattrs() } )
+    first.close()
+
+    offset = 0
+    source_files = []
+    for filename in filenames:
+        part = Dataset( filename, 'r' )
+        part.set_auto_mask( False )
+        if 'source_file' in part.ncattrs():
+            source_files.append( str( part.getncattr( 'source_file' ) ) )
+        nlen = len( part.dimensions[dim] )
+        for name, var in part.variables.items():
+            if dim not in var.dimensions:
+                continue
+            di = var.dimensions.index( dim )
+            slice_size = var.dtype.itemsize * int( np.prod( [ size for si, size in enumerate(var.shape) 
+                                                             if si != di ] ) )
+            nblock = max( 1, int( chunk_mb * 1024**2 // max( 1, slice_size ) ) )
+            for i0 in np.arange( 0, nlen, nblock ):
+                i1 = min( i0 + nblock, nlen )
+                index = [ slice(None) ] * len(var.dimensions)
+                index[di] = slice( i0, i1 )
+                values = var[tuple(index)]
+                index[di] = slice( offset + i0, offset + i1 )
+                fid.variables[name][tuple(index)] = values
+        offset += nlen
+        part.close()
+    if source_files != []:
+        fid.setncattr( 'source_file', ', '.join( source_files ) )
+    fid.close()
+
+
+class Regridding_Session(object):
+    '''
+    NAME:
+           Regridding_Session
+
+    PURPOSE:
+           Regrid many files (e.g., a year of daily emission files) with the same
+           source/destination grids and weights. Weights are looked up or generated 
+           once with the first file, and the other files are distributed over 
+           a process pool. Destination grid information, weight matrices, 
+           and ESMF grids/fields (engine='ESMF') are kept in per-process caches,
+           so that each process sets them up once for all of its files.
+           Results are saved in one file per input file, or concatenated along time
+
+    INPUTS:
+           filenames: list of files, or a file pattern (e.g., '/path/qfed2.emis_co.*.nc4')
+           output_dir: directory of regridded files (same filenames as input files)
+           dst_files: list of regridded filenames (instead of output_dir)
+           concat_file: if provided, regridded files are concatenated along time into 
+                        this NetCDF file (in the order of filenames), and per-file 
+                        results in concat_file + '.parts' are removed afterwards
+           nprocs: number of processes (default: number of CPUs, up to number of files)
+           keep_files: if True, keep per-file results of concat_file
+           verbose: Display detailed information on what is being done
+           kwargs: keywords of Regridding for all files, e.g., src_grid_file, 
+                   dst_grid_file, wgt_file or wgt_cache_dir, method, fields, datatype,
+                   output_profile (creation_date=False and check_timings=False by default)
+                   conservation_file is written for each file, with the name of 
+                   the regridded file added, e.g., conservation_<regridded file>.csv
+
+    OUTPUTS:
+           dst_files: regridded files of input files
+           failed: dictionary of files failed in regridding with error messages
+    '''
+
+    def __init__(self, filenames, output_dir=None, dst_files=None, concat_file=None, 
+                 nprocs=None, keep_files=False, verbose=False, **kwargs):
+
+        # ========================================================================
+        # ===== Error check and pass input values to class-accessible values =====
+        # ========================================================================
+        if type(filenames) == str:
+            filenames = sorted( glob.glob( filenames ) )
+        if len(filenames) == 0:
+            raise ValueError( 'No files are found!' )
+        self.filenames = [ os.path.abspath( filename ) for filename in filenames ]
+
+        if concat_file != None:
+            if kwargs.get( 'output_backend', 'netcdf' ).lower() != 'netcdf':
+                raise ValueError( 'concat_file is only supported for output_backend="netcdf"' )
+            part_dir = concat_file + '.parts'
+            os.makedirs( part_dir, exist_ok=True )
+            self.dst_files = [ os.path.join( part_dir, str(fi).zfill(6) + '_' + os.path.basename( filename ) )
+                               for fi, filename in enumerate( self.filenames ) ]
+        elif dst_files != None:
+            if len(dst_files) != len(self.filenames):
+                raise ValueError( 'The number of dst_files must be the same as the number of files' )
+            self.dst_files = list( dst_files )
+        elif output_dir != None:
+            os.makedirs( output_dir, exist_ok=True )
+            self.dst_files = [ os.path.join( output_dir, os.path.basename( filename ) )
+                               for filename in self.filenames ]
+        else:
+            raise ValueError( '"output_dir", "dst_files", or "concat_file" must be provided' )
+
+        if nprocs == None:
+            self.nprocs = min( os.cpu_count(), len(self.filenames) )
+        else:
+            self.nprocs = nprocs
+
+        self.concat_file = concat_file
+        self.keep_files = keep_files
+        self.verbose = verbose
+
+        # keywords for Regridding of each file
+        self.kwargs = dict( kwargs )
+        self.kwargs.setdefault( 'creation_date', False )
+        self.kwargs.setdefault( 'check_timings', False )
+        self.kwargs.setdefault( 'verbose', verbose )
+        self.kwargs['save_results'] = True
+        # === END Error check and pass input values to class-accessible values ===
+        # ========================================================================
+
+        self.regrid_files()
+
+        if self.concat_file != None:
+            self.concat()
+
+
+    # ===== Keywords of Regridding for a file =====
+    def file_kwargs(self, kwargs, dst_file):
+        if kwargs.get( 'conservation_file' ) == None:
+            return kwargs
+        # a conservation table for each file
+        conservation_file = os.path.splitext( kwargs['conservation_file'] )[0] + '_' + \
+                            os.path.splitext( os.path.basename( dst_file ) )[0] + '.csv'
+        return dict( kwargs, conservation_file=conservation_file )
+
+
+    # ===== Regrid the first file here, then the other files in a process pool =====
+    def regrid_files(self):
+        self.failed = {}
+
+        # weights are looked up (or generated) once with the first file
+        with xr.open_dataset( self.filenames[0] ) as ds:
+            regrid = Regridding( ds, dst_file=self.dst_files[0], 
+                                 **self.file_kwargs( self.kwargs, self.dst_files[0] ) )
+        self.dst_files[0] = regrid.dst_file
+        if self.verbose:
+            print( 'Finished: ' + self.filenames[0] )
+        kwargs = dict( self.kwargs, wgt_file=regrid.wgt_file, wgt_cache_dir=None, 
+                       save_wgt_file=False )
+        files = list( enumerate( zip( self.filenames, self.dst_files ) ) )[1:]
+        if len(files) == 0:
+            return
+
+        if self.nprocs > 1:
+            # ESMF (MPI) state cannot be forked: new processes if ESMF was used here
+            mp_context = multiprocessing.get_context( 'spawn' ) if hasattr( regrid, 'src_grid' ) \
+                         else None
+            with ProcessPoolExecutor( max_workers=self.nprocs, mp_context=mp_context ) as executor:
+                futures = { executor.submit( regrid_file, filename, dst_file, 
+                                             self.file_kwargs( kwargs, dst_file ) ):fi
+                            for fi, ( filename, dst_file ) in files }
+                for future in as_completed( futures ):
+                    self.add_result( futures[future], future )
+        else:
+            for fi, ( filename, dst_file ) in files:
+                try:
+                    self.dst_files[fi] = regrid_file( filename, dst_file, 
+                                                      self.file_kwargs( kwargs, dst_file ) )
+                except Exception as error:
+                    self.failed[filename] = repr( error )
+                    continue
+                if self.verbose:
+                    print( 'Finished: ' + filename )
+
+        if len(self.failed) > 0:
+            print( 'Warning: regridding failed for ' + str(len(self.failed)) + ' files' )
+            for filename in self.failed.keys():
+                print( filename + ': ' + self.failed[filename] )
+
+
+    def add_result(self, fi, future):
+        filename = self.filenames[fi]
+        try:
+            self.dst_files[fi] = future.result()
+        except Exception as error:
+            self.failed[filename] = repr( error )
+            return
+        if self.verbose:
+            print( 'Finished: ' + filename )
+
+
+    # ===== Concatenate per-file results along time =====
+    def concat(self):
+        if len(self.failed) > 0:
+            raise ValueError( 'Regridding failed for ' + str(len(self.failed)) + ' files, ' + \
+                              'results are not concatenated\n' + \
+                              'Per-file results are in ' + self.concat_file + '.parts' )
+        concat_files( self.dst_files, self.concat_file, dim='time' )
+        if self.verbose:
+            print( 'Concatenated file: ' + self.concat_file )
+        if not self.keep_files:
+            shutil.rmtree( self.concat_file + '.parts' )
+# ================== END Regridding of many files (session) ==============
+# ========================================================================
@@ -37,6 +37,8 @@ MODIFICATION HISTORY:
     - New capability for shifting center longitude in the plot
     Duseong Jo, 10, DEC, 2021: VERSION 1.85
     - Add more options to deal with lon/lat lines
+    vivaldi_a contributors, 17, OCT, 2026: VERSION 1.90
+    - SE cells in lon_range/lat_range found with the spatial index of the SCRIP file
 '''
 
 ### Module import ###
@@ -51,6 +53,13 @@ from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
 from matplotlib.collections import PolyCollection
 import matplotlib
 from matplotlib import ticker
+try:
+    from vivaldi_a.analysis.Calc_Emis import get_SCRIP_index
+except ImportError:
+    try:
+        from Calc_Emis import get_SCRIP_index
+    except ImportError:
+        get_SCRIP_index = None
 
 class Plot_2D(object):
     '''
@@ -67,6 +76,8 @@ class Plot_2D(object):
            lon_range: 2-elements list with longitude ranges to plot
            lat_range: 2-elements list with latitude ranges to plot
            scrip_file: a scrip filename for regional refinement model output 
+           scrip_index_dir: directory to save/read the spatial index of the scrip file,
+                            so that it is built only once per grid
            ax: Parent axes from which space for the plot will be drawn
            cmap: colormap for plot
            projection: map projection by cartopy.crs
@@ -128,7 +139,7 @@ class Plot_2D(object):
                  colorticks=None, colorlabels=None, pretty_tick=True, nticks=None, 
                  cmax=None, cmin=None, title="", title_size=20, title_bold=False,
                  unit="", unit_size=15, unit_bold=False, unit_italic=True, unit_offset=[0.0,0.0],
-                 verbose=False):
+                 scrip_index_dir=None, verbose=False):
         
         # ========================================================================
         # ===== Error check and pass input values to class-accessible values =====
@@ -254,6 +265,7 @@ class Plot_2D(object):
         
         # Pass input keywords
         self.scrip_file = scrip_file
+        self.scrip_index_dir = scrip_index_dir
         self.font_family = font_family
         self.projection = projection
         self.center_180 = center_180
@@ -454,10 +466,23 @@ class Plot_2D(object):
             self.var_slice = self.var[ self.lat_inds[0]:self.lat_inds[-1]+1,
                                        self.lon_inds[0]:self.lon_inds[-1]+1 ]
         elif self.model_type == 'SE':
-            self.ncol_inds = np.where( ( self.center_lon >= self.lon_range[0] ) & \
-                                       ( self.center_lon <= self.lon_range[-1] ) & \
-                                       ( self.center_lat >= self.lat_range[0] ) & \
-                                       ( self.center_lat <= self.lat_range[-1] ) )[0]
+            if get_SCRIP_index != None:
+                # candidate cells from the spatial index of the scrip file,
+                # longitudes of the index are not shifted for center_180
+                lon_shift = 180. if self.center_180 else 0.
+                scrip_index = get_SCRIP_index( scrip_file=self.scrip_file, 
+                                               cache_dir=self.scrip_index_dir,
+                                               verbose=self.verbose )
+                cand_inds = scrip_index.search( [ self.lon_range[0] + lon_shift,
+                                                  self.lon_range[-1] + lon_shift ], 
+                                                self.lat_range )
+            else:
+                cand_inds = np.arange( len(self.center_lon) )
+            self.ncol_inds = cand_inds[ np.where( \
+                                        ( self.center_lon[cand_inds] >= self.lon_range[0] ) & \
+                                        ( self.center_lon[cand_inds] <= self.lon_range[-1] ) & \
+                                        ( self.center_lat[cand_inds] >= self.lat_range[0] ) & \
+                                        ( self.center_lat[cand_inds] <= self.lat_range[-1] ) )[0] ]
             self.corner_lon_slice = self.corner_lon[ self.ncol_inds, : ]
             self.corner_lat_slice = self.corner_lat[ self.ncol_inds, : ]
             self.center_lon_slice = self.center_lon[ self.ncol_inds ]